@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Import time of the simulator modules against a budget.
+
+Every module is imported in a fresh interpreter, after NumPy (which all
+of them need), so only its own cost is measured. The numerical modules
+must not pull in matplotlib, PyQt5 or Numba, which are only imported
+on first use (plotting, the GUI, the compiled engine); SciPy is allowed
+where the sparse matrices are part of the model. Exits with status 1
+when a module goes over its budget or loads a forbidden package, so it
+can guard worker start-up time in CI.
+
+    python benchmarks/bench_import.py
+"""
+
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Packages that only plotting, the GUI or the compiled engine may load
+FORBIDDEN = ['matplotlib', 'PyQt5', 'numba']
+
+# Modules and their budget in seconds on top of NumPy, (module, budget, SciPy allowed)
+MODULES = [('covid19_rng', 0.02, False),
+           ('covid19_recorder', 0.02, False),
+           ('covid19_jit', 0.02, False),
+           ('covid19_model', 0.02, False),
+           ('covid19_simulator', 0.02, False),
+           ('covid19_simulator_v2', 0.05, False),
+           ('covid19_profile', 0.02, False),
+           ('covid19_chain', 0.05, False),
+           ('covid19_tauleap', 0.05, False),
+           ('covid19_ensemble', 0.05, False),
+           ('covid19_sweep', 0.1, False),
+           ('covid19_cli', 0.1, False),
+           ('covid19_meanfield', 0.5, True),
+           ('covid19_network', 0.5, True),
+           ('covid19_parallel', 0.5, True)]
+
+SCRIPT = '''
+import sys, time
+import numpy
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(' '.join(sorted(set(name.split('.')[0] for name in sys.modules))))
+'''
+
+
+def time_import(module, repeat=5):
+    # best own import time of a module and the top-level packages it loaded
+    best = float('inf')
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)], cwd=ROOT,
+                             check=True, capture_output=True, text=True).stdout.split('\n')
+        best = min(best, float(out[0]))
+    return best, set(out[1].split())
+
+
+def main():
+    failed = 0
+    print('module                 import(ms)  budget(ms)  loaded')
+    for module, budget, scipy in MODULES:
+        seconds, packages = time_import(module)
+        forbidden = [name for name in FORBIDDEN + ([] if scipy else ['scipy']) if name in packages]
+        ok = seconds <= budget and not forbidden
+        failed += not ok
+        print('{:<22} {:<11.1f} {:<11.0f} {}'.format(module, seconds * 1e3, budget * 1e3,
+                                                     ', '.join(forbidden) if forbidden else 'ok'))
+
+    if failed:
+        print('[ERROR] {} modules over their import budget'.format(failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Setup time of a Node against the sampling time.
+
+Times create_states, indexes, create_transitions and vectorize for
+sampling times from one hour down to one minute; the number of states
+and transitions grows as 1/dt, so should the setup time. The cache of
+compiled models is cleared before every repeat, the last column is the
+whole setup again once the model is cached (a sweep over rates).
+
+    python benchmarks/bench_setup.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import covid19_model
+from covid19_simulator_v2 import Node
+
+
+# Sampling times in steps per day
+STEPS_PER_DAY = [24, 48, 96, 288, 1440]
+
+
+def time_setup(steps_per_day, repeat=3):
+    # best time of every setup stage over a few repeats
+    best = {}
+    cached = float('inf')
+    for _ in range(repeat):
+        covid19_model.CACHE.clear()
+        node = Node()
+        node.set_params({'param_dt': 1 / steps_per_day})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for stage in ['create_states', 'indexes', 'create_transitions', 'vectorize']:
+                start = time.perf_counter()
+                getattr(node, stage)()
+                best[stage] = min(best.get(stage, float('inf')), time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for stage in ['create_states', 'indexes', 'create_transitions', 'vectorize']:
+                getattr(node, stage)()
+            cached = min(cached, time.perf_counter() - start)
+
+    return node, best, cached
+
+
+def main():
+    print('steps/day  states  transitions  states(ms)  indexes(ms)  transitions(ms)  vectorize(ms)  total(ms)  cached(ms)')
+    for steps_per_day in STEPS_PER_DAY:
+        node, best, cached = time_setup(steps_per_day)
+        print('{:<10} {:<7} {:<12} {:<11.2f} {:<12.2f} {:<16.2f} {:<14.2f} {:<10.2f} {:.2f}'.format(
+            steps_per_day, node.param_num_states, len(node.source_ind),
+            best['create_states'] * 1e3, best['indexes'] * 1e3,
+            best['create_transitions'] * 1e3, best['vectorize'] * 1e3,
+            sum(best.values()) * 1e3, cached * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wall time of the simulator engines against a stored baseline.
+
+Every benchmark is timed for every engine of Node.param_engine it
+applies to (legacy, vectorized, compiled):
+
+- setup[N]: create_states to vectorize at N steps per day, with the
+  cache of compiled models cleared;
+- run: one 365-day run of the default scenario;
+- ensemble: 100 replicas, advanced in lockstep by covid19_ensemble.py
+  for the vectorized engine and run one after the other as Node runs
+  with param_replica = r by the others;
+- sweep: a grid of scenarios of covid19_sweep.py, serially;
+- network[N]: a metapopulation of N nodes of covid19_network.py, which
+  only runs on the vectorized engine.
+
+Every benchmark is repeated REPEAT times, or until it took over
+MAX_SECONDS, and the best and the median time are kept. The compiled
+engine is warmed up first, so Numba compilation is not counted. The
+times are compared with the baseline file: a benchmark is flagged when
+both its best and its median time are slower than the ones of the
+baseline by more than the threshold, and by more than MIN_DELTA
+seconds, so that the noise of a single repeat or of a very short
+benchmark does not flag it; the script then exits with status 1. The
+baseline records the machine, Python, NumPy and Numba versions, and a
+baseline saved with other ones is not compared against. Save a
+baseline on the machine the suite runs on:
+
+    python benchmarks/bench_suite.py --save
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --engines vectorized compiled --benchmarks run sweep
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import covid19_model
+from covid19_ensemble import Ensemble
+from covid19_network import Network, gravity_mobility
+from covid19_recorder import AggregateRecorder
+from covid19_simulator_v2 import Node
+from covid19_sweep import Sweep, make_grid
+
+
+# Engines of Node.param_engine compared by the suite
+ENGINES = ['legacy', 'vectorized', 'compiled']
+
+# Baseline file of the suite
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Sampling times of the setup in steps per day
+STEPS_PER_DAY = [24, 96, 288]
+
+# Length of the single run in days
+RUN_LEN = 365
+
+# Number of replicas and length of the ensemble in days
+NUM_REPLICAS = 100
+ENSEMBLE_LEN = 10
+
+# Scenarios and length of the sweep in days
+SWEEP_GRID = {'param_beta_exp': [0.1, 0.2], 'param_qr': [0.0, 0.05]}
+SWEEP_LEN = 60
+
+# Number of nodes and length of the metapopulation in days
+NETWORK_NODES = [10, 30, 100, 300]
+NETWORK_LEN = 10
+
+# Repeats of every benchmark, and time after which it is not repeated
+REPEAT = 5
+MAX_SECONDS = 30.0
+
+# Slowdown in seconds below which a benchmark is never flagged
+MIN_DELTA = 0.01
+
+
+def make_node(engine, **params):
+    node = Node()
+    node.param_vis_on = 0
+    node.param_disp_interval = 0
+    node.param_engine = engine
+    node.set_params(params)
+    return node
+
+
+def build(node):
+    with contextlib.redirect_stdout(io.StringIO()):
+        node.create_states()
+        node.indexes()
+        node.create_transitions()
+        node.vectorize()
+    return node
+
+
+def bench_setup(engine, steps_per_day):
+    covid19_model.CACHE.clear()
+    node = make_node(engine, param_dt=1 / steps_per_day)
+    start = time.perf_counter()
+    build(node)
+    return time.perf_counter() - start
+
+
+def bench_run(engine):
+    node = build(make_node(engine, param_sim_len=RUN_LEN))
+    start = time.perf_counter()
+    node.run(AggregateRecorder())
+    return time.perf_counter() - start
+
+
+def bench_ensemble(engine):
+    if engine == 'vectorized':
+        ensemble = Ensemble(make_node(engine, param_sim_len=ENSEMBLE_LEN), num_replicas=NUM_REPLICAS)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ensemble.create()
+        start = time.perf_counter()
+        ensemble.run()
+        return time.perf_counter() - start
+
+    # the other engines run the same replicas one by one
+    elapsed = 0.0
+    for replica in range(NUM_REPLICAS):
+        node = build(make_node(engine, param_sim_len=ENSEMBLE_LEN, param_replica=replica))
+        start = time.perf_counter()
+        node.run(AggregateRecorder())
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def bench_sweep(engine):
+    scenarios = make_grid(param_sim_len=[SWEEP_LEN], param_engine=[engine], **SWEEP_GRID)
+    sweep = Sweep(scenarios)
+    sweep.param_serial = True
+    sweep.progress = lambda done, total: None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sweep.run()
+    return time.perf_counter() - start
+
+
+def bench_network(engine, num_nodes):
+    # cities of the example of covid19_network.py
+    rng = np.random.default_rng(1)
+    populations = np.round(rng.lognormal(11, 1, num_nodes))
+    coords = rng.uniform(0, 1, (num_nodes, 2))
+
+    node = make_node(engine, param_sim_len=NETWORK_LEN)
+    network = Network(node, num_nodes, gravity_mobility(populations, coords))
+    network.param_init_susceptible = populations
+    network.param_init_exposed = np.where(np.arange(num_nodes) == np.argmax(populations), 10, 0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        network.create()
+    start = time.perf_counter()
+    network.run()
+    return time.perf_counter() - start
+
+
+# Benchmarks as (name, function, arguments, engines)
+BENCHMARKS = ([('setup[{}]'.format(steps), bench_setup, (steps,), ENGINES) for steps in STEPS_PER_DAY]
+              + [('run', bench_run, (), ENGINES),
+                 ('ensemble', bench_ensemble, (), ENGINES),
+                 ('sweep', bench_sweep, (), ENGINES)]
+              + [('network[{}]'.format(num), bench_network, (num,), ['vectorized']) for num in NETWORK_NODES])
+
+
+def timing(func, args, repeat=REPEAT):
+    # best and median time of a few repeats, a slow benchmark is run once
+    times = []
+    for _ in range(repeat):
+        times.append(func(*args))
+        if sum(times) > MAX_SECONDS:
+            break
+    return {'best': min(times), 'median': float(np.median(times))}
+
+
+def warm_up():
+    # compile the kernels of the compiled engine once
+    build(make_node('compiled', param_sim_len=1)).run(AggregateRecorder())
+
+
+def machine():
+    # the compiled engine runs as plain Python without Numba
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'numba': numba_version}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(times, base, threshold):
+    # change of the best time against the baseline and its status, a
+    # change counts when the best and the median time agree on it
+    if base is None:
+        return '-', 'new'
+    changes = [times[name] / base[name] - 1 for name in ('best', 'median')]
+    delta = min(times[name] - base[name] for name in ('best', 'median'))
+    if min(changes) > threshold and delta > MIN_DELTA:
+        status = 'SLOWER'
+    elif max(changes) < -threshold and -delta > MIN_DELTA:
+        status = 'faster'
+    else:
+        status = 'ok'
+    return '{:+.0f}'.format(100 * changes[0]), status
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Time the simulator engines against a stored baseline.')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES,
+                        help='engines to time (default: all)')
+    parser.add_argument('--benchmarks', nargs='+', default=None, metavar='NAME',
+                        help='benchmarks to time, e.g. run or setup (default: all)')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline file (default: benchmarks/baseline.json)')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown that is flagged (default: %(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='write the times into the baseline file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = load_baseline(args.baseline)
+    same_machine = baseline is not None and baseline['machine'] == machine()
+    if baseline is not None and not same_machine:
+        print('[WARNING] The baseline was saved on another machine or with other versions, '
+              'it is not compared against: {}'.format(baseline['machine']))
+    base_times = baseline['times'] if same_machine else {}
+
+    if 'compiled' in args.engines:
+        warm_up()
+
+    times = {}
+    slower = 0
+    print('benchmark     engine      time(s)   baseline(s)  change(%)  status')
+    for name, func, func_args, engines in BENCHMARKS:
+        if args.benchmarks is not None and name.split('[')[0] not in args.benchmarks and name not in args.benchmarks:
+            continue
+        for engine in engines:
+            if engine not in args.engines:
+                continue
+            key = '{}/{}'.format(name, engine)
+            times[key] = timing(func, (engine,) + func_args)
+            base = base_times.get(key)
+            change, status = compare(times[key], base, args.threshold)
+            slower += status == 'SLOWER'
+            print('{:<13} {:<11} {:<9.4f} {:<12} {:<10} {}'.format(
+                name, engine, times[key]['best'], '-' if base is None else '{:.4f}'.format(base['best']),
+                change, status))
+
+    if args.save:
+        # benchmarks not run this time keep their baseline of the same machine
+        kept = base_times
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': machine(), 'times': dict(kept, **times)}, f, indent=1, sort_keys=True)
+        print('[INFO] Baseline of {} benchmarks was written to {}'.format(len(times), args.baseline))
+
+    if slower:
+        print('[ERROR] {} benchmarks slower than the baseline by over {:.0%}'.format(slower, args.threshold))
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
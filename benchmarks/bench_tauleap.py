@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Accuracy and wall time of the adaptive tau-leap engine against the
+fixed-step vectorized engine it approximates.
+
+For every sampling time, a few replicas of the default scenario are run
+with fixed steps and with leaps of several tolerances; the mean peak of
+Infected, its day and the final number of Dead are compared with the
+fixed-step ones. A peak or a final Dead off by more than MAX_ERROR, or
+a day of the peak off by more than MAX_DAYS, is flagged, and the script
+then exits with status 1.
+
+    python benchmarks/bench_tauleap.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_recorder import AggregateRecorder
+from covid19_simulator_v2 import Node
+from covid19_tauleap import TauLeapNode
+
+
+# Sampling times in steps per day
+STEPS_PER_DAY = [24, 96]
+
+# Tolerances of the tau-leap engine
+TOLERANCES = [0.01, 0.03, 0.1]
+
+# Number of replicas and length of every run in days
+NUM_REPLICAS = 3
+SIM_LEN = 300
+
+# Largest relative error of the mean peak of Infected and of the mean
+# final Dead, a few times the spread of the mean of NUM_REPLICAS runs
+MAX_ERROR = 0.05
+
+# Largest difference of the mean day of the peak of Infected
+MAX_DAYS = 3
+
+
+def make_node(steps_per_day, seed):
+    node = Node()
+    node.param_disp_interval = 0
+    node.set_params({'param_dt': 1 / steps_per_day, 'param_sim_len': SIM_LEN, 'param_replica': seed})
+    return node
+
+
+def run_fixed(steps_per_day, seed):
+    node = make_node(steps_per_day, seed)
+    node.param_engine = 'vectorized'
+    with contextlib.redirect_stdout(io.StringIO()):
+        node.create_states()
+        node.indexes()
+        node.create_transitions()
+        node.vectorize()
+
+    start = time.perf_counter()
+    recorder = node.run(AggregateRecorder())
+    elapsed = time.perf_counter() - start
+
+    # same daily grid as the tau-leap engine
+    daily = slice(None, None, steps_per_day)
+    return elapsed, recorder.time[daily], recorder['Infected'][daily], recorder['Dead'][daily]
+
+
+def run_tauleap(steps_per_day, seed, eps):
+    tau_node = TauLeapNode(make_node(steps_per_day, seed))
+    tau_node.param_eps = eps
+    with contextlib.redirect_stdout(io.StringIO()):
+        tau_node.create_chains()
+
+    start = time.perf_counter()
+    results = tau_node.run()
+    elapsed = time.perf_counter() - start
+
+    return elapsed, results['time'], results['Infected'], results['Dead']
+
+
+def summary(runs):
+    # mean wall time, peak of Infected, day of the peak and final Dead
+    return np.array([[elapsed, state_inf.max(), time_arr[state_inf.argmax()], state_dea[-1]]
+                     for elapsed, time_arr, state_inf, state_dea in runs]).mean(axis=0)
+
+
+def main():
+    flagged = 0
+    print('steps/day  engine      time(s)  peak_inf  peak_err(%)  peak_day  dead     dead_err(%)  status')
+    for steps_per_day in STEPS_PER_DAY:
+        ref = summary([run_fixed(steps_per_day, seed) for seed in range(NUM_REPLICAS)])
+        print('{:<10} {:<11} {:<8.2f} {:<9.0f} {:<12} {:<9.1f} {:<8.0f} {}'.format(
+            steps_per_day, 'fixed', ref[0], ref[1], '-', ref[2], ref[3], '-'))
+
+        for eps in TOLERANCES:
+            res = summary([run_tauleap(steps_per_day, seed, eps) for seed in range(NUM_REPLICAS)])
+            peak_err = res[1] / ref[1] - 1
+            dead_err = res[3] / ref[3] - 1
+            ok = max(abs(peak_err), abs(dead_err)) <= MAX_ERROR and abs(res[2] - ref[2]) <= MAX_DAYS
+            status = 'ok' if ok else 'OFF'
+            flagged += status == 'OFF'
+            print('{:<10} {:<11} {:<8.2f} {:<9.0f} {:<12.1f} {:<9.1f} {:<8.0f} {:<12.1f} {}'.format(
+                steps_per_day, 'eps={}'.format(eps), res[0], res[1], 100 * peak_err,
+                res[2], res[3], 100 * dead_err, status))
+
+    if flagged:
+        print('[ERROR] {} runs off the fixed steps by over {:.0%} or {} days'.format(flagged, MAX_ERROR, MAX_DAYS))
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact chain engine of a Node.
+
+The transitions of the spec are not expanded into one row per hop: every
+group of covid19_model.py (Transition 3 out of every state, the shift of
+a stage chain, the side exits of a chain) works on slices of the state
+vector. The expected values are the ones of Node.vec_expval in the order
+of the transition table and are sampled in one call, and the groups are
+applied one after another with the clamping of Node.apply_stage, so a
+run draws the same numbers and gives the same states as the legacy,
+vectorized and compiled engines, without building the transition table.
+"""
+
+import numpy as np
+
+import covid19_model
+import covid19_rng
+from covid19_recorder import AggregateRecorder
+from covid19_simulator_v2 import Node
+
+
+def chain_names(n_vac, n_exp, n_inf):
+    # state names and types in the layout of Node.create_states
+    states_name = ['Birth', 'Susceptible']
+    states_type = ['Birth', 'Susceptible']
+
+    for name, size, state_type in [('Vaccinated', n_vac, 'Susceptible'),
+                                   ('Exposed', n_exp, 'Exposed'),
+                                   ('Quarantined', n_exp, 'Exposed'),
+                                   ('Infected', n_inf, 'Infected'),
+                                   ('Isolated', n_inf, 'Infected'),
+                                   ('Severe_Infected', n_inf, 'Infected')]:
+        states_name += ['{}_{}'.format(name, ind + 1) for ind in range(size)]
+        states_type += [state_type] * size
+
+    states_name += ['Vaccination_Immunized', 'Maternally_Immunized', 'Recovery_Immunized', 'Dead']
+    states_type += ['Immunized', 'Immunized', 'Immunized', 'Dead']
+
+    return states_name, states_type
+
+
+class ChainNode:
+    def __init__(self, node):
+        # Node holding the parameters and the sampler
+        self.node = node
+        self.states_x = []
+
+
+    def __getattr__(self, name):
+        # parameters and initial values are the ones of the node
+        if name.startswith(('param_', 'init_')):
+            return getattr(self.node, name)
+        raise AttributeError(name)
+
+
+    @property
+    def states_name(self):
+        return chain_names(self.param_n_vac, self.param_n_exp, self.param_n_inf)[0]
+
+
+    @property
+    def states_type(self):
+        return chain_names(self.param_n_vac, self.param_n_exp, self.param_n_inf)[1]
+
+
+    def create_chains(self):
+        # the chains follow the layout of the v2 model
+        if self.param_model != 'v2':
+            raise ValueError('The chain engine only supports the v2 model, not {}'.format(self.param_model))
+        self.spec = covid19_model.SPECS['v2']
+
+        n_vac = self.param_n_vac
+        n_exp = self.param_n_exp
+        n_inf = self.param_n_inf
+
+        # slices of the chains in the state vector
+        start = 2
+        self.chains = {}
+        for name, size in [('Vaccinated', n_vac), ('Exposed', n_exp), ('Quarantined', n_exp),
+                           ('Infected', n_inf), ('Isolated', n_inf), ('Severe_Infected', n_inf)]:
+            self.chains[name] = slice(start, start + size)
+            start += size
+        self.sl_vac = self.chains['Vaccinated']
+        self.sl_exp = self.chains['Exposed']
+        self.sl_qua = self.chains['Quarantined']
+        self.sl_inf = self.chains['Infected']
+        self.sl_iso = self.chains['Isolated']
+        self.sl_sin = self.chains['Severe_Infected']
+
+        self.ind_vim = start
+        self.ind_mim = start + 1
+        self.ind_rim = start + 2
+        self.param_num_states = start + 4
+
+        # initial values
+        dtype = np.int64 if self.param_dtype == 'int64' else np.float64
+        self.states_x = np.zeros(self.param_num_states, dtype=dtype)
+        self.states_x[1] = self.init_susceptible
+        self.states_x[self.sl_exp.start] = self.init_exposed
+        self.states_x[self.sl_qua.start] = self.init_quarantined
+        self.states_x[self.sl_inf.start] = self.init_infected
+        self.states_x[self.sl_iso.start] = self.init_isolated
+        self.states_x[self.sl_sin.start] = self.init_severe_infected
+        self.states_x[self.ind_vim] = self.init_vaccination_imm
+        self.states_x[self.ind_mim] = self.init_maternally_imm
+        self.states_x[self.ind_rim] = self.init_recovery_imm
+
+        # states of every compartment, same grouping as Node.indexes
+        self.comp_ind = {'Susceptible': np.r_[1, self.sl_vac.start:self.sl_vac.stop - 1],
+                         'Exposed': self.sl_exp,
+                         'Quarantined': self.sl_qua,
+                         'Infected': self.sl_inf,
+                         'Isolated': self.sl_iso,
+                         'Severe_Infected': self.sl_sin,
+                         'Immunized': slice(self.ind_vim, self.ind_rim + 1),
+                         'Dead': slice(self.param_num_states - 1, self.param_num_states)}
+
+        # random stream of the run
+        self.node.rng = covid19_rng.stream(self.param_seed, self.param_run, self.param_replica)
+        self.create_groups()
+
+        print("[INFO] Chains were created...")
+
+
+    def create_groups(self):
+        # Transition groups of the spec as (group, source, destination,
+        # kind, coef_lo, coef_hi, chain), in the order they are applied;
+        # source and destination are a state index or a slice of the
+        # state vector, never one index per transition
+        vr_on = self.param_vr != 0
+        self.groups = []
+        for num, src, dst, kind, rate, cond in self.spec.transitions:
+            if cond is not None and not covid19_model.CONDITIONS[cond](vr_on, self.param_n_vac, self.param_n_exp):
+                continue
+            source, dest = self.endpoint(src), self.endpoint(dst)
+            # Transitions 5, 10, 13, 15-17 - a chain moving by one slot
+            chain = src.endswith('[i]') and dst == src[:-2] + 'i+1]'
+            self.groups.append((num, source, dest, kind,
+                                rate(self.node, self.param_gamma_mor1),
+                                rate(self.node, self.param_gamma_mor2), chain))
+
+
+    def endpoint(self, ref):
+        # state index or slice of an endpoint of the spec
+        # (see covid19_model.CompiledModel.endpoint)
+        if ref == '*':
+            return slice(1, self.param_num_states - 1)
+        if not ref.endswith(']'):
+            return self.states_name.index(ref)
+
+        name, pos = ref[:-1].split('[')
+        chain = self.chains[name]
+        if pos == '1':
+            return chain.start
+        elif pos == 'n':
+            return chain.stop - 1
+        elif pos == 'i':
+            return slice(chain.start, chain.stop - 1)
+        elif pos == 'i+1':
+            return slice(chain.start + 1, chain.stop)
+        raise ValueError('Unknown endpoint: {}'.format(ref))
+
+
+    def stoch_solver(self):
+        # the expected values of Node.vec_expval in the order of the
+        # transition table, sampled in one call, then applied group
+        # after group as Node.apply_transitions does one by one
+        x = self.states_x
+        total_pop = x[1:-1].sum()
+        pressure, states_sin = self.loads(x)
+        hosp_lo = states_sin < self.param_hosp_capacity
+
+        expval = []
+        for num, source, dest, kind, coef_lo, coef_hi, chain in self.groups:
+            if kind == 'birth':
+                expval.append(np.atleast_1d(coef_lo * total_pop))
+            elif kind == 'foi':
+                expval.append(np.atleast_1d(coef_lo * x[source]) * (pressure / total_pop))
+            elif kind == 'hosp':
+                expval.append(np.atleast_1d((coef_lo if hosp_lo else coef_hi) * x[source]))
+            else:
+                expval.append(np.atleast_1d(coef_lo * x[source]))
+        dx = self.node.sample(np.concatenate(expval))
+
+        y = x.copy()
+        start = 0
+        for (num, source, dest, kind, coef_lo, coef_hi, chain), val in zip(self.groups, expval):
+            d = dx[start:start + len(val)]
+            start += len(val)
+            if chain:
+                # f[i] = min(d[i], y[i] + f[i-1]) as in Node.apply_stage
+                cum = np.cumsum(y[source])
+                flows = cum + np.minimum(np.minimum.accumulate(d - cum), 0)
+            elif source == 1:
+                # Susceptible is the only source allowed to go negative
+                flows = d
+            else:
+                flows = np.minimum(d, y[source])
+                if isinstance(source, slice) and source.start == 1:
+                    flows[0] = d[0]
+            self.move(y, source, dest, flows)
+
+        self.states_x = y
+
+
+    def move(self, y, source, dest, flows):
+        # flows of a group out of its sources into its destinations,
+        # many sources can flow into one destination (Transition 3)
+        if isinstance(source, slice):
+            y[source] -= flows
+        else:
+            y[source] -= flows[0]
+        if isinstance(dest, slice):
+            y[dest] += flows
+        else:
+            y[dest] += flows.sum()
+
+
+    def settled(self, x):
+        # None while anyone is exposed or infected, then 'stationary'
+        # without mortality and vaccination, otherwise 'extinct'
+        for name, _, state_type, _, _ in self.spec.chains:
+            if state_type != 'Susceptible' and x[self.chains[name]].any():
+                return None
+        if self.param_dr == 0 and self.param_vr == 0 and not x[self.sl_vac].any():
+            return 'stationary'
+        return 'extinct'
+
+
+    def fast_forward(self, first):
+        # Once nobody is exposed or infected only the rate groups still
+        # move anyone (see Node.fast_forward): advance all of them by
+        # their expected values at once. Integer states are rounded.
+        groups = [(source, dest, coef_lo) for _, source, dest, kind, coef_lo, _, _ in self.groups
+                  if kind == 'rate']
+        y = self.states_x.astype(np.float64)
+
+        for ind in range(first, self.param_num_sim):
+            yield self.states_x
+            flows = [np.atleast_1d(coef * y[source]) for source, _, coef in groups]
+            for (source, dest, _), val in zip(groups, flows):
+                self.move(y, source, dest, val)
+            self.states_x = np.rint(y).astype(np.int64) if self.param_dtype == 'int64' else y.copy()
+
+
+    # same loads and simulation loop as the node
+    loads = Node.loads
+    steps = Node.steps
+    settled_steps = Node.settled_steps
+    run = Node.run
+
+
+def main():
+    # initialize a new node and run it as chains
+    node = Node()
+    node.param_vis_on = 0
+
+    if node.check_init():
+        chain_node = ChainNode(node)
+        chain_node.create_chains()
+        recorder = chain_node.run(AggregateRecorder())
+
+        print('Inf {}, Sev Inf {}, Dead {}'.format(np.max(recorder['Infected']),
+                                                   np.max(recorder['Severe_Infected']),
+                                                   np.max(recorder['Dead'])))
+
+
+if __name__ == "__main__":
+    main()
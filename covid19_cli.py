@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line runner of Node scenarios, without GUI.
+
+Every scenario file (.json, .toml, .yaml/.yml) holds Node parameters,
+e.g. in YAML:
+
+    param_beta_exp: 0.2
+    param_qr: 0.05
+    init_susceptible: 500000
+
+The param_ prefix may be left out (beta_exp: 0.2), model: v1 runs the
+first model of covid19_model.py. A file may also hold
+several scenarios sharing the parameters given next to them:
+
+    param_sim_len: 200
+    scenarios:
+      - name: low
+        beta_exp: 0.1
+      - name: high
+        beta_exp: 0.3
+
+The aggregated compartments of every scenario are written into one .npz
+file as <scenario>/time, <scenario>/Infected, ... (percentiles across
+replicas for the ensemble engine). Nothing is plotted unless --plot is
+given, and matplotlib is only imported then. With --profile DIR the
+step loop of every scenario is profiled (covid19_profile.py) into
+DIR/<scenario>.json and DIR/<scenario>.folded.
+
+    covid19_simulator base.yaml lockdown.toml -o results.npz --engine vectorized
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import numpy as np
+
+
+# Engines of the command line, the first four are Node.param_engine
+ENGINES = ['legacy', 'vectorized', 'chain', 'compiled', 'ensemble']
+
+
+def load_file(path):
+    # mapping of a .json, .toml or .yaml/.yml file
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        with open(path) as f:
+            return json.load(f)
+    elif ext == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError('Reading {} needs Python 3.11 or the tomli package'.format(path))
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    elif ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('Reading {} needs the PyYAML package'.format(path))
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    else:
+        raise ValueError('Unknown scenario file type: {}'.format(path))
+
+
+def load_scenarios(path):
+    # list of (name, parameters) of a scenario file
+    config = load_file(path)
+    if not isinstance(config, dict):
+        raise ValueError('Scenario file {} does not hold a mapping'.format(path))
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    shared = {key: value for key, value in config.items() if key not in ('name', 'scenarios')}
+    if 'scenarios' not in config:
+        return [(config.get('name', stem), shared)]
+
+    scenarios = []
+    for ind, scenario in enumerate(config['scenarios']):
+        params = dict(shared)
+        params.update({key: value for key, value in scenario.items() if key != 'name'})
+        scenarios.append((scenario.get('name', '{}_{}'.format(stem, ind)), params))
+    return scenarios
+
+
+def parse_override(text):
+    # name=value of --set, the value is read as JSON when it can be
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected name=value, got {}'.format(text))
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name.strip(), value
+
+
+def node_params(node, params):
+    # parameter names of the node, with the param_ prefix added
+    # where it was left out
+    named = {}
+    for name, value in params.items():
+        if not hasattr(node, name) and hasattr(node, 'param_' + name):
+            name = 'param_' + name
+        named[name] = value
+    return named
+
+
+def run_scenario(params, args):
+    # run one scenario and return its aggregated compartments
+    from covid19_recorder import COMPARTMENTS, AggregateRecorder
+    from covid19_simulator_v2 import Node
+
+    node = Node()
+    node.param_vis_on = 0
+    node.param_disp_interval = 100 if args.verbose else 0
+    node.param_engine = 'vectorized' if args.engine == 'ensemble' else args.engine
+    node.set_params(node_params(node, params))
+    if args.seed is not None:
+        node.param_seed = args.seed
+    if args.model_cache is not None:
+        node.param_model_cache = args.model_cache
+    if args.profile is not None:
+        node.param_profile = 1
+
+    # the node reports every stage on stdout
+    out = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(out):
+        if args.engine == 'ensemble':
+            from covid19_ensemble import Ensemble
+            ensemble = Ensemble(node, num_replicas=args.replicas)
+            if not ensemble.create():
+                raise ValueError('Invalid initialization:\n' + out.getvalue().strip())
+            return node, ensemble.run()
+
+        if not node.check_init():
+            raise ValueError('Invalid initialization:\n' + out.getvalue().strip())
+        if node.param_engine == 'chain':
+            from covid19_chain import ChainNode
+            node = ChainNode(node)
+            node.create_chains()
+        else:
+            node.create_states()
+            node.indexes()
+            node.create_transitions()
+            node.vectorize()
+        recorder = node.run(AggregateRecorder())
+
+    results = {'time': recorder.time}
+    for name in COMPARTMENTS:
+        results[name] = recorder[name]
+    return node, results
+
+
+def summary(results):
+    # peaks of a scenario, the median of an ensemble
+    def peak(name):
+        values = results[name]
+        if values.ndim > 1:
+            values = values[len(values) // 2]
+        return np.max(values)
+
+    return 'Inf {:.0f}, Sev Inf {:.0f}, Dead {:.0f}'.format(peak('Infected'), peak('Severe_Infected'), peak('Dead'))
+
+
+def plot(name, node, results):
+    # compartments of a scenario, as in the plots of covid19_simulator_v2.py
+    import matplotlib.pyplot as plt
+
+    def median(values):
+        return values[len(values) // 2] if values.ndim > 1 else values
+
+    time_arr = results['time']
+    fig, ax = plt.subplots(figsize=(8,4))
+    for comp, color, style in [('Exposed', 'lime', ':'), ('Quarantined', 'fuchsia', '-.'),
+                               ('Infected', 'navy', '--'), ('Isolated', 'g', '--'),
+                               ('Severe_Infected', 'r', '--'), ('Immunized', 'cyan', '-'),
+                               ('Dead', 'k', '-')]:
+        ax.plot(time_arr, median(results[comp]), linewidth=1, color=color, linestyle=style,
+                label=comp.replace('_', ' '))
+    ax.plot(time_arr, np.ones(len(time_arr)) * node.param_hosp_capacity, linewidth=1, color='lime',
+            label='Hospital Capacity')
+    ax.set_xlim(0, node.param_sim_len)
+    ax.grid(linestyle=':', linewidth=1)
+    ax.set_title(name)
+    ax.set_xlabel("Time (days)", fontsize=18)
+    ax.set_ylabel("Number of individuals", fontsize=18)
+    ax.legend(loc="upper left", ncol=1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='covid19_simulator',
+        description='Run COVID-19 epidemic scenarios and write their compartments to a .npz file.')
+    parser.add_argument('scenarios', nargs='+', metavar='FILE',
+                        help='scenario files (.json, .toml, .yaml or .yml)')
+    parser.add_argument('-o', '--output', default='results.npz',
+                        help='.npz file of the results (default: %(default)s)')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='vectorized',
+                        help='solver engine (default: %(default)s)')
+    parser.add_argument('-r', '--replicas', type=int, default=100,
+                        help='number of replicas of the ensemble engine (default: %(default)s)')
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help='root seed of the random streams, overrides the scenario files')
+    parser.add_argument('--set', type=parse_override, action='append', default=[], metavar='NAME=VALUE',
+                        help='parameter applied to every scenario, may be repeated')
+    parser.add_argument('--model-cache', default=None, metavar='DIR',
+                        help='directory of the on-disk cache of compiled models')
+    parser.add_argument('--profile', default=None, metavar='DIR',
+                        help='profile the step loop, <scenario>.json and .folded are written to DIR')
+    parser.add_argument('--plot', action='store_true',
+                        help='plot every scenario once all of them are done')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='show the progress of the simulations')
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+
+    scenarios = []
+    try:
+        for path in args.scenarios:
+            scenarios += load_scenarios(path)
+    except (OSError, ValueError) as err:
+        parser.error(str(err))
+
+    names = [name for name, _ in scenarios]
+    if len(set(names)) != len(names):
+        parser.error('Scenario names are not unique: {}'.format(', '.join(names)))
+
+    arrays = {}
+    done = []
+    for name, params in scenarios:
+        params.update(dict(args.set))
+        start = time.time()
+        try:
+            node, results = run_scenario(params, args)
+        except ValueError as err:
+            print('[ERROR] Scenario {}: {}'.format(name, err), file=sys.stderr)
+            return 1
+        print('{}: {} ({:.2f} sec)'.format(name, summary(results), time.time() - start))
+        if getattr(node, 'profiler', None) is not None:
+            os.makedirs(args.profile, exist_ok=True)
+            node.profiler.to_json(os.path.join(args.profile, name + '.json'))
+            node.profiler.to_folded(os.path.join(args.profile, name + '.folded'))
+
+        for key, values in results.items():
+            arrays['{}/{}'.format(name, key)] = values
+        done.append((name, node, results))
+
+    np.savez_compressed(args.output, **arrays)
+    print('[INFO] Results of {} scenarios were written to {}'.format(len(done), args.output))
+    if args.verbose:
+        import covid19_model
+        print('[INFO] Compiled models: {hits} hits, {disk_hits} disk hits, {misses} misses'.format(
+            **covid19_model.CACHE.info()))
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        for name, node, results in done:
+            plot(name, node, results)
+        plt.show()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo ensemble of stochastic replicas of one Node scenario.
+
+All replicas share the state graph of the node and are advanced in
+lockstep as the rows of one (num_replicas, num_states) array. Replica r
+draws from its own stream (run, r) of covid19_rng.py, so it follows the
+same trajectory as a vectorized Node run with param_replica = r, whatever
+the number of replicas.
+"""
+
+import numpy as np
+import time
+
+import covid19_rng
+from covid19_recorder import COMPARTMENTS, compartment_matrix
+from covid19_simulator_v2 import Node
+
+
+class Ensemble:
+    def __init__(self, node, num_replicas=100):
+        # Node holding the parameters of the scenario
+        self.node = node
+        # Number of stochastic replicas
+        self.param_num_replicas = num_replicas
+        # Percentiles reported for the aggregated compartments
+        self.param_percentiles = [5, 25, 50, 75, 95]
+        # Aggregated compartments
+        self.compartments = COMPARTMENTS
+
+        self.states_x = []
+
+
+    def create(self):
+        node = self.node
+
+        # check correctenes of the initialization
+        if not node.check_init():
+            return 0
+
+        # the state graph is built once for all replicas
+        node.create_states()
+        node.indexes()
+        node.create_transitions()
+        node.vectorize()
+
+        # every replica starts from the initial states of the node
+        dtype = np.int64 if node.param_dtype == 'int64' else np.float64
+        self.states_x = np.tile(node.states_x.astype(dtype),
+                                (self.param_num_replicas, 1))
+        self.rngs = covid19_rng.streams(node.param_seed, node.param_run,
+                                        replicas=range(self.param_num_replicas))
+
+        # indicator matrix of the aggregated compartments
+        self.ind_comp = compartment_matrix(node)
+
+        print("[INFO] Ensemble of {} replicas was created...".format(self.param_num_replicas))
+        return 1
+
+
+    def stoch_solver(self):
+        # advance all replicas by one step, each with its own stream
+        expval = self.node.vec_expval(self.states_x)
+        dx = self.node.sample(expval, self.rngs)
+        self.states_x = self.node.vec_apply(self.states_x, dx)
+
+
+    def run(self):
+        node = self.node
+
+        # aggregated compartments of every replica at every step, in
+        # double precision: float32 rounds counts above 2**24 and
+        # shifts the percentiles of large populations
+        comp_arr = np.zeros((node.param_num_sim, self.param_num_replicas,
+                             len(self.compartments)))
+
+        start = time.time()
+        for ind in range(node.param_num_sim):
+            comp_arr[ind] = self.states_x @ self.ind_comp
+            self.stoch_solver()
+
+            if node.param_disp_interval and ind % node.param_disp_interval == 0:
+                end = time.time()
+                print("Sim.time: {:.4f} sec, Iteration: {}/{}".format(end - start, ind + 1, node.param_num_sim))
+
+        # per-step percentiles across the replicas
+        comp_pct = np.percentile(comp_arr, self.param_percentiles, axis=1)
+
+        results = {'time': np.arange(node.param_num_sim) * node.param_dt,
+                   'percentiles': np.asarray(self.param_percentiles)}
+        for ind, name in enumerate(self.compartments):
+            results[name] = comp_pct[:, :, ind]
+
+        return results
+
+
+def main():
+    # initialize a new node and an ensemble on top of it
+    node = Node()
+    node.param_engine = 'vectorized'
+    ensemble = Ensemble(node, num_replicas=100)
+
+    if ensemble.create():
+        results = ensemble.run()
+
+        # if visualization is enabled
+        # then plot the percentile bands
+        if node.param_vis_on:
+            import matplotlib.pyplot as plt
+
+            time_arr = results['time']
+            lo, mid, hi = 0, len(ensemble.param_percentiles) // 2, -1
+
+            fig, ax = plt.subplots(figsize=(8,4))
+            for name, color in [('Infected', 'navy'), ('Severe_Infected', 'r'), ('Dead', 'k')]:
+                ax.plot(time_arr, results[name][mid], linewidth=1, color=color, label=name.replace('_', ' '))
+                ax.fill_between(time_arr, results[name][lo], results[name][hi], color=color, alpha=0.2)
+            ax.plot(time_arr, np.ones(len(time_arr)) * node.param_hosp_capacity, linewidth=1, color='lime', label='Hospital Capacity')
+            plt.xlim(0, node.param_sim_len)
+            ax.grid(linestyle=':', linewidth=1)
+            plt.xlabel("Time (days)", fontsize=18)
+            plt.ylabel("Number of individuals", fontsize=18)
+            plt.legend(loc="upper left", ncol=1)
+            plt.show()
+
+
+if __name__ == "__main__":
+    main()
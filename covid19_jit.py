@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled stochastic step loop of a Node.
+
+advance() runs whole blocks of steps over the transition arrays built by
+Node.vectorize: expected values from the state before the step, then
+every transition sampled and applied one after another, with the same
+clamping as the legacy solver. It draws from the generator of the node
+in the same order as the vectorized engine, so both give bit-identical
+trajectories for the same seed.
+
+The loop is compiled with Numba when it is installed, otherwise it runs
+as plain Python (same results, but slower than the vectorized engine).
+Numba is only imported by the first call to compiled().
+"""
+
+import numpy as np
+
+
+# Number of steps advanced by one call of the compiled loop
+BLOCK_SIZE = 256
+
+# Rounding guard of the number of binomial trials
+EPS32 = float(np.finfo(np.float32).eps)
+
+# Kinds of transitions in the kind array
+KIND_RATE = 0       # coefficient times the source state
+KIND_BIRTH = 1      # coefficient times the total population
+KIND_FOI = 2        # also times the infection pressure per individual
+KIND_HOSP = 3       # coefficient switches with the hospital load
+
+_compiled = None
+
+
+def advance(states_x, block, work, source, dest, kind, coef_lo, coef_hi,
+            loads, weights, hosp, hosp_capacity, rng):
+    # advance states_x by len(block) steps, block receives the states
+    # before every step and work holds the state during a step
+    # (float64 for float states, int64 for integer ones)
+    num_states = len(states_x)
+    num_trans = len(source)
+    expval = np.empty(num_trans)
+
+    for step in range(block.shape[0]):
+        block[step] = states_x
+        work[:] = states_x
+
+        # total population, infection pressure and hospital load
+        total_pop = 0.0
+        for ind in range(1, num_states - 1):
+            total_pop += work[ind]
+
+        pressure = 0.0
+        for row in range(len(weights)):
+            total = 0.0
+            for ind in range(loads[row, 0], loads[row, 1]):
+                total += work[ind]
+            pressure = total if row == 0 else pressure + weights[row] * total
+
+        states_sin = 0.0
+        for ind in range(hosp[0], hosp[1]):
+            states_sin += work[ind]
+        high = not states_sin < hosp_capacity
+
+        # expected values of all transitions
+        for ind in range(num_trans):
+            if kind[ind] == KIND_BIRTH:
+                expval[ind] = coef_lo[ind] * total_pop
+            elif kind[ind] == KIND_FOI:
+                expval[ind] = coef_lo[ind] * work[source[ind]] * (pressure / total_pop)
+            elif kind[ind] == KIND_HOSP and high:
+                expval[ind] = coef_hi[ind] * work[source[ind]]
+            else:
+                expval[ind] = coef_lo[ind] * work[source[ind]]
+
+        # sample and apply the transitions one after another,
+        # only Susceptible can give away more than it holds
+        for ind in range(num_trans):
+            val = expval[ind]
+            if val > 0 and val < 10:
+                trials = np.ceil(val * 10 + EPS32)
+                dx = float(rng.binomial(int(trials), val / trials))
+            elif val > 0:
+                dx = np.rint(val)
+            else:
+                dx = 0.0
+
+            sind = source[ind]
+            if sind != 1 and work[sind] - dx <= 0:
+                dx = work[sind]
+            work[sind] -= dx
+            work[dest[ind]] += dx
+
+        states_x[:] = work
+
+
+def compiled():
+    # advance() compiled with Numba, or as it is without Numba
+    global _compiled
+    if _compiled is None:
+        try:
+            from numba import njit
+        except ImportError:
+            print("[INFO] Numba is not installed, the compiled engine runs as plain Python...")
+            _compiled = advance
+        else:
+            _compiled = njit(cache=True, error_model='numpy')(advance)
+
+    return _compiled
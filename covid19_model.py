@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Declarative model specs and their compiled transition tables.
+
+A ModelSpec lists the stage chains of a model in the order of the state
+vector and its transitions in the order they are applied, with the rate
+of every transition as a function of the Node parameters. compile_model
+turns a spec and the chain lengths into a CompiledModel: state names
+and indices, the transition index arrays and the stages of vec_apply.
+The table only depends on the structure of the model, the coefficients
+of a given set of rates are filled in by CompiledModel.coefficients.
+
+Two specs are defined: SPEC_V1, the model of covid19_simulator.py and of
+the Qt app (no Isolated states), and SPEC_V2 of covid19_simulator_v2.py.
+All engines of Node run on the compiled table of either one.
+
+Endpoints of a transition are written as:
+
+    'Susceptible'    a single state (also 'Birth', 'Dead', ...)
+    'Exposed[1]'     first state of a chain
+    'Exposed[n]'     last state of a chain
+    'Exposed[i]'     every state of a chain but the last one, paired
+    'Exposed[i+1]'   with every state of a chain but the first one
+    '*'              every state except Birth and Dead
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+
+
+# States before and after the chains, as (name, type, initial value)
+HEAD_STATES = [('Birth', 'Birth', None),
+               ('Susceptible', 'Susceptible', 'init_susceptible')]
+TAIL_STATES = [('Vaccination_Immunized', 'Immunized', 'init_vaccination_imm'),
+               ('Maternally_Immunized', 'Immunized', 'init_maternally_imm'),
+               ('Recovery_Immunized', 'Immunized', 'init_recovery_imm'),
+               ('Dead', 'Dead', None)]
+
+# Kinds of transitions, the expected value is the coefficient times:
+# the source state (rate), the total population (birth), the source
+# state and the infection pressure per individual (foi), or the source
+# state with a coefficient switching with the hospital load (hosp)
+KINDS = ['rate', 'birth', 'foi', 'hosp']
+
+# Conditions under which a transition exists
+CONDITIONS = {'vr': lambda vr_on, n_vac, n_exp: vr_on,
+              'n_vac': lambda vr_on, n_vac, n_exp: n_vac != 0,
+              'n_exp': lambda vr_on, n_vac, n_exp: n_exp != 0}
+
+
+class ModelSpec:
+    def __init__(self, name, chains, transitions, pressure, hospital):
+        # Name of the model
+        self.name = name
+        # Stage chains in the order of the state vector, as (name, short
+        # name of the ind_ attributes, state type, length parameter,
+        # initial value of the first state)
+        self.chains = chains
+        # Transitions in the order they are applied, as (group, source,
+        # destination, kind, rate(node, gamma_mor_sin), condition)
+        self.transitions = transitions
+        # Terms of the infection pressure, as (chain, weight parameter),
+        # the first one has no weight
+        self.pressure = pressure
+        # Chain of the hospital load
+        self.hospital = hospital
+
+
+    def digest(self):
+        # fingerprint of the structure of the model (not of the rates),
+        # saved tables of another structure are never read back
+        structure = (self.name, self.chains, [(num, src, dst, kind, cond)
+                                              for num, src, dst, kind, _, cond in self.transitions],
+                     self.pressure, self.hospital)
+        return hashlib.sha1(repr(structure).encode()).hexdigest()[:12]
+
+
+class CompiledModel:
+    def __init__(self, spec, n_vac, n_exp, n_inf, vr_on, arrays=None):
+        # structural key: everything the table depends on
+        self.spec = spec
+        self.key = (spec.name, n_vac, n_exp, n_inf, vr_on)
+
+        # a table saved by save() is read back instead of being built
+        if arrays is None:
+            self.create_states({'param_n_vac': n_vac, 'param_n_exp': n_exp, 'param_n_inf': n_inf})
+            self.create_transitions(vr_on, n_vac, n_exp)
+            stages = self.find_stages()
+        else:
+            self.states_name = arrays['states_name'].tolist()
+            self.states_type = arrays['states_type'].tolist()
+            self.init_ind = list(zip(arrays['init_ind'].tolist(), arrays['init_name'].tolist()))
+            self.chains = {name: slice(start, stop) for (name, _, _, _, _), (start, stop)
+                           in zip(spec.chains, arrays['chains'].tolist())}
+            self.source_arr = arrays['source_arr']
+            self.dest_arr = arrays['dest_arr']
+            self.group_arr = arrays['group_arr']
+            self.spec_rows = arrays['spec_rows']
+            stages = [(start, end, bool(chain)) for start, end, chain in arrays['stages'].tolist()]
+            self.states_ind = {name: ind for ind, name in enumerate(self.states_name)}
+
+        self.index(stages)
+
+
+    def create_states(self, lengths):
+        # states, with the slice of every chain
+        self.states_name = []
+        self.states_type = []
+        self.init_ind = []
+        for name, state_type, init in HEAD_STATES:
+            self.add_state(name, state_type, init)
+        self.chains = {}
+        for name, _, state_type, length, init in self.spec.chains:
+            start = len(self.states_name)
+            for ind in range(lengths[length]):
+                self.add_state('{}_{}'.format(name, ind + 1), state_type, init if ind == 0 else None)
+            self.chains[name] = slice(start, len(self.states_name))
+        for name, state_type, init in TAIL_STATES:
+            self.add_state(name, state_type, init)
+
+        self.num_states = len(self.states_name)
+        self.states_ind = {name: ind for ind, name in enumerate(self.states_name)}
+
+
+    def create_transitions(self, vr_on, n_vac, n_exp):
+        # transitions, and the spec rows they come from
+        source, dest, group, rows = [], [], [], []
+        for row, (num, src, dst, kind, rate, cond) in enumerate(self.spec.transitions):
+            if cond is not None and not CONDITIONS[cond](vr_on, n_vac, n_exp):
+                continue
+            src_ind = self.endpoint(src)
+            dst_ind = self.endpoint(dst)
+            size = max(len(src_ind), len(dst_ind))
+            source += list(src_ind) * (size // len(src_ind)) if src_ind else []
+            dest += list(dst_ind) * (size // len(dst_ind)) if dst_ind else []
+            group += [num] * size
+            rows += [row] * size
+
+        self.source_arr = np.asarray(source, dtype=np.intp)
+        self.dest_arr = np.asarray(dest, dtype=np.intp)
+        self.group_arr = np.asarray(group, dtype=np.intp)
+        self.spec_rows = np.asarray(rows, dtype=np.intp)
+
+
+    def index(self, stages):
+        # lookups derived from the states and transitions, the cheap
+        # part of the table that is not saved
+        spec = self.spec
+        self.num_states = len(self.states_name)
+        self.type_ind = {}
+        for ind, state_type in enumerate(self.states_type):
+            self.type_ind.setdefault(state_type, []).append(ind)
+        self.type_ind = {state_type: np.asarray(ind, dtype=np.intp)
+                         for state_type, ind in self.type_ind.items()}
+
+        # states of every compartment, as a slice of the state vector
+        # or as an index array (Susceptible does not include the last
+        # Vaccinated state, it is counted on its own)
+        vac = self.chains['Vaccinated']
+        self.comp_ind = {'Susceptible': np.r_[1, vac.start:vac.stop - 1]}
+        for name, _, _, _, _ in spec.chains[1:]:
+            self.comp_ind[name] = self.chains[name]
+        self.comp_ind['Immunized'] = slice(self.states_ind['Vaccination_Immunized'],
+                                           self.states_ind['Recovery_Immunized'] + 1)
+        self.comp_ind['Dead'] = slice(self.num_states - 1, self.num_states)
+
+        self.source_ind = self.source_arr.tolist()
+        self.dest_ind = self.dest_arr.tolist()
+
+        kinds = np.array([KINDS.index(kind) for _, _, _, kind, _, _ in spec.transitions], dtype=np.int8)
+        self.kind_arr = kinds[self.spec_rows]
+        self.rows_birth = np.flatnonzero(self.kind_arr == KINDS.index('birth'))
+        self.rows_foi = np.flatnonzero(self.kind_arr == KINDS.index('foi'))
+        self.rows_hosp = np.flatnonzero(self.kind_arr == KINDS.index('hosp'))
+
+        # Susceptible is the only source allowed to go negative
+        self.clamp_mask = self.source_arr != 1
+
+        # chains of the infection pressure and of the hospital load
+        self.loads_arr = np.array([[self.chains[name].start, self.chains[name].stop]
+                                   for name, _ in spec.pressure], dtype=np.intp)
+        self.hosp_arr = np.array([self.chains[spec.hospital].start,
+                                  self.chains[spec.hospital].stop], dtype=np.intp)
+
+        # Transitions of a stage can share a source or a destination
+        # (e.g. Dead in Transition 3), their flows are summed up
+        # before being scattered into the states
+        self.stage_bounds = stages
+        self.stages = [(start, end, chain,
+                        scatter_index(self.source_arr[start:end]),
+                        scatter_index(self.dest_arr[start:end]))
+                       for start, end, chain in stages]
+
+        # the table is shared by every node with the same key
+        for arr in [self.source_arr, self.dest_arr, self.group_arr, self.spec_rows, self.kind_arr,
+                    self.rows_birth, self.rows_foi, self.rows_hosp, self.clamp_mask]:
+            arr.flags.writeable = False
+
+
+    def save(self, path):
+        # arrays of the table, written to a temporary file first so
+        # that processes sharing a cache never read a partial one
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, states_name=np.array(self.states_name), states_type=np.array(self.states_type),
+                     init_ind=np.array([ind for ind, _ in self.init_ind], dtype=np.intp),
+                     init_name=np.array([name for _, name in self.init_ind]),
+                     chains=np.array([[self.chains[name].start, self.chains[name].stop]
+                                      for name, _, _, _, _ in self.spec.chains], dtype=np.intp),
+                     source_arr=self.source_arr, dest_arr=self.dest_arr, group_arr=self.group_arr,
+                     spec_rows=self.spec_rows, stages=np.array(self.stage_bounds, dtype=np.intp))
+        os.replace(tmp, path)
+
+
+    def add_state(self, name, state_type, init):
+        if init is not None:
+            self.init_ind.append((len(self.states_name), init))
+        self.states_name.append(name)
+        self.states_type.append(state_type)
+
+
+    def endpoint(self, ref):
+        # state indices of an endpoint of a transition
+        if ref == '*':
+            return range(1, self.num_states - 1)
+        if not ref.endswith(']'):
+            return [self.states_ind[ref]]
+
+        name, pos = ref[:-1].split('[')
+        chain = self.chains[name]
+        if pos == '1':
+            return [chain.start]
+        elif pos == 'n':
+            return [chain.stop - 1]
+        elif pos == 'i':
+            return range(chain.start, chain.stop - 1)
+        elif pos == 'i+1':
+            return range(chain.start + 1, chain.stop)
+        raise ValueError('Unknown endpoint: {}'.format(ref))
+
+
+    def find_stages(self):
+        # Transitions are applied one after another and a source can only
+        # give away what it holds at that moment. Split them once into
+        # consecutive stages that can be applied at the same time: either
+        # transitions with untouched sources, or a chain where each source
+        # is the destination of the previous transition.
+        num_trans = len(self.source_arr)
+        stages = []
+        touched = {self.source_arr[0]: 1, self.dest_arr[0]: 1}
+        chain = False
+        start = 0
+        for ind in range(1, num_trans):
+            sind = self.source_arr[ind]
+            dind = self.dest_arr[ind]
+            link = self.dest_arr[ind - 1] == sind and touched.get(sind) == 1
+
+            if link and (chain or ind - start == 1):
+                chain = True
+            elif chain or (sind != 1 and sind in touched):
+                stages.append((start, ind, chain))
+                touched = {}
+                chain = False
+                start = ind
+
+            touched[sind] = touched.get(sind, 0) + 1
+            touched[dind] = touched.get(dind, 0) + 1
+        stages.append((start, num_trans, chain))
+
+        return stages
+
+
+    def initial_states(self, node, dtype):
+        # state vector with the initial values of the node
+        states_x = np.zeros(self.num_states, dtype=dtype)
+        for ind, init in self.init_ind:
+            states_x[ind] = getattr(node, init)
+        return states_x
+
+
+    def coefficients(self, node):
+        # coefficients of the expected values of all transitions below
+        # and above the hospital capacity, one rate per spec row
+        rates = self.spec.transitions
+        coef_lo = np.array([rate(node, node.param_gamma_mor1) for _, _, _, _, rate, _ in rates])
+        coef_hi = np.array([rate(node, node.param_gamma_mor2) for _, _, _, _, rate, _ in rates])
+        weights = np.array([1] + [getattr(node, weight) for _, weight in self.spec.pressure[1:]],
+                           dtype=np.float64)
+        return coef_lo[self.spec_rows], coef_hi[self.spec_rows], weights
+
+
+def scatter_index(ind):
+    # distinct states of the transitions, and the order and offsets
+    # that group the transitions by state (None if all distinct).
+    # Consecutive states (the stage chains) are kept as a slice.
+    if np.all(np.diff(ind) == 1):
+        return slice(ind[0], ind[-1] + 1), None, None
+    elif len(np.unique(ind)) == len(ind):
+        return ind, None, None
+
+    order = np.argsort(ind, kind='stable')
+    uniq, offsets = np.unique(ind[order], return_index=True)
+    return uniq, order, offsets
+
+
+# Rates shared by both models
+def birth_sus(p, mor):
+    return p.param_br * (1 - p.param_mir) * p.param_dt
+
+def birth_mim(p, mor):
+    return p.param_br * p.param_mir * p.param_dt
+
+def mortality(p, mor):
+    return p.param_dr * p.param_dt
+
+def vaccination(p, mor):
+    return p.param_vr * p.param_dt
+
+def stay(p, mor):
+    return 1 - p.param_dr * p.param_dt
+
+def vac_immunized(p, mor):
+    return p.param_vir
+
+def vac_susceptible(p, mor):
+    return 1 - p.param_dr * p.param_dt - p.param_vir
+
+def exposure(p, mor):
+    return p.param_beta_exp * p.param_dt
+
+def infection(p, mor):
+    return p.param_beta_inf * p.param_dt
+
+def exp_stay(p, mor):
+    return 1 - p.param_dr * p.param_dt - p.param_qr * p.param_dt
+
+def quarantine(p, mor):
+    return p.param_qr * p.param_dt
+
+def inf_stay(p, mor):
+    return 1 - p.param_dr * p.param_dt - p.param_sir * p.param_dt
+
+def severe(p, mor):
+    return p.param_sir * p.param_dt
+
+def recovery(p, mor):
+    return p.param_gamma_im
+
+def inf_mortality(p, mor):
+    return p.param_gamma_mor
+
+def sin_mortality(p, mor):
+    return mor
+
+# Rates of the outcomes of Infected and Severe_Infected in covid19_simulator.py
+def v1_inf_susceptible(p, mor):
+    return 1 - p.param_gamma_mor - p.param_gamma_im
+
+def v1_sin_susceptible(p, mor):
+    return 1 - mor - p.param_gamma_im
+
+# and in covid19_simulator_v2.py
+def v2_inf_susceptible(p, mor):
+    return (1 - p.param_gamma_mor) * (1 - p.param_gamma_im)
+
+def v2_sin_recovery(p, mor):
+    return (1 - mor) * p.param_gamma_im
+
+def v2_sin_susceptible(p, mor):
+    return (1 - mor) * (1 - p.param_gamma_im)
+
+
+SPEC_V1 = ModelSpec(
+    'v1',
+    chains=[('Vaccinated', 'vac', 'Susceptible', 'param_n_vac', None),
+            ('Exposed', 'exp', 'Exposed', 'param_n_exp', 'init_exposed'),
+            ('Quarantined', 'qua', 'Exposed', 'param_n_exp', 'init_quarantined'),
+            ('Infected', 'inf', 'Infected', 'param_n_inf', 'init_infected'),
+            ('Severe_Infected', 'sin', 'Infected', 'param_n_inf', 'init_severe_infected')],
+    transitions=[(1, 'Birth', 'Susceptible', 'birth', birth_sus, None),
+                 (2, 'Birth', 'Maternally_Immunized', 'birth', birth_mim, None),
+                 (3, '*', 'Dead', 'rate', mortality, None),
+                 (4, 'Susceptible', 'Vaccinated[1]', 'rate', vaccination, 'vr'),
+                 (5, 'Vaccinated[i]', 'Vaccinated[i+1]', 'rate', stay, 'n_vac'),
+                 (6, 'Vaccinated[n]', 'Vaccination_Immunized', 'rate', vac_immunized, 'vr'),
+                 (7, 'Vaccinated[n]', 'Susceptible', 'rate', vac_susceptible, 'vr'),
+                 (8, 'Susceptible', 'Exposed[1]', 'foi', exposure, 'n_exp'),
+                 (9, 'Susceptible', 'Infected[1]', 'foi', infection, None),
+                 (10, 'Exposed[i]', 'Exposed[i+1]', 'rate', exp_stay, None),
+                 (11, 'Exposed[n]', 'Infected[1]', 'rate', stay, 'n_exp'),
+                 (12, 'Exposed[i]', 'Quarantined[i+1]', 'rate', quarantine, None),
+                 (13, 'Quarantined[i]', 'Quarantined[i+1]', 'rate', stay, None),
+                 (14, 'Quarantined[n]', 'Infected[1]', 'rate', stay, 'n_exp'),
+                 (15, 'Infected[i]', 'Infected[i+1]', 'rate', inf_stay, None),
+                 (16, 'Severe_Infected[i]', 'Severe_Infected[i+1]', 'rate', stay, None),
+                 (17, 'Infected[i]', 'Severe_Infected[i+1]', 'rate', severe, None),
+                 (18, 'Infected[n]', 'Recovery_Immunized', 'rate', recovery, None),
+                 (19, 'Severe_Infected[n]', 'Recovery_Immunized', 'rate', recovery, None),
+                 (20, 'Infected[n]', 'Susceptible', 'rate', v1_inf_susceptible, None),
+                 (21, 'Severe_Infected[n]', 'Susceptible', 'hosp', v1_sin_susceptible, None),
+                 (22, 'Infected[n]', 'Dead', 'rate', inf_mortality, None),
+                 (23, 'Severe_Infected[n]', 'Dead', 'hosp', sin_mortality, None)],
+    pressure=[('Infected', None), ('Exposed', 'param_eps_exp'),
+              ('Severe_Infected', 'param_eps_sev'), ('Quarantined', 'param_eps_qua')],
+    hospital='Severe_Infected')
+
+
+SPEC_V2 = ModelSpec(
+    'v2',
+    chains=[('Vaccinated', 'vac', 'Susceptible', 'param_n_vac', None),
+            ('Exposed', 'exp', 'Exposed', 'param_n_exp', 'init_exposed'),
+            ('Quarantined', 'qua', 'Exposed', 'param_n_exp', 'init_quarantined'),
+            ('Infected', 'inf', 'Infected', 'param_n_inf', 'init_infected'),
+            ('Isolated', 'iso', 'Infected', 'param_n_inf', 'init_isolated'),
+            ('Severe_Infected', 'sin', 'Infected', 'param_n_inf', 'init_severe_infected')],
+    transitions=[(1, 'Birth', 'Susceptible', 'birth', birth_sus, None),
+                 (2, 'Birth', 'Maternally_Immunized', 'birth', birth_mim, None),
+                 (3, '*', 'Dead', 'rate', mortality, None),
+                 (4, 'Susceptible', 'Vaccinated[1]', 'rate', vaccination, 'vr'),
+                 (5, 'Vaccinated[i]', 'Vaccinated[i+1]', 'rate', stay, 'n_vac'),
+                 (6, 'Vaccinated[n]', 'Vaccination_Immunized', 'rate', vac_immunized, 'vr'),
+                 (7, 'Vaccinated[n]', 'Susceptible', 'rate', vac_susceptible, 'vr'),
+                 (8, 'Susceptible', 'Exposed[1]', 'foi', exposure, 'n_exp'),
+                 (9, 'Susceptible', 'Infected[1]', 'foi', infection, None),
+                 (10, 'Exposed[i]', 'Exposed[i+1]', 'rate', exp_stay, None),
+                 (11, 'Exposed[n]', 'Infected[1]', 'rate', stay, 'n_exp'),
+                 (12, 'Exposed[i]', 'Quarantined[i+1]', 'rate', quarantine, None),
+                 (13, 'Quarantined[i]', 'Quarantined[i+1]', 'rate', stay, None),
+                 (14, 'Quarantined[n]', 'Isolated[1]', 'rate', stay, 'n_exp'),
+                 (15, 'Infected[i]', 'Infected[i+1]', 'rate', inf_stay, None),
+                 (16, 'Isolated[i]', 'Isolated[i+1]', 'rate', inf_stay, None),
+                 (17, 'Severe_Infected[i]', 'Severe_Infected[i+1]', 'rate', stay, None),
+                 (18, 'Infected[i]', 'Severe_Infected[i+1]', 'rate', severe, None),
+                 (19, 'Isolated[i]', 'Severe_Infected[i+1]', 'rate', severe, None),
+                 (20, 'Infected[n]', 'Recovery_Immunized', 'rate', recovery, None),
+                 (21, 'Isolated[n]', 'Recovery_Immunized', 'rate', recovery, None),
+                 (22, 'Severe_Infected[n]', 'Recovery_Immunized', 'hosp', v2_sin_recovery, None),
+                 (23, 'Infected[n]', 'Susceptible', 'rate', v2_inf_susceptible, None),
+                 (24, 'Isolated[n]', 'Susceptible', 'rate', v2_inf_susceptible, None),
+                 (25, 'Severe_Infected[n]', 'Susceptible', 'hosp', v2_sin_susceptible, None),
+                 (26, 'Infected[n]', 'Dead', 'rate', inf_mortality, None),
+                 (27, 'Severe_Infected[n]', 'Dead', 'hosp', sin_mortality, None)],
+    pressure=[('Infected', None), ('Exposed', 'param_eps_exp'), ('Severe_Infected', 'param_eps_sev'),
+              ('Isolated', 'param_eps_sev'), ('Quarantined', 'param_eps_qua')],
+    hospital='Severe_Infected')
+
+
+# Specs by the name given in Node.param_model
+SPECS = {spec.name: spec for spec in [SPEC_V1, SPEC_V2]}
+
+
+class ModelCache:
+    def __init__(self, max_size=8):
+        # Number of compiled models kept in memory, least recently used
+        # ones are dropped first
+        self.param_max_size = max_size
+        self.models = OrderedDict()
+        # Lookups served from memory, from the disk cache, and tables
+        # that had to be built
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def path(self, cache_dir, spec, key):
+        return os.path.join(cache_dir, '{}_{}_{}_{}_{}_{:d}.npz'.format(spec.digest(), *key))
+
+
+    def get(self, spec, n_vac, n_exp, n_inf, vr_on, cache_dir=None):
+        key = (spec.name, n_vac, n_exp, n_inf, bool(vr_on))
+        if key in self.models:
+            self.hits += 1
+            self.models.move_to_end(key)
+            return self.models[key]
+
+        path = None if cache_dir is None else self.path(cache_dir, spec, key)
+        if path is not None and os.path.exists(path):
+            with np.load(path) as arrays:
+                model = CompiledModel(spec, *key[1:], arrays=arrays)
+            self.disk_hits += 1
+        else:
+            model = CompiledModel(spec, *key[1:])
+            self.misses += 1
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                model.save(path)
+
+        self.models[key] = model
+        while len(self.models) > self.param_max_size:
+            self.models.popitem(last=False)
+        return model
+
+
+    def info(self):
+        # counters of the cache, e.g. to check that a sweep over
+        # rates built the table only once
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'size': len(self.models), 'max_size': self.param_max_size}
+
+
+    def clear(self):
+        # drop the models in memory and reset the counters,
+        # the disk cache is left as it is
+        self.models.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+
+# Compiled models of this process
+CACHE = ModelCache()
+
+
+def compile_model(name, n_vac, n_exp, n_inf, vr_on, cache_dir=None):
+    # transition table of a spec for the given chain lengths, shared
+    # with every other node of the same structure (see ModelCache)
+    if name not in SPECS:
+        raise ValueError('Unknown model: {}'.format(name))
+    return CACHE.get(SPECS[name], n_vac, n_exp, n_inf, vr_on, cache_dir)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metapopulation of Node scenarios coupled by mobility.
+
+All nodes (regions, cities) share the state graph of one Node and are
+advanced in lockstep as the rows of one (num_nodes, num_states) array,
+as in covid19_ensemble.py. They are coupled through a sparse
+origin-destination matrix, mobility[i, j] being the number of trips per
+day and per resident of node i to node j:
+
+- Commuting: a traveller spends param_trip_len days in the destination
+  and comes back, so at any time a share of the residents of i mixes
+  with the population of j. The force of infection in node i uses the
+  infection pressure per individual of every node it mixes with,
+  weighted by the time spent there (two sparse mat-vecs).
+- Relocation: a share param_relocation of the trips does not come
+  back. Once every param_travel_interval steps, the mobile states (not
+  the hospitalized, isolated or quarantined ones) of every node are
+  split between staying and the destinations by multinomial draws, and
+  the arrivals are gathered with one sparse product over the edges, so
+  individuals stay whole and the total population is kept exactly.
+
+beta and the hospital capacity can be set per node. Node i draws from
+its own stream (run, replica, i) of covid19_rng.py.
+"""
+
+import numpy as np
+import time
+import scipy.sparse as sp
+
+import covid19_rng
+from covid19_recorder import COMPARTMENTS, compartment_matrix
+from covid19_simulator_v2 import Node
+
+
+def gravity_mobility(populations, coords, num_neighbours=10, trips=0.05):
+    # sparse mobility matrix of a gravity model: every node sends
+    # trips per resident and day to its num_neighbours nearest nodes,
+    # split proportionally to their population over the squared distance
+    populations = np.asarray(populations, dtype=np.float64)
+    coords = np.asarray(coords, dtype=np.float64)
+    num_nodes = len(populations)
+    num_neighbours = min(num_neighbours, num_nodes - 1)
+
+    rows, cols, vals = [], [], []
+    for ind in range(num_nodes):
+        dist2 = ((coords - coords[ind]) ** 2).sum(axis=1)
+        dist2[ind] = np.inf
+        near = np.argpartition(dist2, num_neighbours - 1)[:num_neighbours]
+        weight = populations[near] / np.maximum(dist2[near], 1e-12)
+        rows.append(np.full(num_neighbours, ind))
+        cols.append(near)
+        vals.append(trips * weight / weight.sum())
+
+    return sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(num_nodes, num_nodes))
+
+
+class Network:
+    def __init__(self, node, num_nodes, mobility=None):
+        # Node holding the parameters shared by all nodes
+        self.node = node
+        # Number of nodes of the network
+        self.param_num_nodes = num_nodes
+        # Sparse (num_nodes, num_nodes) matrix of trips per
+        # resident and day (None leaves the nodes uncoupled)
+        self.mobility = mobility
+        # Days spent in the destination by a commuting traveller
+        self.param_trip_len = 1/3
+        # Share of the trips whose travellers stay in the destination
+        self.param_relocation = 0.01
+        # Number of steps between two relocations (None is one day)
+        self.param_travel_interval = None
+        # Per-node values (sequences of num_nodes values), None keeps
+        # the value of the node for all of them
+        self.param_beta_exp = None
+        self.param_beta_inf = None
+        self.param_hosp_capacity = None
+        self.param_init_susceptible = None
+        self.param_init_exposed = None
+        # Number of steps between two recorded states (None is one day)
+        self.param_output_interval = None
+        # Aggregated compartments
+        self.compartments = COMPARTMENTS
+
+        self.states_x = []
+
+
+    def per_node(self, value, default):
+        # per-node array of a parameter
+        if value is None:
+            value = default
+        value = np.broadcast_to(np.asarray(value, dtype=np.float64), (self.param_num_nodes,))
+        return value.copy()
+
+
+    def create(self):
+        node = self.node
+        num_nodes = self.param_num_nodes
+
+        # check correctenes of the initialization
+        if not node.check_init():
+            return 0
+
+        # the state graph is built once for all nodes
+        node.create_states()
+        node.indexes()
+        node.create_transitions()
+        node.vectorize()
+
+        # initial states, possibly different in every node
+        dtype = np.int64 if node.param_dtype == 'int64' else np.float64
+        self.states_x = np.tile(node.states_x.astype(dtype), (num_nodes, 1))
+        self.states_x[:, 1] = self.per_node(self.param_init_susceptible, node.init_susceptible)
+        self.states_x[:, node.ind_exp1] = self.per_node(self.param_init_exposed, node.init_exposed)
+        self.rngs = covid19_rng.streams(node.param_seed, node.param_run,
+                                        replicas=[node.param_replica], nodes=range(num_nodes))
+
+        # Transitions 8-9 with the beta of every node, and
+        # the hospital capacity of every node
+        rows = node.rows_foi
+        beta_exp = self.per_node(self.param_beta_exp, node.param_beta_exp)
+        beta_inf = self.per_node(self.param_beta_inf, node.param_beta_inf)
+        self.coef_foi = np.where(node.group_arr[rows] == 8, beta_exp[:, None], beta_inf[:, None]) * node.param_dt
+        self.hosp_capacity = self.per_node(self.param_hosp_capacity, node.param_hosp_capacity)
+
+        self.create_mobility()
+
+        # indicator matrix of the aggregated compartments
+        self.ind_comp = compartment_matrix(node)
+
+        if self.param_output_interval is None:
+            self.param_output_interval = max(1, round(1 / node.param_dt))
+
+        print("[INFO] Network of {} nodes was created...".format(num_nodes))
+        return 1
+
+
+    def create_mobility(self):
+        # mixing matrix of the commuters and relocation
+        # probabilities of the travellers, both sparse
+        node = self.node
+        num_nodes = self.param_num_nodes
+
+        mobility = self.mobility
+        if mobility is None:
+            mobility = sp.csr_matrix((num_nodes, num_nodes))
+        mobility = sp.csr_matrix(mobility, dtype=np.float64)
+        if mobility.shape != (num_nodes, num_nodes):
+            raise ValueError('Mobility matrix must be {0}x{0}'.format(num_nodes))
+        mobility.setdiag(0)
+        mobility.eliminate_zeros()
+        trips = np.asarray(mobility.sum(axis=1)).ravel()
+
+        # mixing[i, j]: share of the time the residents of i spend in j
+        away = np.minimum(trips * self.param_trip_len, 1)
+        scale = np.divide(away, trips, out=np.zeros(num_nodes), where=trips > 0)
+        self.mixing = (sp.diags(1 - away) + sp.diags(scale) @ mobility).tocsr()
+        self.mixing_t = self.mixing.T.tocsr()
+
+        # probability to relocate from i to j during one travel interval
+        if self.param_travel_interval is None:
+            self.param_travel_interval = max(1, round(1 / node.param_dt))
+        rate = self.param_relocation * self.param_travel_interval * node.param_dt
+        if np.any(trips * rate >= 1):
+            raise ValueError('Relocation probabilities of a node must sum below 1')
+        self.travel_prob = (mobility * rate).tocsr()
+        self.travel_gather = self.gather_matrix(self.travel_prob, np.arange(num_nodes), num_nodes)
+
+        # states moving with the travellers
+        chains = node.chains
+        self.ind_mobile = np.r_[1, chains['Vaccinated'], chains['Exposed'], chains['Infected'],
+                                node.comp_ind['Immunized']]
+
+
+    def gather_matrix(self, prob, targets, num_targets):
+        # sparse (num_targets, num_edges) matrix adding the travellers
+        # of every edge of prob into the target of its destination
+        return sp.csr_matrix((np.ones(prob.nnz, dtype=np.int64), (targets[prob.indices], np.arange(prob.nnz))),
+                             shape=(num_targets, prob.nnz))
+
+
+    def mixed_pressure(self, pressure, total_pop):
+        # infection pressure per individual where the
+        # residents of every node are
+        present = np.maximum(self.mixing_t @ total_pop, 1)
+        return self.mixing @ (self.mixing_t @ pressure / present)
+
+
+    def expval(self, x, pressure, rows=slice(None)):
+        # expected values of all transitions in the nodes of rows (all
+        # of them by default), with their mixed infection pressure and
+        # their own beta and hospital capacity
+        node = self.node
+        total_pop = x[:, 1:-1].sum(axis=1)
+        states_sin = x[:, node.chains['Severe_Infected']].sum(axis=1)
+
+        expval = node.coef_lo * x[:, node.source_arr]
+        expval[:, node.rows_birth] = node.coef_lo[node.rows_birth] * total_pop[:, None]
+        expval[:, node.rows_foi] = self.coef_foi[rows] * (x[:, 1] * pressure)[:, None]
+
+        # Transitions 22, 25 and 27 switch with the hospital load
+        hosp = node.rows_hosp
+        high = (states_sin >= self.hosp_capacity[rows])[:, None]
+        expval[:, hosp] = np.where(high, node.coef_hi[hosp], node.coef_lo[hosp]) * x[:, node.source_arr[hosp]]
+
+        return expval
+
+
+    def relocate(self, mobile, prob, gather, rngs):
+        # travellers out of the origin rows of prob, every node splits
+        # its mobile states between staying and its destinations with
+        # its own stream. Returns the mobile states left behind and the
+        # arrivals at the targets of gather.
+        count = np.maximum(mobile, 0).astype(np.int64)
+        moved = np.zeros((prob.nnz, count.shape[1]), dtype=np.int64)
+        for row, rng in enumerate(rngs):
+            lo, hi = prob.indptr[row], prob.indptr[row + 1]
+            if hi > lo:
+                pvals = np.append(prob.data[lo:hi], 0)
+                moved[lo:hi] = rng.multinomial(count[row], pvals)[:, :-1].T
+
+        leave = sp.csr_matrix((np.ones(prob.nnz, dtype=np.int64), np.arange(prob.nnz), prob.indptr),
+                              shape=(prob.shape[0], prob.nnz))
+        return mobile - leave @ moved, gather @ moved
+
+
+    def travel(self, x):
+        # relocated travellers of all nodes
+        left, arrived = self.relocate(x[:, self.ind_mobile], self.travel_prob,
+                                      self.travel_gather, self.rngs)
+        x[:, self.ind_mobile] = left + arrived
+
+
+    def stoch_solver(self):
+        # advance all nodes by one step with batched draws
+        node = self.node
+        x = self.states_x
+        pressure, _ = node.loads(x)
+        pressure = self.mixed_pressure(pressure, x[:, 1:-1].sum(axis=1))
+        dx = node.sample(self.expval(x, pressure), self.rngs)
+        self.states_x = node.vec_apply(x, dx)
+
+
+    def run(self):
+        node = self.node
+        interval = self.param_output_interval
+        num_out = (node.param_num_sim - 1) // interval + 1
+
+        # aggregated compartments of every node at every recorded step
+        comp_arr = np.zeros((num_out, self.param_num_nodes, len(self.compartments)), dtype=np.float32)
+
+        start = time.time()
+        for ind in range(node.param_num_sim):
+            if ind % interval == 0:
+                comp_arr[ind // interval] = self.states_x @ self.ind_comp
+            self.stoch_solver()
+            if (ind + 1) % self.param_travel_interval == 0:
+                self.travel(self.states_x)
+
+            if node.param_disp_interval and ind % node.param_disp_interval == 0:
+                end = time.time()
+                print("Sim.time: {:.4f} sec, Iteration: {}/{}".format(end - start, ind + 1, node.param_num_sim))
+
+        results = {'time': np.arange(num_out) * interval * node.param_dt}
+        for ind, name in enumerate(self.compartments):
+            results[name] = comp_arr[:, :, ind]
+
+        return results
+
+
+def main():
+    # initialize a new node and a network of cities on top of it,
+    # the epidemic starts in the largest city
+    num_nodes = 100
+    rng = np.random.default_rng(1)
+    populations = np.round(rng.lognormal(11, 1, num_nodes))
+    coords = rng.uniform(0, 1, (num_nodes, 2))
+
+    node = Node()
+    node.param_dt = 1/6
+    node.set_params({})
+    node.param_disp_interval = 0
+    network = Network(node, num_nodes, gravity_mobility(populations, coords))
+    network.param_init_susceptible = populations
+    network.param_init_exposed = np.where(np.arange(num_nodes) == np.argmax(populations), 10, 0)
+    network.param_hosp_capacity = np.round(populations * 885 / 1e6)
+
+    if network.create():
+        results = network.run()
+
+        print('Inf {:.0f}, Sev Inf {:.0f}, Dead {:.0f}'.format(np.max(results['Infected'].sum(axis=1)),
+                                                                np.max(results['Severe_Infected'].sum(axis=1)),
+                                                                np.max(results['Dead'].sum(axis=1))))
+
+        # if visualization is enabled then plot the
+        # Infected of every node and of the whole network
+        if node.param_vis_on:
+            import matplotlib.pyplot as plt
+
+            time_arr = results['time']
+
+            fig, ax = plt.subplots(figsize=(8,4))
+            ax.plot(time_arr, results['Infected'], linewidth=0.5, color='navy', alpha=0.3)
+            ax.plot(time_arr, results['Infected'].sum(axis=1), linewidth=1, color='r', label='Infected (network)')
+            plt.xlim(0, node.param_sim_len)
+            ax.grid(linestyle=':', linewidth=1)
+            plt.xlabel("Time (days)", fontsize=18)
+            plt.ylabel("Number of individuals", fontsize=18)
+            plt.legend(loc="upper left", ncol=1)
+            plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metapopulation network of covid19_network.py run on several processes.
+
+The nodes are cut into param_num_blocks blocks of consecutive nodes and
+the blocks are shared out between the worker processes. The states of
+all nodes live in one multiprocessing.shared_memory array and every
+worker advances the rows of its own blocks in place, block by block,
+with the step of Network (Node.sample and Node.vec_apply on the rows of
+the block). Two barriers separate the phases of a step:
+
+1. every block writes the infection pressure and population of its
+   nodes (two numbers per node) into shared memory;
+2. every block mixes the pressure over the network, samples and applies
+   its transitions and, on travel steps, draws its relocated
+   travellers. Arrivals in nodes of the same block are applied at once,
+   the ones in other blocks are written into the outbox of the block,
+   one row per boundary node;
+3. on travel steps, every block adds the outbox rows of the other
+   blocks that point to its nodes.
+
+Every node draws from its own stream, as in Network, so a run gives the
+same trajectories as Network for any number of workers and blocks.
+"""
+
+import numpy as np
+import os
+import threading
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from covid19_network import Network, gravity_mobility
+from covid19_simulator_v2 import Node
+
+
+class SharedArrays:
+    def __init__(self, specs=None, names=None):
+        # numpy arrays in shared memory blocks, created from specs
+        # {name: (shape, dtype)} or attached to the blocks of names
+        # {name: (shm_name, shape, dtype)} of another process
+        self.shm = {}
+        self.arrays = {}
+        if specs is not None:
+            for name, (shape, dtype) in specs.items():
+                size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+                self.shm[name] = shared_memory.SharedMemory(create=True, size=size)
+                self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self.shm[name].buf)
+                self.arrays[name][...] = 0
+        else:
+            for name, (shm_name, shape, dtype) in names.items():
+                self.shm[name] = shared_memory.SharedMemory(name=shm_name)
+                self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self.shm[name].buf)
+
+
+    def names(self):
+        return {name: (self.shm[name].name, arr.shape, arr.dtype.str)
+                for name, arr in self.arrays.items()}
+
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for shm in self.shm.values():
+            shm.close()
+            if unlink:
+                shm.unlink()
+
+
+def run_worker(network, names, blocks, barrier):
+    # worker entry point: advance the given blocks through
+    # the whole simulation, in step with the other workers
+    shared = SharedArrays(names=names)
+    try:
+        network.run_blocks(shared, blocks, barrier)
+    except BaseException:
+        # release the other workers waiting at the barriers
+        barrier.abort()
+        raise
+    finally:
+        shared.close()
+
+
+class PartitionedNetwork(Network):
+    def __init__(self, node, num_nodes, mobility=None):
+        Network.__init__(self, node, num_nodes, mobility)
+        # Number of worker processes (None uses all cores,
+        # 1 runs in the calling process)
+        self.param_workers = None
+        # Number of blocks of nodes (None is one block per worker)
+        self.param_num_blocks = None
+
+
+    def create(self):
+        if not Network.create(self):
+            return 0
+
+        num_nodes = self.param_num_nodes
+
+        # blocks of consecutive nodes
+        self.workers = self.param_workers or os.cpu_count()
+        num_blocks = min(self.param_num_blocks or self.workers, num_nodes)
+        bounds = np.linspace(0, num_nodes, num_blocks + 1).round().astype(int)
+        self.blocks = [slice(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+        # relocations of every block: arrivals into its own nodes
+        # first, then into one outbox row per boundary node
+        prob = self.travel_prob
+        self.block_travel = []
+        self.outbox_rows = []
+        start = 0
+        for block in self.blocks:
+            sub = prob[block]
+            dest = np.unique(sub.indices)
+            boundary = dest[(dest < block.start) | (dest >= block.stop)]
+            targets = np.zeros(num_nodes, dtype=np.intp)
+            targets[block] = np.arange(block.stop - block.start)
+            targets[boundary] = block.stop - block.start + np.arange(len(boundary))
+            self.block_travel.append((sub, self.gather_matrix(sub, targets, block.stop - block.start + len(boundary))))
+            self.outbox_rows.append((slice(start, start + len(boundary)), boundary))
+            start += len(boundary)
+        self.num_outbox = start
+
+        # outbox rows of the other blocks pointing into every block,
+        # as (outbox rows, local rows) pairs
+        self.block_inbox = []
+        for block in self.blocks:
+            inbox = []
+            for rows, boundary in self.outbox_rows:
+                inside = (boundary >= block.start) & (boundary < block.stop)
+                if inside.any():
+                    inbox.append((np.arange(rows.start, rows.stop)[inside], boundary[inside] - block.start))
+            self.block_inbox.append(inbox)
+
+        print("[INFO] Network was cut into {} blocks, {} boundary rows...".format(len(self.blocks), self.num_outbox))
+        return 1
+
+
+    def __getstate__(self):
+        # workers get the graph and coefficients, never the states
+        state = self.__dict__.copy()
+        state['states_x'] = None
+        return state
+
+
+    def run_blocks(self, shared, blocks, barrier):
+        # advance the blocks (indices into self.blocks) of one worker
+        node = self.node
+        states_x = shared['states_x']
+        loads = shared['loads']
+        outbox = shared['outbox']
+        comp_arr = shared['comp_arr']
+        interval = self.param_output_interval
+        travel_interval = self.param_travel_interval
+        report = node.param_disp_interval and 0 in blocks
+
+        start = time.time()
+        for ind in range(node.param_num_sim):
+            # 1 - pressure and population of the nodes of the blocks
+            for num in blocks:
+                rows = self.blocks[num]
+                x = states_x[rows]
+                if ind % interval == 0:
+                    comp_arr[ind // interval, rows] = x @ self.ind_comp
+                loads[0, rows], _ = node.loads(x)
+                loads[1, rows] = x[:, 1:-1].sum(axis=1)
+            barrier.wait()
+
+            # 2 - transitions and relocations out of the blocks
+            pressure = self.mixed_pressure(loads[0], loads[1])
+            travel = (ind + 1) % travel_interval == 0
+            for num in blocks:
+                rows = self.blocks[num]
+                x = states_x[rows]
+                dx = node.sample(self.expval(x, pressure[rows], rows), self.rngs[rows])
+                x[:] = node.vec_apply(x, dx)
+
+                if travel:
+                    size = rows.stop - rows.start
+                    out_rows = self.outbox_rows[num][0]
+                    left, arrived = self.relocate(x[:, self.ind_mobile], *self.block_travel[num],
+                                                  self.rngs[rows])
+                    x[:, self.ind_mobile] = left + arrived[:size]
+                    outbox[out_rows] = arrived[size:]
+            barrier.wait()
+
+            # 3 - relocations into the blocks
+            if travel:
+                for num in blocks:
+                    x = states_x[self.blocks[num]]
+                    for out_rows, local in self.block_inbox[num]:
+                        x[np.ix_(local, self.ind_mobile)] += outbox[out_rows]
+
+            if report and ind % node.param_disp_interval == 0:
+                end = time.time()
+                print("Sim.time: {:.4f} sec, Iteration: {}/{}".format(end - start, ind + 1, node.param_num_sim))
+
+
+    def run(self):
+        node = self.node
+        interval = self.param_output_interval
+        num_out = (node.param_num_sim - 1) // interval + 1
+        num_nodes = self.param_num_nodes
+
+        shared = SharedArrays({'states_x': (self.states_x.shape, self.states_x.dtype),
+                               'loads': ((2, num_nodes), np.float64),
+                               'outbox': ((self.num_outbox, len(self.ind_mobile)), np.int64),
+                               'comp_arr': ((num_out, num_nodes, len(self.compartments)), np.float32)})
+        try:
+            shared['states_x'][:] = self.states_x
+
+            workers = min(self.workers, len(self.blocks))
+            parts = [list(part) for part in np.array_split(np.arange(len(self.blocks)), workers)]
+
+            if workers == 1:
+                self.run_blocks(shared, parts[0], threading.Barrier(1))
+            else:
+                barrier = mp.Barrier(workers)
+                procs = [mp.Process(target=run_worker, args=(self, shared.names(), part, barrier))
+                         for part in parts]
+                for proc in procs:
+                    proc.start()
+                for proc in procs:
+                    proc.join()
+                if any(proc.exitcode != 0 for proc in procs):
+                    raise RuntimeError('A worker of the partitioned network failed')
+
+            self.states_x = shared['states_x'].copy()
+            comp_arr = shared['comp_arr'].copy()
+        finally:
+            shared.close(unlink=True)
+
+        results = {'time': np.arange(num_out) * interval * node.param_dt}
+        for ind, name in enumerate(self.compartments):
+            results[name] = comp_arr[:, :, ind]
+
+        return results
+
+
+def main():
+    # initialize a network of cities as in covid19_network.py and
+    # run it on all cores, the epidemic starts in the largest city
+    num_nodes = 1000
+    rng = np.random.default_rng(1)
+    populations = np.round(rng.lognormal(11, 1, num_nodes))
+    coords = rng.uniform(0, 1, (num_nodes, 2))
+
+    node = Node()
+    node.param_dt = 1/6
+    node.set_params({})
+    node.param_disp_interval = 0
+    network = PartitionedNetwork(node, num_nodes, gravity_mobility(populations, coords))
+    network.param_init_susceptible = populations
+    network.param_init_exposed = np.where(np.arange(num_nodes) == np.argmax(populations), 10, 0)
+    network.param_hosp_capacity = np.round(populations * 885 / 1e6)
+
+    if network.create():
+        start = time.time()
+        results = network.run()
+        print("Sim.time: {:.4f} sec".format(time.time() - start))
+
+        print('Inf {:.0f}, Sev Inf {:.0f}, Dead {:.0f}'.format(np.max(results['Infected'].sum(axis=1)),
+                                                                np.max(results['Severe_Infected'].sum(axis=1)),
+                                                                np.max(results['Dead'].sum(axis=1))))
+
+
+if __name__ == "__main__":
+    main()
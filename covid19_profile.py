@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiler of the step loop of a Node.
+
+A Profiler is attached to a node between two steps and detached again,
+by Node.run when param_profile is set or by hand at any time. While it
+is attached, the step methods of the node instance (stoch_solver,
+vec_expval, sample, apply_stage, apply_transitions, jit_solver) are
+replaced by timed wrappers; once detached the node runs its own methods
+again, so nothing is measured and nothing is paid when profiling is off.
+It records:
+
+- the latency of every step, as percentiles and a log-scale histogram;
+- the time spent on the expected values, on sampling and on applying
+  the flows, and the sampling and applying time of every transition
+  group (the Transition numbers of covid19_model.py). While attached the
+  stages of the node are split at the group boundaries; stages only
+  group transitions applied in order, so the results do not change;
+- with track_allocations, the memory allocated during every step
+  (tracemalloc, which slows the steps down several times).
+
+The compiled engine advances blocks of steps in one call, only the mean
+step time of every block is known. The chain engine has no transition
+groups, only its step latency is recorded.
+
+report() returns all of it as a dict, to_json() writes it and
+to_folded() writes folded stacks ("step;sample;Transition_8 123", in
+microseconds) as read by flamegraph.pl and speedscope.
+"""
+
+import json
+import time
+import numpy as np
+
+from covid19_model import scatter_index
+
+
+# Edges of the step latency histogram in seconds, 4 bins per decade
+# from 1 us to 10 s
+HIST_EDGES = 10.0 ** np.arange(-6, 1.01, 0.25)
+
+# Step methods of the node replaced while the profiler is attached
+WRAPPED = ['stoch_solver', 'vec_expval', 'sample', 'apply_stage', 'apply_transitions', 'jit_solver']
+
+
+class Profiler:
+    def __init__(self, track_allocations=False):
+        # Trace the memory allocated during every step
+        self.param_track_allocations = track_allocations
+        self.node = None
+        self.reset()
+
+
+    def reset(self):
+        # drop everything recorded so far
+        self.engine = None
+        self.latency = []
+        self.allocated = []
+        self.phases = dict.fromkeys(['expval', 'sample', 'apply'], 0.0)
+        self.groups = {}
+        self.in_step = False
+
+
+    def attach(self, node):
+        if self.node is not None:
+            raise ValueError('The profiler is already attached to a node')
+        self.node = node
+        self.engine = node.param_engine
+
+        # stages split at the transition groups, the group of every
+        # stage, and the rows of every group for the sampler
+        self.stages = getattr(node, 'stages', None)
+        if self.stages is not None:
+            group_arr = np.asarray(node.group_arr)
+            node.stages = self.group_stages(node, group_arr)
+            self.stage_group = {stage[0]: int(group_arr[stage[0]]) for stage in node.stages}
+            cuts = np.r_[0, np.flatnonzero(np.diff(group_arr)) + 1, len(group_arr)]
+            self.group_rows = [(lo, hi, int(group_arr[lo])) for lo, hi in zip(cuts[:-1], cuts[1:])]
+            for lo, hi, group in self.group_rows:
+                times = self.groups.setdefault(group, {'transitions': 0, 'sample': 0.0, 'apply': 0.0})
+                times['transitions'] = int(hi - lo)
+
+        self.original = {}
+        for name in WRAPPED:
+            if hasattr(node, name):
+                self.original[name] = getattr(node, name)
+                setattr(node, name, getattr(self, name))
+
+        self.tracing = False
+        if self.param_track_allocations:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+
+
+    def detach(self):
+        # the node gets its own methods and stages back
+        node = self.node
+        for name in self.original:
+            delattr(node, name)
+        if self.stages is not None:
+            node.stages = self.stages
+        if self.tracing:
+            self.tracemalloc.stop()
+        self.node = None
+
+
+    def group_stages(self, node, group_arr):
+        # stages of the node cut where the transition group changes
+        stages = []
+        for start, end, chain, _, _ in node.stages:
+            cuts = np.flatnonzero(np.diff(group_arr[start:end])) + start + 1
+            for lo, hi in zip(np.r_[start, cuts], np.r_[cuts, end]):
+                stages.append((int(lo), int(hi), chain,
+                               scatter_index(node.source_arr[lo:hi]),
+                               scatter_index(node.dest_arr[lo:hi])))
+        return stages
+
+
+    def stoch_solver(self, *args):
+        # one step, its latency and allocated memory
+        if self.param_track_allocations:
+            self.tracemalloc.reset_peak()
+            base = self.tracemalloc.get_traced_memory()[0]
+
+        self.in_step = True
+        start = time.perf_counter()
+        self.original['stoch_solver'](*args)
+        self.latency.append(time.perf_counter() - start)
+        self.in_step = False
+
+        if self.param_track_allocations:
+            self.allocated.append(self.tracemalloc.get_traced_memory()[1] - base)
+
+
+    def jit_solver(self, block, rng=None):
+        # a block of compiled steps, every step gets the mean time
+        start = time.perf_counter()
+        self.original['jit_solver'](block, rng)
+        if not self.in_step:
+            self.latency += [(time.perf_counter() - start) / len(block)] * len(block)
+
+
+    def vec_expval(self, x):
+        start = time.perf_counter()
+        expval = self.original['vec_expval'](x)
+        self.phases['expval'] += time.perf_counter() - start
+        return expval
+
+
+    def sample(self, expval, rng=None):
+        # one state vector is sampled group by group, in order, which
+        # draws the same numbers as one call; stacks in one call
+        sample = self.original['sample']
+        start = time.perf_counter()
+        if expval.ndim > 1 or self.stages is None:
+            dx = sample(expval, rng)
+        else:
+            parts = []
+            for lo, hi, group in self.group_rows:
+                lap = time.perf_counter()
+                parts.append(sample(expval[lo:hi], rng))
+                self.groups[group]['sample'] += time.perf_counter() - lap
+            dx = np.concatenate(parts)
+        self.phases['sample'] += time.perf_counter() - start
+        return dx
+
+
+    def apply_stage(self, y, dx, stage):
+        start = time.perf_counter()
+        self.original['apply_stage'](y, dx, stage)
+        elapsed = time.perf_counter() - start
+        self.groups[self.stage_group[stage[0]]]['apply'] += elapsed
+        self.phases['apply'] += elapsed
+
+
+    def apply_transitions(self, dx_arr, start, end):
+        lap = time.perf_counter()
+        self.original['apply_transitions'](dx_arr, start, end)
+        elapsed = time.perf_counter() - lap
+        self.groups[self.stage_group[start]]['apply'] += elapsed
+        self.phases['apply'] += elapsed
+
+
+    def report(self):
+        # everything recorded, times in seconds, memory in bytes
+        latency = np.asarray(self.latency)
+        total = float(latency.sum())
+        phases = {name: float(value) for name, value in self.phases.items()}
+        phases['other'] = total - sum(phases.values())
+
+        report = {'engine': self.engine, 'steps': len(latency), 'total': total, 'phases': phases,
+                  'groups': {'Transition_{}'.format(group): dict(times)
+                             for group, times in sorted(self.groups.items())}}
+        if len(latency):
+            counts = np.histogram(latency, np.r_[0, HIST_EDGES, np.inf])[0]
+            report['latency'] = {'mean': float(latency.mean()), 'max': float(latency.max()),
+                                 'p50': float(np.percentile(latency, 50)),
+                                 'p90': float(np.percentile(latency, 90)),
+                                 'p99': float(np.percentile(latency, 99)),
+                                 'edges': HIST_EDGES.tolist(), 'counts': counts.tolist()}
+        if self.allocated:
+            allocated = np.asarray(self.allocated)
+            report['allocated'] = {'mean': float(allocated.mean()), 'max': int(allocated.max())}
+        return report
+
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+
+    def folded(self):
+        # folded stacks of the whole run in microseconds
+        report = self.report()
+        lines = []
+        for phase in ['expval', 'sample', 'apply']:
+            rest = report['phases'][phase]
+            for name, times in report['groups'].items():
+                if phase in times:
+                    lines.append(('step;{};{}'.format(phase, name), times[phase]))
+                    rest -= times[phase]
+            lines.append(('step;{}'.format(phase), rest))
+        lines.append(('step', report['phases']['other']))
+        return ['{} {}'.format(stack, round(value * 1e6)) for stack, value in lines if round(value * 1e6) > 0]
+
+
+    def to_folded(self, path):
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.folded()) + '\n')
+
+
+    def summary(self, top=5):
+        # one line of totals and the most expensive transition groups
+        report = self.report()
+        if not report['steps']:
+            return '[INFO] Profile: no step was recorded'
+        lines = ['[INFO] Profile of {} steps ({}): {:.1f} us per step, p99 {:.1f} us, {}'.format(
+            report['steps'], report['engine'], report['latency']['mean'] * 1e6, report['latency']['p99'] * 1e6,
+            ', '.join('{} {:.0%}'.format(name, value / report['total'])
+                      for name, value in report['phases'].items() if report['total'] > 0))]
+        if 'allocated' in report:
+            lines.append('[INFO] Allocated per step: {:.0f} bytes, max {} bytes'.format(
+                report['allocated']['mean'], report['allocated']['max']))
+        groups = sorted(report['groups'].items(), key=lambda item: -(item[1]['sample'] + item[1]['apply']))
+        for name, times in groups[:top]:
+            lines.append('        {:<14} {:>7} transitions, sample {:8.1f} ms, apply {:8.1f} ms'.format(
+                name, times['transitions'], times['sample'] * 1e3, times['apply'] * 1e3))
+        return '\n'.join(lines)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recorders of Node trajectories.
+
+A recorder is handed the state vector at every step of Node.run and
+keeps only what it needs: the per-compartment sums, the full state
+vector every k-th step, or the full state vector at every step.
+"""
+
+import numpy as np
+
+
+# Aggregated compartments
+COMPARTMENTS = ['Susceptible', 'Exposed', 'Quarantined', 'Infected',
+                'Isolated', 'Severe_Infected', 'Immunized', 'Dead']
+
+
+def compartment_matrix(node):
+    # (num_states, num_compartments) indicator matrix, the compartment
+    # sums of a state vector x are given by x @ compartment_matrix(node)
+    # sums are zero for compartments the model does not have
+    # (Isolated of the v1 model)
+    ind_comp = np.zeros((node.param_num_states, len(COMPARTMENTS)))
+    for col, name in enumerate(COMPARTMENTS):
+        if name in node.comp_ind:
+            ind_comp[node.comp_ind[name], col] = 1
+
+    return ind_comp
+
+
+class AggregateRecorder:
+    def __init__(self):
+        self.time = []
+        self.aggregates = []
+
+
+    def start(self, node):
+        # called once the states and transitions are created
+        self.param_dt = node.param_dt
+        self.param_num_sim = node.param_num_sim
+        self.states_name = node.states_name
+        self.ind_comp = compartment_matrix(node)
+
+        self.time = np.arange(node.param_num_sim) * node.param_dt
+        self.aggregates = np.zeros((node.param_num_sim, len(COMPARTMENTS)))
+
+
+    def record(self, ind, states_x):
+        # sums are computed in place, the per-state
+        # trajectory is never stored
+        self.aggregates[ind] = states_x @ self.ind_comp
+
+
+    def finish(self):
+        pass
+
+
+    def __getitem__(self, name):
+        # aggregated trajectory of a compartment
+        return self.aggregates[:, COMPARTMENTS.index(name)]
+
+
+class DecimatedRecorder(AggregateRecorder):
+    def __init__(self, interval=None):
+        # Number of steps between two stored state vectors,
+        # None stores one state vector per simulated day
+        AggregateRecorder.__init__(self)
+        self.param_interval = interval
+        self.states_time = []
+        self.states_arr = []
+
+
+    def start(self, node):
+        AggregateRecorder.start(self, node)
+
+        if self.param_interval is None:
+            self.param_interval = max(1, round(1 / node.param_dt))
+
+        num_rec = (node.param_num_sim - 1) // self.param_interval + 1
+        self.states_time = self.time[::self.param_interval]
+        # integer states are stored exactly, as in MemmapRecorder
+        dtype = np.int64 if node.param_dtype == 'int64' else np.float32
+        self.states_arr = np.zeros((num_rec, node.param_num_states), dtype=dtype)
+
+
+    def record(self, ind, states_x):
+        AggregateRecorder.record(self, ind, states_x)
+
+        if ind % self.param_interval == 0:
+            self.states_arr[ind // self.param_interval] = states_x
+
+
+class FullRecorder(DecimatedRecorder):
+    def __init__(self):
+        # every state vector of every step
+        DecimatedRecorder.__init__(self, interval=1)
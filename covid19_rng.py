@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Random streams of the simulators.
+
+Every stream is a numpy Generator over the counter-based Philox bit
+generator, keyed by (run, replica, node) under a root seed: it is the
+child SeedSequence(seed).spawn()[run].spawn()[replica].spawn()[node],
+built directly from its key. Streams of different keys do not overlap,
+and a stream only depends on its key, not on which process creates it
+or in which order. So a replica of an ensemble, a node of a network or
+a scenario of a sweep can be run on its own, on any worker, and
+reproduce its trajectory bit for bit.
+
+Nothing here touches the global state of random or np.random; the
+generators are passed explicitly to the samplers.
+"""
+
+import numpy as np
+
+
+def stream(seed, run=0, replica=0, node=0):
+    # random generator of one (run, replica, node) key
+    key = np.random.SeedSequence(seed, spawn_key=(run, replica, node))
+    return np.random.Generator(np.random.Philox(key))
+
+
+def streams(seed, run=0, replicas=(0,), nodes=(0,)):
+    # generators of all (replica, node) keys of a run,
+    # replica-major: replicas[0] with all nodes first
+    return [stream(seed, run, replica, node) for replica in replicas for node in nodes]
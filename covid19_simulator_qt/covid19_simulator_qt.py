@@ -6,595 +6,321 @@ Created on Fri Mar 27 09:24:35 2020
 @author: askat
 """
 
-import random
 import numpy as np
+import os
+import threading
 import time
-import matplotlib.pyplot as plt
 import sys
-from PyQt5 import QtWidgets, uic
+from PyQt5 import QtCore, QtWidgets, uic
+
+# the model and its engines live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import covid19_recorder
+import covid19_simulator
+
+
+# the form is loaded when the window is created, not at import
+qtCreatorFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mainwindow.ui")
+
+# Aggregated compartments, in the columns of the snapshots
+COMPARTMENTS = ['Susceptible', 'Exposed', 'Quarantined', 'Infected',
+                'Severe_Infected', 'Immunized', 'Dead']
+
+# Node parameters set from the spin boxes of the same name
+WIDGET_PARAMS = ['param_br', 'param_dr', 'param_vr', 'param_vir', 'param_mir',
+                 'param_beta_exp', 'param_qr', 'param_beta_inf', 'param_sir',
+                 'param_eps_exp', 'param_eps_qua', 'param_eps_sev',
+                 'param_hosp_capacity', 'param_gamma_mor', 'param_gamma_mor1',
+                 'param_gamma_mor2', 'param_gamma_im', 'param_t_exp', 'param_t_inf',
+                 'param_t_vac', 'param_sim_len', 'init_susceptible', 'init_exposed',
+                 'init_quarantined', 'init_infected', 'init_severe_infected']
+
+
+def downsample(x, y, num_columns):
+    # keep the minimum and the maximum of y in each of num_columns
+    # columns of consecutive points, in their order, so that a long
+    # trace draws the same envelope with at most 2 * num_columns points
+    if len(x) <= 2 * num_columns:
+        return x, y
+    width = -(-len(x) // num_columns)
+    cols = np.pad(y, (0, width * num_columns - len(y)), mode='edge').reshape(num_columns, width)
+    start = np.arange(num_columns)[:, None] * width
+    ind = np.sort(np.c_[cols.argmin(axis=1), cols.argmax(axis=1)], axis=1) + start
+    ind = np.minimum(ind.ravel(), len(x) - 1)
+    return x[ind], y[ind]
+
+
+class SimulationWorker(QtCore.QObject):
+    # snapshot(time, aggregates) with one row per simulated day so far,
+    # finished(time, aggregates, cancelled) with one row per step, sent
+    # after every run, also after error(message) when the run failed
+    snapshot = QtCore.pyqtSignal(object, object)
+    progress = QtCore.pyqtSignal(str)
+    error = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal(object, object, bool)
+
+    def __init__(self, node):
+        QtCore.QObject.__init__(self)
+        # Node holding the parameters, the states and the solver
+        self.node = node
+        # Number of steps between two snapshot rows (None is one day)
+        self.param_snapshot_interval = None
+        # Shortest time in seconds between two emitted snapshots
+        self.param_emit_period = 0.1
+        self.stop = threading.Event()
+
+    def cancel(self):
+        # called from the GUI thread, the loop stops before its next step
+        self.stop.set()
+
+    def run(self):
+        # the whole simulation runs in the worker thread, the GUI only
+        # receives copies of the aggregated compartments
+        node = self.node
+        time_arr = np.zeros(0)
+        comp_arr = np.zeros((0, len(COMPARTMENTS)), dtype=np.float32)
+        # number of steps recorded so far
+        done = 0
+        try:
+            node.create_states()
+            node.indexes()
+            node.create_transitions()
+            node.vectorize()
+
+            # columns of the compartments of the window
+            ind_comp = covid19_recorder.compartment_matrix(node)
+            ind_comp = ind_comp[:, [covid19_recorder.COMPARTMENTS.index(name) for name in COMPARTMENTS]]
+
+            interval = self.param_snapshot_interval or max(1, round(1 / node.param_dt))
+            time_arr = np.arange(node.param_num_sim) * node.param_dt
+            comp_arr = np.zeros((node.param_num_sim, len(COMPARTMENTS)), dtype=np.float32)
 
+            start = time.time()
+            last_emit = start
+            for ind, states_x in enumerate(node.steps()):
+                if self.stop.is_set():
+                    break
+                comp_arr[ind] = states_x @ ind_comp
+                done = ind + 1
+
+                if node.param_disp_interval and ind % node.param_disp_interval == 0:
+                    end = time.time()
+                    self.progress.emit("Sim.time: {:.4f} sec, Iteration: {}/{}".format(
+                        end - start, ind + 1, node.param_num_sim))
 
-qtCreatorFile = "mainwindow.ui"
-Ui_MainWindow, QtBaseClass = uic.loadUiType(qtCreatorFile)
+                if time.time() - last_emit > self.param_emit_period:
+                    last_emit = time.time()
+                    self.snapshot.emit(time_arr[:ind + 1:interval].copy(), comp_arr[:ind + 1:interval].copy())
+        except Exception as err:
+            self.error.emit('{}: {}'.format(type(err).__name__, err))
+        finally:
+            # the window waits for this signal to end the thread
+            self.finished.emit(time_arr[:done], comp_arr[:done], self.stop.is_set())
 
 
-class Node(QtWidgets.QMainWindow, Ui_MainWindow):
+class MainWindow(QtWidgets.QMainWindow):
     def __init__(self):
         QtWidgets.QMainWindow.__init__(self)
-        Ui_MainWindow.__init__(self)
-        self.setupUi(self)
+        uic.loadUi(qtCreatorFile, self)
         self.setWindowTitle("COVID-19 Epidemic Simulator")
         self.set_params.clicked.connect(self.set_parameters)
         self.set_params.clicked.connect(self.simulate)
-
-    def set_parameters(self):
-        # Daily birth rate
-        self.param_br = self.param_br.value()
-        # Daily mortality rate except infected people
-        self.param_dr = self.param_dr.value()
-        # Daily vaccination rate
-        self.param_vr = self.param_vr.value()
-        # Ratio of the immunized after vaccination
-        self.param_vir = self.param_vir.value()
-        # Maternal immunization rate
-        self.param_mir = self.param_mir.value()
-        # Susceptible to exposed transition constant
-        self.param_beta_exp = self.param_beta_exp.value()
-        # Daily quarantine rate (Ratio of Exposed getting Quarantined)
-        self.param_qr = self.param_qr.value()
-        # Susceptible to infected transition constant
-        self.param_beta_inf = self.param_beta_inf.value()
-        # Daily severe infected rate (Ratio of Infected getting Severe Infected
-        self.param_sir = self.param_sir.value()
-        # Disease transmission rate of exposed compared to the infected
-        self.param_eps_exp = self.param_eps_exp.value()
-        # Disease transmission rate of quarantined compared to the infected
-        self.param_eps_qua = self.param_eps_qua.value()
-        # Disease transmission rate of severe infected compared to the infected
-        self.param_eps_sev = self.param_eps_sev.value()
-        # Maximum amount patients that hospital can accommodate
-        self.param_hosp_capacity = self.param_hosp_capacity.value()
-        # Infected to Dead transition probability
-        self.param_gamma_mor = self.param_gamma_mor.value()
-        # Severe Infected (Hospitalized) to Dead transition probability
-        self.param_gamma_mor1 = self.param_gamma_mor1.value()
-        # Severe Infected (Not Hospitalized) to Dead transition probability
-        self.param_gamma_mor2 = self.param_gamma_mor2.value()
-        # Infected to Recovery Immunized transition probability
-        self.param_gamma_im = self.param_gamma_im.value()
-        # Sampling time in days (1/24 corresponds to one hour)
-        self.param_dt = 1/24
-        # Number of states
-        self.param_num_states = 0
-        # Incubation period
-        self.param_t_exp = self.param_t_exp.value()
-        # Infection period
-        self.param_t_inf = self.param_t_inf.value()
-        # Vaccination immunization period
-        self.param_t_vac = self.param_t_vac.value()
-        # Length of simulation in days
-        self.param_sim_len = float(self.param_sim_len.value())
-        # Number of simulation
-        self.param_num_sim = int(self.param_sim_len / self.param_dt) + 1
-        self.param_n_exp = round(self.param_t_exp / self.param_dt)
-        self.param_n_inf = round(self.param_t_inf / self.param_dt)
-        self.param_n_vac = round(self.param_t_vac / self.param_dt)
-        # display interval
-        self.param_disp_interval = 100
-        # Visualize results after simulation
+        self.cancel_sim.clicked.connect(self.cancel)
+        # the plots live in the window, they are built
+        # once, by the first run that shows them
+        self.canvas = None
+        self.sim_thread = None
+        self.worker = None
+        # error message of the last run, None if it did not fail
+        self.sim_error = None
+        # Visualize results while the simulation runs
         self.param_vis_on = 1
-        # generate random numbers
-        np.random.seed(1)
-        self.param_rand_seed = np.random.randint(low=1, high=100, size=625)
-        # Define the initial values for the states
-        self.init_susceptible = self.init_susceptible.value()
-        self.init_exposed = self.init_exposed.value()
-        self.init_quarantined = self.init_quarantined.value()
-        self.init_infected = self.init_infected.value()
-        self.init_severe_infected = self.init_severe_infected.value()
-        self.init_vaccination_imm = 0
-        self.init_maternally_imm = 0
-        self.init_recovery_imm = 0
-        # Define states
-        self.states_x = [0, self.init_susceptible]
-        self.states_dx = []
-        self.states_name = ['Birth', 'Susceptible']
-        self.states_type = ['Birth', 'Susceptible']
-        # Define transitions
-        self.source = ['Birth', 'Birth']
-        self.dest = ['Susceptible', 'Maternally_Immunized']
-        self.source_ind = []
-        self.dest_ind = []
-
-    def check_init(self):
-        if self.param_beta_exp == 0 and self.param_beta_inf == 0:
-            print('[ERROR] Both beta_exp and beta_inf cannot be zero.')
-            return 0
-        elif self.param_beta_exp != 0 and self.param_beta_inf != 0:
-            print('[ERROR] Both beta_exp and beta_inf cannot be non-zero.')
-            return 0
-        else:
-            print("[INFO] Initialization was done properly!")
-            return 1
-
-    def create_states(self):
-        # create some temporal variables
-        n_vac = self.param_n_vac
-        n_vac_exp = n_vac + self.param_n_exp
-        n_vac_2exp = n_vac_exp + self.param_n_exp
-        n_vac_2exp_inf = n_vac_2exp + self.param_n_inf
-        n_vac_2exp_2inf = n_vac_2exp_inf + self.param_n_inf + 1
-        count = len(self.states_name) - 1
-
-        # loop to create states
-        while count < n_vac_2exp_2inf:
-            # Vaccinated States
-            if count <= n_vac:
-                self.states_name.append('Vaccinated_{}'.format(count))
-                self.states_type.append('Susceptible')
-            # Exposed States (Includes both exposed and quarantined)
-            elif count > n_vac and count <= n_vac_exp:
-                self.states_name.append('Exposed_{}'.format(count - n_vac))
-                self.states_type.append('Exposed')
-                if count == n_vac + 1:
-                    self.states_x.append(self.init_exposed)
-                    count += 1
-                    continue
-            elif count > n_vac_exp and count <= n_vac_2exp:
-                self.states_name.append('Quarantined_{}'.
-                                        format(count - n_vac_exp))
-                self.states_type.append('Exposed')
-                if count == n_vac_exp + 1:
-                    self.states_x.append(self.init_quarantined)
-                    count += 1
-                    continue
-            # Infected States (Includes both infected and isolated)
-            elif count > n_vac_2exp and count <= n_vac_2exp_inf:
-                self.states_name.append('Infected_{}'.
-                                        format(count - n_vac_2exp))
-                self.states_type.append('Infected')
-                if count == n_vac_2exp + 1:
-                    self.states_x.append(self.init_infected)
-                    count += 1
-                    continue
-            else:
-                self.states_name.append('Severe_Infected_{}'.
-                                        format(count - n_vac_2exp_inf))
-                self.states_type.append('Infected')
-                if count == n_vac_2exp + 1:
-                    self.states_x.append(self.init_isolated)
-                    count += 1
-                    continue
-
-            self.states_x.append(0)
-
-            count += 1
-
-        # Add the Immunized and dead states
-        self.states_name.append('Vaccination_Immunized')
-        self.states_type.append('Immunized')
-        self.states_x.append(self.init_vaccination_imm)
-
-        self.states_name.append('Maternally_Immunized')
-        self.states_type.append('Immunized')
-        self.states_x.append(self.init_maternally_imm)
-
-        self.states_name.append('Recovery_Immunized')
-        self.states_type.append('Immunized')
-        self.states_x.append(self.init_recovery_imm)
-
-        self.states_name.append('Dead')
-        self.states_type.append('Dead')
-        self.states_x.append(0)
-
-        # convert states into numpy arrays
-        # for fast processing
-        self.states_x = np.asarray(self.states_x, dtype=np.float32)
-        self.states_dx = np.zeros(self.states_x.shape, dtype=np.float32)
-
-        # initialize number of states
-        self.param_num_states = len(self.states_x)
-
-        print("[INFO] States were created...")
-
-    def create_transitions(self):
-        # create some temporal variables
-        count = len(self.source) - 1
-        n_st = self.param_num_states
-        n_vac = self.param_n_vac
-        n_exp = self.param_n_exp
-        n_inf = self.param_n_inf
-
-        # Transition 3 - Any State except Birth to Dead (Natural Mortality)
-        for ind in range(count, n_st - 1):
-            self.source.append(self.states_name[ind])
-            self.dest.append('Dead')
-
-        # Transition 4 - Susceptible to Vaccinated[1]
-        if self.param_vr != 0:
-            self.source.append('Susceptible')
-            self.dest.append('Vaccinated_1')
-
-        # Transition 5 - Vaccinated[i] to Vaccinated[i+1] until i+1 == n_vac
-        if self.param_n_vac != 0:
-            for ind in range(n_vac - 1):
-                self.source.append(self.states_name[2 + ind])
-                self.dest.append(self.states_name[3 + ind])
-
-        if self.param_vr != 0:
-            # Transition 6 - Vaccinated[n_vac] to Vaccination_Immunized
-            self.source.append('Vaccinated_{}'.format(n_vac))
-            self.dest.append('Vaccination_Immunized')
-
-            # Transition 7 - Vaccinated[n_vac] to Susceptible
-            self.source.append('Vaccinated_{}'.format(n_vac))
-            self.dest.append('Susceptible')
-
-        # Transition 8 - Susceptible to Exposed[1]
-        if self.param_n_exp != 0:
-            self.source.append('Susceptible')
-            self.dest.append('Exposed_1')
-
-        # Transition 9 - Susceptible to Infected[1]
-        self.source.append('Susceptible')
-        self.dest.append('Infected_1')
-
-        # Transition 10 - Exposed[i] to Exposed[i+1] until i+1 == n_exp
-        for ind in range(n_exp - 1):
-            self.source.append('Exposed_{}'.format(ind + 1))
-            self.dest.append('Exposed_{}'.format(ind + 2))
-
-        # Transition 11 - Exposed[n_inc] to Infected[1]
-        if self.param_n_exp != 0:
-            self.source.append('Exposed_{}'.format(n_exp))
-            self.dest.append('Infected_1')
-
-        # Transition 12 - Exposed[i] to Quarantined[i+1] until i+1 == n_exp
-        for ind in range(n_exp - 1):
-            self.source.append('Exposed_{}'.format(ind + 1))
-            self.dest.append('Quarantined_{}'.format(ind + 2))
-
-        # Transition 13 - Quarantined[i] to Quarantined[i+1] until i+1 == n_exp
-        for ind in range(n_exp - 1):
-            self.source.append('Quarantined_{}'.format(ind + 1))
-            self.dest.append('Quarantined_{}'.format(ind + 2))
-
-        # Transition 14 - Quarantined[n_exp] to Infected[1]
-        if self.param_n_exp != 0:
-            self.source.append('Quarantined_{}'.format(n_exp))
-            self.dest.append('Infected_1')
-
-        # Transition 15 - Infected[i] to Infected[i+1] until i+1 == n_inf
-        for ind in range(n_inf - 1):
-            self.source.append('Infected_{}'.format(ind + 1))
-            self.dest.append('Infected_{}'.format(ind + 2))
-
-        # Transition 16 - Severe_Infected[i] to Severe_Infected[i+1]
-        for ind in range(n_inf - 1):
-            self.source.append('Severe_Infected_{}'.format(ind + 1))
-            self.dest.append('Severe_Infected_{}'.format(ind + 2))
-
-        # Transition 17 - Infected[i] to Severe_Infected[i+1]
-        for ind in range(n_inf - 1):
-            self.source.append('Infected_{}'.format(ind + 1))
-            self.dest.append('Severe_Infected_{}'.format(ind + 2))
-
-        # Transition 18 - Infected[n_inf] to Recovery_Immunized
-        self.source.append('Infected_{}'.format(n_inf))
-        self.dest.append('Recovery_Immunized')
-
-        # Transition 19 - Severe_Infected[n_inf] to Recovery Immunized
-        self.source.append('Severe_Infected_{}'.format(n_inf))
-        self.dest.append('Recovery_Immunized')
-
-        # Transition 20 - Infected[n_inf] to Susceptible
-        self.source.append('Infected_{}'.format(n_inf))
-        self.dest.append('Susceptible')
-
-        # Transition 21 - Severe_Infected[n_inf] to Susceptible
-        self.source.append('Severe_Infected_{}'.format(n_inf))
-        self.dest.append('Susceptible')
-
-        # Transition 22 - Infected[n_inf] to Dead
-        self.source.append('Infected_{}'.format(n_inf))
-        self.dest.append('Dead')
-
-        # Transition 23 - Severe_Infected[n_inf] to Dead
-        self.source.append('Severe_Infected_{}'.format(n_inf))
-        self.dest.append('Dead')
-
-        for ind in range(len(self.source)):
-            self.source_ind.append(self.states_name.index(self.source[ind]))
-            self.dest_ind.append(self.states_name.index(self.dest[ind]))
-
-        print("[INFO] State transitions were created...")
-
-    def indexes(self):
-        # define vectors of indices
-        self.ind_vac = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_inf = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_exp = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_sin = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_qua = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_imm = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_sus = np.zeros((len(self.states_x)), dtype=np.float32)
-
-        # intialize vectors of indices
-        for ind in range(len(self.states_name)):
-            if self.states_name[ind] == 'Vaccinated_{}'.format(self.param_n_vac):
-                self.ind_vac[ind] = 1
-            elif 'Infected_' in self.states_name[ind] and 'Severe_Infected_' not in self.states_name[ind]:
-                self.ind_inf[ind] = 1
-            elif 'Exposed_' in self.states_name[ind]:
-                self.ind_exp[ind] = 1
-            elif 'Severe_Infected_' in self.states_name[ind]:
-                self.ind_sin[ind] = 1
-            elif 'Quarantined_' in self.states_name[ind]:
-                self.ind_qua[ind] = 1
-            elif 'Immunized' in self.states_type[ind]:
-                self.ind_imm[ind] = 1
-            elif 'Susceptible' in self.states_type[ind]:
-                self.ind_sus[ind] = 1
-
-        # define other indices
-        self.ind_exp1 = self.states_name.index('Exposed_1')
-        self.ind_expn = self.states_name.index('Exposed_{}'.
-                                               format(self.param_n_exp))
-
-        self.ind_qua1 = self.states_name.index('Quarantined_1')
-        self.ind_quan = self.states_name.index('Quarantined_{}'.
-                                               format(self.param_n_exp))
-
-        self.ind_sin1 = self.states_name.index('Severe_Infected_1')
-        self.ind_sinn = self.states_name.index('Severe_Infected_{}'.
-                                               format(self.param_n_inf))
-
-        self.ind_inf1 = self.states_name.index('Infected_1')
-        self.ind_infn = self.states_name.index('Infected_{}'.
-                                               format(self.param_n_inf))
-
-    def dx_generator(self, size, val):
-        dx = 0
-
-        for ind in range(size):
-            rand_num = random.uniform(0, 1)
-            if rand_num < val:
-                dx += 1
-
-        return dx
-
-    def stoch_solver(self):
-        # define a list to store transitions
-        expval = []
-        state_1 = self.states_x[1]
-
-        # Total population is the sum of all states except birth and death
-        total_pop = self.states_x[1:-1].sum()
-
-        # Transition 1 - Birth to Susceptible
-        expval.append(total_pop * self.param_br *
-                      (1 - self.param_mir) * self.param_dt)
-
-        # Transition 2 - Birth to Maternally Immunized
-        expval.append(total_pop * self.param_br *
-                      self.param_mir * self.param_dt)
-
-        # Transition 3 - Any State except Birth to Dead (Natural Mortality)
-        expval += (self.states_x[1:self.param_num_states - 1] *
-                   self.param_dr * self.param_dt).tolist()
-
-        # Transition 4 - Susceptible to Vaccinated[1]
-        if self.param_vr != 0:
-            expval.append(state_1 * self.param_vr * self.param_dt)
-
-        # Transition 5 - Vaccinated[i] to Vaccinated[i+1] until i+1 == n_vac
-        if self.param_n_vac != 0:
-            expval += (self.states_x[2:self.param_n_vac + 1] *
-                       (1 - self.param_dr * self.param_dt)).tolist()
-
-        # Transition 6 - Vaccinated[n_vac] to Vaccination_Immunized
-        # Transition 7 - Vaccinated[n_vac] to Susceptible
-        if self.param_vr != 0:
-            state_vac = self.states_x.dot(self.ind_vac).sum()
-            expval.append(state_vac * self.param_vir)
-            expval.append(state_vac * (1 - self.param_dr *
-                          self.param_dt - self.param_vir))
-
-        # Transition 8 - Susceptible to Exposed[1]
-        temp1 = self.states_x.dot(self.ind_inf).sum() + self.param_eps_exp * \
-                self.states_x.dot(self.ind_exp).sum() + self.param_eps_sev * \
-                self.states_x.dot(self.ind_sin).sum() + self.param_eps_qua * \
-                self.states_x.dot(self.ind_qua).sum()
-
-        if self.param_n_exp != 0:
-            expval.append(state_1 * temp1 *
-                          self.param_beta_exp * self.param_dt / total_pop)
-
-        # Transition 9 - Susceptible to Infected[1]
-        expval.append(state_1 * temp1 * self.param_beta_inf *
-                      self.param_dt / total_pop)
-
-        # Transition 10 - Exposed[i] to Exposed[i+1] until i+1 == n_exp
-        expval += (self.states_x[self.ind_exp1:self.ind_exp1 + self.param_n_exp - 1] *
-                   (1 - self.param_dr * self.param_dt - self.param_qr * self.param_dt)).tolist()
-
-        # Transition 11 - Exposed[n_exp] to Infected[1]
-        if self.param_n_exp != 0:
-            expval.append(self.states_x[self.ind_expn] *
-                          (1 - self.param_dr * self.param_dt))
-
-        # Transition 12 - Exposed[i] to Quarantined[i+1] until i+1 == n_exp
-        expval += (self.states_x[self.ind_exp1:self.ind_exp1 + self.param_n_exp - 1] *
-                   (self.param_qr * self.param_dt)).tolist()
-
-        # Transition 13 - Quarantined[i] to Quarantined[i+1] until i+1 == n_exp
-        expval += (self.states_x[self.ind_qua1:self.ind_qua1 + self.param_n_exp - 1] *
-                   (1 - self.param_dr * self.param_dt)).tolist()
-
-        # Transition 14 - Quarantined[n_exp] to Infected[1]
-        if self.param_n_exp != 0:
-            expval.append(self.states_x[self.ind_quan] *
-                          (1 - self.param_dr * self.param_dt))
-
-        # Transition 15 - Infected[i] to Infected[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_inf1:self.ind_inf1 + self.param_n_inf - 1] *
-                   (1 - self.param_dr * self.param_dt - self.param_sir * self.param_dt)).tolist()
-
-        # Transition 16 - Severe_Infected[i] to Severe_Infected[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_sin1:self.ind_sin1 + self.param_n_inf - 1] *
-                   (1 - self.param_dr * self.param_dt)).tolist()
-
-        # Transition 17 - Infected[i] to Severe_Infected[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_inf1:self.ind_inf1 + self.param_n_inf - 1] *
-                   (self.param_sir * self.param_dt)).tolist()
-
-        # Transition 18 - Infected[n_inf] to Recovery_Immunized
-        expval.append(self.states_x[self.ind_infn] * self.param_gamma_im)
-
-        # Transition 19 - Severe_Infected[n_inf] to Recovery Immunized
-        expval.append(self.states_x[self.ind_sinn] * self.param_gamma_im)
-
-        # Transition 20 - Infected[n_inf] to Susceptible
-        expval.append(self.states_x[self.ind_infn] *
-                      (1 - self.param_gamma_mor - self.param_gamma_im))
-
-        # Transition 21 - Severe_Infected[n_inf] to Susceptible
-        states_sin = self.states_x.dot(self.ind_sin).sum()
-
-        if states_sin < self.param_hosp_capacity:
-            expval.append(self.states_x[self.ind_sinn] *
-                          (1 - self.param_gamma_mor1 - self.param_gamma_im))
-        else:
-            expval.append(self.states_x[self.ind_sinn] *
-                          (1 - self.param_gamma_mor2 - self.param_gamma_im))
 
-        # Transition 22 - Infected[n_inf] to Dead
-        expval.append(self.states_x[self.ind_infn] * self.param_gamma_mor)
+        # Node of the v1 model (covid19_simulator.py) holding the
+        # parameters and the states, its compiled transition table is
+        # reused by the next runs as long as the periods are unchanged
+        self.node = covid19_simulator.Node()
+        self.node.param_engine = 'vectorized'
+        self.node.param_sampler = 'binomial'
+        self.node.param_disp_interval = 100
+        self.node.param_vis_on = 0
 
-        # Transition 23 - Severe_Infected[n_inf] to Dead
-        if states_sin < self.param_hosp_capacity:
-            expval.append(self.states_x[self.ind_sinn] * self.param_gamma_mor1)
-        else:
-            expval.append(self.states_x[self.ind_sinn] * self.param_gamma_mor2)
-
-        # Randomly generate the transition value based on the expected value
-        for eval, sind, dind in zip(expval, self.source_ind, self.dest_ind):
-            if eval < 10 and eval > 0:
-                temp1 = int(np.ceil(eval * 10 + np.finfo(np.float32).eps))
-                temp2 = eval/temp1
-                dx = self.dx_generator(temp1, temp2)
-            elif eval <= 0:
-                dx = 0
-            else:
-                dx = round(eval)
-
-            # Apply the changes for the transitions to the
-            # corresponding source and destination states
-            temp = self.states_x[sind] - dx
-
-            if sind == 1:
-                self.states_x[sind] = temp
-                self.states_x[dind] += dx
-            elif temp <= 0:
-                self.states_x[dind] += self.states_x[sind]
-                self.states_x[sind] = 0
-            else:
-                self.states_x[sind] = temp
-                self.states_x[dind] += dx
+    def set_parameters(self):
+        # the spin boxes keep their values, the node gets a copy
+        params = {name: getattr(self, name).value() for name in WIDGET_PARAMS}
+        params['param_sim_len'] = float(params['param_sim_len'])
+        self.node.set_params(params)
 
     def simulate(self):
         # check correctenes of the initialization
-        if self.check_init():
-            # create states based on the
-            # initialization parameters
-            self.create_states()
-            self.indexes()
-
-            # create transitions based on
-            # the created states
-            self.create_transitions()
-
-            # create a container to store states
-            states_arr = np.zeros((self.param_num_sim,
-                                   len(self.states_name)), dtype=np.float32)
-
-            start = time.time()
-            # start simulation
-            for ind in range(self.param_num_sim):
-                states_arr[ind, :] = self.states_x
-                self.stoch_solver()
-
-                if ind % self.param_disp_interval == 0:
-                    end = time.time()
-                    sim_info = "Sim.time: {:.4f} sec, Iteration: {}/{}".format(
-                            end - start, ind + 1, self.param_num_sim)
-                    print(sim_info)
-                    # self.results_output.setText(sim_info)
-
-            # if visualization is enabled
-            # then plot states
-            if self.param_vis_on:
-                # extract all states from states array
-                time_arr = np.linspace(0, self.param_num_sim,
-                                       self.param_num_sim) * self.param_dt
-
-                state_sus = states_arr.dot(self.ind_sus)
-                state_exp = states_arr.dot(self.ind_exp)
-                state_inf = states_arr.dot(self.ind_inf)
-                state_sin = states_arr.dot(self.ind_sin)
-                state_qua = states_arr.dot(self.ind_qua)
-                state_imm = states_arr.dot(self.ind_imm)
-                state_dea = states_arr[:, -1]
-
-                # print simulation results
-                self.output_results.setText("Simulation was completed. Total number of:")
-                self.output_results2.setText("Exposed: {}; Infected: {}; Severe Infected: {}".
-                                            format(int(state_sin[-1]),
-                                                   int(state_exp[-1]),
-                                                   int(state_inf[-1])))
-                self.output_results3.setText("Quarantined: {}; Immunized: {}; Dead: {}".
-                                             format(int(state_qua[-1]),
-                                                    int(state_imm[-1]),
-                                                    int(state_dea[-1])))
-                fig, ax = plt.subplots(figsize=(8, 4))
-                ax.plot(time_arr, state_sus, linewidth=1,
-                        color='dodgerblue', label='Susceptible')
-                ax.plot(time_arr, state_exp, linewidth=1,
-                        color='lime', linestyle=':', label='Exposed')
-                ax.plot(time_arr, state_qua, linewidth=1,
-                        color='fuchsia', linestyle='-.', label='Quarantined')
-                ax.plot(time_arr, state_inf, linewidth=1,
-                        color='navy', linestyle='--', label='Infected')
-                ax.plot(time_arr, state_sin, linewidth=1,
-                        color='r', linestyle='--', label='Severe Infected')
-                ax.plot(time_arr, state_imm, linewidth=1,
-                        color='cyan', label='Immunized')
-                ax.plot(time_arr, state_dea, linewidth=1,
-                        color='k', label='Dead')
-                plt.ylim(0, self.init_susceptible)
-                plt.xlim(0, self.param_sim_len)
-                ax.grid(linestyle=':', linewidth=1)
-                plt.ylabel("Number of individuals", fontsize=18)
-                plt.xlabel("Time (days)", fontsize=18)
-                plt.legend(loc="upper left", ncol=1)
-
-                fig2, ax2 = plt.subplots(figsize=(8, 4))
-                ax2.plot(time_arr, state_sin, linewidth=1, color='r',
-                         linestyle='--', label='Severe Infected')
-                ax2.plot(time_arr, np.ones(self.param_num_sim) *
-                         self.param_hosp_capacity, linewidth=1,
-                         color='lime', label='Hospital Capacity')
-                ax2.plot(time_arr, state_dea, linewidth=1,
-                         color='k', label='Dead')
-                plt.ylabel("Number of individuals", fontsize=18)
-                plt.xlabel("Time (days)", fontsize=18)
-                plt.legend(loc="upper left", ncol=1)
-                ax2.grid(linestyle=':', linewidth=1)
-                plt.show()
+        if self.sim_thread is not None or not self.node.check_init():
+            return
+
+        # the simulation runs in a worker thread and streams daily
+        # snapshots of the compartments, the window stays responsive
+        self.sim_error = None
+        self.sim_thread = QtCore.QThread()
+        self.worker = SimulationWorker(self.node)
+        self.worker.moveToThread(self.sim_thread)
+        self.sim_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.statusbar.showMessage)
+        self.worker.snapshot.connect(self.update_plots)
+        self.worker.error.connect(self.show_error)
+        self.worker.finished.connect(self.show_results)
+        self.worker.finished.connect(self.sim_thread.quit)
+        self.sim_thread.finished.connect(self.run_finished)
+
+        # if visualization is enabled then the
+        # plots are drawn while the simulation runs
+        if self.param_vis_on:
+            self.reset_plots()
+
+        self.set_params.setEnabled(False)
+        self.cancel_sim.setEnabled(True)
+        self.output_results.setText("Simulation is running...")
+        self.sim_thread.start()
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+
+    def run_finished(self):
+        self.sim_thread.deleteLater()
+        self.worker.deleteLater()
+        self.sim_thread = None
+        self.worker = None
+        self.set_params.setEnabled(True)
+        self.cancel_sim.setEnabled(False)
+
+    def create_plots(self):
+        # one figure with two axes embedded in plot_area, the lines
+        # are animated: they are only drawn by blitting over the
+        # cached background of the axes
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=(6, 5), tight_layout=True)
+        self.canvas = FigureCanvasQTAgg(self.fig)
+        layout = QtWidgets.QVBoxLayout(self.plot_area)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas)
+
+        self.ax, self.ax2 = self.fig.subplots(2, 1, sharex=True)
+        self.lines = []
+        for name, color, style in [('Susceptible', 'dodgerblue', '-'),
+                                   ('Exposed', 'lime', ':'),
+                                   ('Quarantined', 'fuchsia', '-.'),
+                                   ('Infected', 'navy', '--'),
+                                   ('Severe_Infected', 'r', '--'),
+                                   ('Immunized', 'cyan', '-'),
+                                   ('Dead', 'k', '-')]:
+            line, = self.ax.plot([], [], linewidth=1, color=color, linestyle=style,
+                                 label=name.replace('_', ' '), animated=True)
+            self.lines.append((line, COMPARTMENTS.index(name)))
+
+        for name, color, style in [('Severe_Infected', 'r', '--'),
+                                   ('Dead', 'k', '-')]:
+            line, = self.ax2.plot([], [], linewidth=1, color=color, linestyle=style,
+                                  label=name.replace('_', ' '), animated=True)
+            self.lines.append((line, COMPARTMENTS.index(name)))
+        self.hosp_line = self.ax2.axhline(0, linewidth=1, color='lime', label='Hospital Capacity')
+
+        for ax in (self.ax, self.ax2):
+            ax.grid(linestyle=':', linewidth=1)
+            ax.set_ylabel("Number of individuals")
+            ax.legend(loc="upper left", ncol=1, fontsize='small')
+        self.ax2.set_xlabel("Time (days)")
+
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.cache_background)
+
+    def cache_background(self, event):
+        # everything but the lines, after every full redraw (new limits,
+        # resized window); the lines go on top of it again
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+
+    def reset_plots(self):
+        # empty lines and limits of the new run, the only full redraw
+        # of a run unless the second axes have to grow
+        if self.canvas is None:
+            self.create_plots()
+        for line, _ in self.lines:
+            line.set_data([], [])
+        node = self.node
+        self.hosp_line.set_ydata([node.param_hosp_capacity] * 2)
+        self.ax.set_xlim(0, node.param_sim_len)
+        self.ax.set_ylim(0, node.init_susceptible)
+        self.ax2.set_ylim(0, 2 * max(node.param_hosp_capacity, 1))
+        self.canvas.draw()
+
+    def draw_lines(self):
+        for line, _ in self.lines:
+            self.fig.draw_artist(line)
+
+    def blit_lines(self):
+        # only the lines are redrawn, over the cached background
+        if self.background is None:
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_lines()
+        self.canvas.blit(self.fig.bbox)
+
+    def update_plots(self, time_arr, comp_arr):
+        # new data of the lines, downsampled to the width of the axes
+        if not self.param_vis_on:
+            return
+
+        num_columns = max(int(self.ax.bbox.width), 1)
+        for line, col in self.lines:
+            line.set_data(*downsample(time_arr, comp_arr[:, col], num_columns))
+
+        # the second axes are rescaled (one full redraw)
+        # when the severe infected or the dead leave them
+        top = self.ax2.get_ylim()[1]
+        peak = comp_arr[:, [COMPARTMENTS.index('Severe_Infected'), COMPARTMENTS.index('Dead')]].max(initial=0)
+        if peak > top:
+            self.ax2.set_ylim(0, 2 * peak)
+            self.canvas.draw()
+        else:
+            self.blit_lines()
+
+    def show_error(self, message):
+        # the results of the failed run follow with finished
+        self.sim_error = message
+        self.statusbar.showMessage(message)
+
+    def show_results(self, time_arr, comp_arr, cancelled):
+        # final results of the run, at every step
+        self.update_plots(time_arr, comp_arr)
+        if not len(comp_arr):
+            if self.sim_error is not None:
+                self.output_results.setText("Simulation failed: {}".format(self.sim_error))
+            else:
+                self.output_results.setText("Simulation was cancelled.")
+            return
+
+        last = dict(zip(COMPARTMENTS, comp_arr[-1]))
+        if self.sim_error is not None:
+            self.output_results.setText("Simulation failed at day {:.1f}: {}. Total number of:".
+                                        format(time_arr[-1], self.sim_error))
+        elif cancelled:
+            self.output_results.setText("Simulation was cancelled at day {:.1f}. Total number of:".
+                                        format(time_arr[-1]))
+        else:
+            self.output_results.setText("Simulation was completed. Total number of:")
+        self.output_results2.setText("Exposed: {}; Infected: {}; Severe Infected: {}".
+                                     format(int(last['Exposed']),
+                                            int(last['Infected']),
+                                            int(last['Severe_Infected'])))
+        self.output_results3.setText("Quarantined: {}; Immunized: {}; Dead: {}".
+                                     format(int(last['Quarantined']),
+                                            int(last['Immunized']),
+                                            int(last['Dead'])))
 
 
 if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
-    node = Node()
-    node.show()
+    window = MainWindow()
+    window.show()
     sys.exit(app.exec_())
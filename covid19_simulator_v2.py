@@ -6,10 +6,14 @@ Created on Thu Apr  2 18:08:19 2020
 @author: askat
 """
 
-import random
 import numpy as np
 import time 
-import matplotlib.pyplot as plt 
+
+import covid19_jit
+import covid19_model
+import covid19_rng
+from covid19_recorder import AggregateRecorder
+from covid19_store import MemmapRecorder
 
 
 class Node:
@@ -75,9 +79,45 @@ class Node:
         self.param_disp_interval = 100
         # Visualize results after simulation's end
         self.param_vis_on = 1                  
-        
-        np.random.seed(1)
-        self.param_rand_seed = np.random.randint(low = 1, high = 100, size = 625)
+        # Write the full trajectory to this .npy file with a .json
+        # sidecar (None keeps only the compartment sums)
+        self.param_store_path = None
+        # Solver engine: 'legacy' walks the transitions one by one,
+        # 'vectorized' uses the precomputed transition arrays,
+        # 'chain' applies the transition groups to slices (covid19_chain.py)
+        # and 'compiled' runs the transition arrays in a Numba loop
+        self.param_engine = 'legacy'
+        # Sampler of the transitions: 'legacy' draws every trial on
+        # its own, 'binomial' draws all of them in one call
+        self.param_sampler = 'binomial'
+        # Root seed, run and replica number of the random stream
+        # of the node (see covid19_rng.py)
+        self.param_seed = 1
+        self.param_run = 0
+        self.param_replica = 0
+        # Number type of the states: 'float32' as in the original model,
+        # 'int64' keeps exact counts and conserves the population
+        # (float32 rounds single transitions away above ~1e7 individuals)
+        self.param_dtype = 'float32'
+        # Model spec of covid19_model.py: 'v2' with the Isolated states,
+        # 'v1' without them as in covid19_simulator.py
+        self.param_model = 'v2'
+        # Directory of the on-disk cache of compiled models, shared
+        # between processes and sessions (None keeps them in memory)
+        self.param_model_cache = None
+        # Stop sampling once the epidemic died out and no transition is
+        # left that can move anyone, the remaining steps repeat the last
+        # states (same results, checked once a simulated day)
+        self.param_early_stop = 1
+        # Once the epidemic died out, advance the remaining steps by the
+        # expected flows left (mortality, vaccination) instead of
+        # sampling them, see fast_forward
+        self.param_fast_forward = 0
+        # Profile run(): 1 times the steps, the sampling and applying of
+        # every transition group (covid19_profile.py), 2 also traces
+        # the memory allocated per step; the Profiler is kept in
+        # self.profiler after the run
+        self.param_profile = 0
         
         # Define the initial values for the states
         self.init_susceptible = 1000000
@@ -91,18 +131,40 @@ class Node:
         self.init_recovery_imm = 0
         
         # Define states
-        self.states_x = [0, self.init_susceptible]
+        self.states_x = []
         self.states_dx = []
-        self.states_name = ['Birth', 'Susceptible']
-        self.states_type = ['Birth', 'Susceptible']
+        self.states_name = []
+        self.states_type = []
         
         # Define transitions
-        self.source = ['Birth', 'Birth']
-        self.dest = ['Susceptible', 'Maternally_Immunized' ]
+        self.source = []
+        self.dest = []
+        self.trans_group = []
         self.source_ind = []
         self.dest_ind = []
+
+        # Compiled transition table of the model (covid19_model.py),
+        # shared by all nodes with the same structural parameters
+        self.compiled_model = None
+
+        # Profiler of the last run, when param_profile is set
+        self.profiler = None
         
 
+    def set_params(self, params):
+        # override parameters given as a dictionary
+        # and update the ones derived from them
+        for name, value in params.items():
+            if not hasattr(self, name):
+                raise ValueError('Unknown parameter: {}'.format(name))
+            setattr(self, name, value)
+
+        self.param_num_sim = int(self.param_sim_len / self.param_dt) + 1
+        self.param_n_exp = round(self.param_t_exp / self.param_dt)
+        self.param_n_inf = round(self.param_t_inf / self.param_dt)
+        self.param_n_vac = round(self.param_t_vac / self.param_dt)
+
+
     def check_init(self):
         if self.param_beta_exp == 0 and self.param_beta_inf == 0:
             print('[ERROR] Both beta_exp and beta_inf cannot be zero.')
@@ -115,420 +177,417 @@ class Node:
             return 1
             
             
+    def model_key(self):
+        # structural parameters of the transition table
+        return (self.param_model, self.param_n_vac, self.param_n_exp,
+                self.param_n_inf, self.param_vr != 0)
+
+
     def create_states(self):
-        # create some temporal variables
-        n_vac = self.param_n_vac
-        n_vac_exp = n_vac + self.param_n_exp
-        n_vac_2exp = n_vac_exp + self.param_n_exp
-        n_vac_2exp_inf = n_vac_2exp + self.param_n_inf
-        n_vac_2exp_2inf = n_vac_2exp_inf + self.param_n_inf
-        n_vac_2exp_3inf = n_vac_2exp_2inf + self.param_n_inf + 1
-        count = len(self.states_name) - 1
-        
-        # loop to create states
-        while count < n_vac_2exp_3inf:
-            # Vaccinated States
-            if count <= n_vac:
-                self.states_name.append('Vaccinated_{}'.format(count))
-                self.states_type.append('Susceptible')
-            # Exposed States (Includes both exposed and quarantined)
-            elif count > n_vac and count <= n_vac_exp:
-                self.states_name.append('Exposed_{}'.format(count - n_vac))
-                self.states_type.append('Exposed')
-                if count == n_vac + 1:
-                    self.states_x.append(self.init_exposed)
-                    count += 1
-                    continue
-            elif count > n_vac_exp and count <= n_vac_2exp:
-                self.states_name.append('Quarantined_{}'.format(count - n_vac_exp))
-                self.states_type.append('Exposed')
-                if count == n_vac_exp + 1:
-                    self.states_x.append(self.init_quarantined)
-                    count += 1
-                    continue
-            # Infected States (Includes: Infected, Isolated and Severe Infected)
-            elif count > n_vac_2exp and count <= n_vac_2exp_inf:
-                self.states_name.append('Infected_{}'.format(count - n_vac_2exp))
-                self.states_type.append('Infected')
-                if count == n_vac_2exp + 1:
-                    self.states_x.append(self.init_infected)
-                    count += 1
-                    continue
-            elif count > n_vac_2exp_inf and count <= n_vac_2exp_2inf:
-                self.states_name.append('Isolated_{}'.format(count - n_vac_2exp_inf))
-                self.states_type.append('Infected')
-                if count == n_vac_2exp_inf + 1:
-                    self.states_x.append(self.init_isolated)
-                    count += 1
-                    continue
-            else:
-                self.states_name.append('Severe_Infected_{}'.format(count - n_vac_2exp_2inf))
-                self.states_type.append('Infected')
-                if count == n_vac_2exp_2inf + 1:
-                    self.states_x.append(self.init_severe_infected)
-                    count += 1
-                    continue
-                
-            self.states_x.append(0)
-            count += 1
-            
-        # Add the Immunized and dead states
-        self.states_name.append('Vaccination_Immunized')
-        self.states_type.append('Immunized')
-        self.states_x.append(self.init_vaccination_imm)
-
-        self.states_name.append('Maternally_Immunized')
-        self.states_type.append('Immunized')
-        self.states_x.append(self.init_maternally_imm)
-
-        self.states_name.append('Recovery_Immunized')
-        self.states_type.append('Immunized')
-        self.states_x.append(self.init_recovery_imm)
-
-        self.states_name.append('Dead')
-        self.states_type.append('Dead')
-        self.states_x.append(0)
+        # the transition table comes from the cache of compiled models
+        # unless the structure is new, the initial states are set every time
+        self.compiled_model = covid19_model.compile_model(*self.model_key(), self.param_model_cache)
+        model = self.compiled_model
+        self.spec = model.spec
+
+        self.states_name = model.states_name
+        self.states_type = model.states_type
         
         # convert states into numpy arrays
         # for fast processing
-        self.states_x = np.asarray(self.states_x, dtype=np.float32)
-        self.states_dx = np.zeros(self.states_x.shape, dtype=np.float32)
+        self.states_x = model.initial_states(self, self.param_dtype)
+        self.states_dx = np.zeros(self.states_x.shape, dtype=self.param_dtype)
 
         # initialize number of states
-        self.param_num_states = len(self.states_x)
+        self.param_num_states = model.num_states
+
+        # name -> index and type -> indices of the states, and the
+        # slice of every stage chain
+        self.states_ind = model.states_ind
+        self.type_ind = model.type_ind
+        self.chains = model.chains
+
+        # every run starts from its own random stream
+        self.rng = covid19_rng.stream(self.param_seed, self.param_run, self.param_replica)
         
         print("[INFO] States were created...")
         
         
     def create_transitions(self):
-        # create some temporal variables
-        count = len(self.source) - 1
-        n_st = self.param_num_states 
-        n_vac = self.param_n_vac
-        n_exp = self.param_n_exp
-        n_inf = self.param_n_inf
-        
-        # Transition 3 - Any State except Birth to Dead (Natural Mortality)
-        for ind in range(count, n_st - 1):
-            self.source.append(self.states_name[ind])
-            self.dest.append('Dead')
-            
-        # Transition 4 - Susceptible to Vaccinated[1]
-        if self.param_vr != 0:
-            self.source.append('Susceptible')
-            self.dest.append('Vaccinated_1')
-            
-        # Transition 5 - Vaccinated[i] to Vaccinated[i+1] until i+1 == n_vac
-        if self.param_n_vac != 0:
-            for ind in range(n_vac - 1):
-                self.source.append(self.states_name[2 + ind])
-                self.dest.append(self.states_name[3 + ind])
-                
-        if self.param_vr != 0:
-            # Transition 6 - Vaccinated[n_vac] to Vaccination_Immunized
-            self.source.append('Vaccinated_{}'.format(n_vac))
-            self.dest.append('Vaccination_Immunized')
-            
-            # Transition 7 - Vaccinated[n_vac] to Susceptible
-            self.source.append('Vaccinated_{}'.format(n_vac))
-            self.dest.append('Susceptible')
-            
-        # Transition 8 - Susceptible to Exposed[1]
-        if self.param_n_exp != 0:
-            self.source.append('Susceptible')
-            self.dest.append('Exposed_1')
-                
-        # Transition 9 - Susceptible to Infected[1]
-        self.source.append('Susceptible')
-        self.dest.append('Infected_1')
-            
-        # Transition 10 - Exposed[i] to Exposed[i+1] until i+1 == n_exp
-        for ind in range(n_exp - 1):
-            self.source.append('Exposed_{}'.format(ind + 1))
-            self.dest.append('Exposed_{}'.format(ind + 2))
-            
-        # Transition 11 - Exposed[n_inc] to Infected[1]
-        if self.param_n_exp != 0:
-            self.source.append('Exposed_{}'.format(n_exp))
-            self.dest.append('Infected_1')
-            
-        # Transition 12 - Exposed[i] to Quarantined[i+1] until i+1 == n_exp
-        for ind in range(n_exp - 1):
-            self.source.append('Exposed_{}'.format(ind + 1))
-            self.dest.append('Quarantined_{}'.format(ind + 2))
-            
-        # Transition 13 - Quarantined[i] to Quarantined[i+1] until i+1 == n_exp
-        for ind in range(n_exp - 1):
-            self.source.append('Quarantined_{}'.format(ind + 1))
-            self.dest.append('Quarantined_{}'.format(ind + 2))
-            
-        # Transition 14 - Quarantined[n_exp] to Isolated[1]
-        if self.param_n_exp != 0:
-            self.source.append('Quarantined_{}'.format(n_exp))
-            self.dest.append('Isolated_1')
-        
-        # Transition 15 - Infected[i] to Infected[i+1] until i+1 == n_inf
-        for ind in range(n_inf - 1):
-            self.source.append('Infected_{}'.format(ind + 1))
-            self.dest.append('Infected_{}'.format(ind + 2))
-            
-        # Transition 16 - Isolated[i] to Isolated[i+1] until i+1 == n_inf
-        for ind in range(n_inf - 1):
-            self.source.append('Isolated_{}'.format(ind + 1))
-            self.dest.append('Isolated_{}'.format(ind + 2))
-            
-        # Transition 17 - Severe_Infected[i] to Severe_Infected[i+1] until i+1 == n_inf
-        for ind in range(n_inf - 1):
-            self.source.append('Severe_Infected_{}'.format(ind + 1))
-            self.dest.append('Severe_Infected_{}'.format(ind + 2))
-            
-        # Transition 18 - Infected[i] to Severe_Infected[i+1] until i+1 == n_inf
-        for ind in range(n_inf - 1):
-            self.source.append('Infected_{}'.format(ind + 1))
-            self.dest.append('Severe_Infected_{}'.format(ind + 2))
-            
-        # Transition 19 - Isolated[i] to Severe_Infected[i+1] until i+1 == n_inf
-        for ind in range(n_inf - 1):
-            self.source.append('Isolated_{}'.format(ind + 1))
-            self.dest.append('Severe_Infected_{}'.format(ind + 2))
-            
-        # Transition 20 - Infected[n_inf] to Recovery_Immunized
-        self.source.append('Infected_{}'.format(n_inf))
-        self.dest.append('Recovery_Immunized')
-        
-        # Transition 21 - Isolated[n_inf] to Recovery Immunized
-        self.source.append('Isolated_{}'.format(n_inf))
-        self.dest.append('Recovery_Immunized')
-        
-        # Transition 22 - Infected[n_inf] to Susceptible
-        self.source.append('Severe_Infected_{}'.format(n_inf))
-        self.dest.append('Recovery_Immunized')
-        
-        # Transition 23 - Infected[n_inf] to Susceptible
-        self.source.append('Infected_{}'.format(n_inf))
-        self.dest.append('Susceptible')
-        
-        # Transition 24 - Isolated[n_inf] to Susceptible
-        self.source.append('Isolated_{}'.format(n_inf))
-        self.dest.append('Susceptible')
-        
-        # Transition 25 - Severe_Infected[n_inf] to Susceptible
-        self.source.append('Severe_Infected_{}'.format(n_inf))
-        self.dest.append('Susceptible')
+        # transitions are kept as state indices, in the
+        # order of the Transition numbers of the spec
+        model = self.compiled_model
+        self.source_ind = model.source_ind
+        self.dest_ind = model.dest_ind
+        self.trans_group = model.group_arr
         
-        # Transition 26 - Infected[n_inf] to Dead
-        self.source.append('Infected_{}'.format(n_inf))
-        self.dest.append('Dead')
-                
-        # Transition 27 - Severe_Infected[n_inf] to Dead
-        self.source.append('Severe_Infected_{}'.format(n_inf))
-        self.dest.append('Dead')
-        
-        for ind in range(len(self.source)):
-            self.source_ind.append(self.states_name.index(self.source[ind]))
-            self.dest_ind.append(self.states_name.index(self.dest[ind]))
+        # names of the transition states
+        self.source = [self.states_name[ind] for ind in self.source_ind]
+        self.dest = [self.states_name[ind] for ind in self.dest_ind]
         
         print("[INFO] State transitions were created...")
 
 
     def indexes(self):
-        # define vectors of indices
-        self.ind_vac = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_inf = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_exp = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_sin = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_qua = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_imm = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_sus = np.zeros((len(self.states_x)), dtype=np.float32)
-        self.ind_iso = np.zeros((len(self.states_x)), dtype=np.float32)
-        
-        # intialize vectors of indices
-        for ind in range(len(self.states_name)):
-            if self.states_name[ind] == 'Vaccinated_{}'.format(self.param_n_vac):
-                self.ind_vac[ind] = 1
-            elif 'Infected_' in self.states_name[ind] and not 'Severe_Infected_' in self.states_name[ind]:
-                self.ind_inf[ind] = 1
-            elif 'Exposed_' in self.states_name[ind]:
-                self.ind_exp[ind] = 1
-            elif 'Severe_Infected_' in self.states_name[ind]:
-                self.ind_sin[ind] = 1
-            elif 'Quarantined_' in self.states_name[ind]:
-                self.ind_qua[ind] = 1
-            elif 'Immunized' in self.states_type[ind]:
-                self.ind_imm[ind] = 1
-            elif 'Susceptible' in self.states_type[ind]:
-                self.ind_sus[ind] = 1
-            elif 'Isolated_' in self.states_name[ind]:
-                self.ind_iso[ind] = 1
-        
-        # define other indices
-        self.ind_exp1 = self.states_name.index('Exposed_1')
-        self.ind_expn = self.states_name.index('Exposed_{}'.format(self.param_n_exp))
-        
-        self.ind_qua1 = self.states_name.index('Quarantined_1')
-        self.ind_quan = self.states_name.index('Quarantined_{}'.format(self.param_n_exp))
-        
-        self.ind_sin1 = self.states_name.index('Severe_Infected_1')
-        self.ind_sinn = self.states_name.index('Severe_Infected_{}'.format(self.param_n_inf))
+        # states of every compartment, as a slice of the state vector
+        # or as an index array
+        self.comp_ind = self.compiled_model.comp_ind
         
-        self.ind_iso1 = self.states_name.index('Isolated_1')
-        self.ind_ison = self.states_name.index('Isolated_{}'.format(self.param_n_inf))
-        
-        self.ind_inf1 = self.states_name.index('Infected_1')
-        self.ind_infn = self.states_name.index('Infected_{}'.format(self.param_n_inf))
+        # first and last state of every chain (ind_exp1, ind_expn, ...)
+        for name, short, _, _, _ in self.spec.chains:
+            chain = self.chains[name]
+            setattr(self, 'ind_{}1'.format(short), chain.start)
+            setattr(self, 'ind_{}n'.format(short), chain.stop - 1)
         
     
-    def dx_generator(self, size, val):
-        dx = 0
-      
-        for ind in range(size):
-            rand_num = random.uniform(0, 1)
-            if rand_num < val:
-                dx += 1
+    def loads(self, x):
+        # infection pressure and hospital load (number of Severe
+        # Infected) of one state vector or a stack of them
+        spec = self.spec
+        states_sin = x[..., self.chains[spec.hospital]].sum(axis=-1)
+        pressure = None
+        for name, weight in spec.pressure:
+            total = states_sin if name == spec.hospital else x[..., self.chains[name]].sum(axis=-1)
+            pressure = total if weight is None else pressure + getattr(self, weight) * total
+        
+        return pressure, states_sin
+        
     
+    def vectorize(self):
+        # transition arrays of the compiled model
+        model = self.compiled_model
+        self.source_arr = model.source_arr
+        self.dest_arr = model.dest_arr
+        self.group_arr = model.group_arr
+
+        # Transitions 1-2 scale with the total population,
+        # Transitions 8-9 with the infection pressure
+        self.rows_birth = model.rows_birth
+        self.rows_foi = model.rows_foi
+
+        # Susceptible is the only source allowed to go negative
+        self.clamp_mask = model.clamp_mask
+
+        # consecutive stages of transitions applied at
+        # the same time (see CompiledModel.create_stages)
+        self.stages = model.stages
+
+        self.rates()
+
+        print("[INFO] Transition arrays were created...")
+
+
+    def require_arrays(self):
+        # the older call sequence create_states, indexes,
+        # create_transitions leaves out vectorize
+        if not hasattr(self, 'stages'):
+            self.vectorize()
+
+
+    def rates(self):
+        # coefficients of the expected values of all transitions, the
+        # ones switching with the hospital load (Transitions 22, 25 and
+        # 27 of v2) take coef_hi above the capacity
+        model = self.compiled_model
+        self.coef_lo, self.coef_hi, self.weights_arr = model.coefficients(self)
+        self.rows_hosp = model.rows_hosp
+
+        # kind of every transition and terms of the infection
+        # pressure, as used by the compiled engine
+        self.kind_arr = np.full(len(self.group_arr), covid19_jit.KIND_RATE, dtype=np.int8)
+        self.kind_arr[self.rows_birth] = covid19_jit.KIND_BIRTH
+        self.kind_arr[self.rows_foi] = covid19_jit.KIND_FOI
+        self.kind_arr[self.rows_hosp] = covid19_jit.KIND_HOSP
+        self.loads_arr = model.loads_arr
+        self.hosp_arr = model.hosp_arr
+
+
+    def dx_generator(self, size, val, rng):
+        # number of successes among size trials of probability val
+        return np.count_nonzero(rng.random(size) < val)
+
+
+    def vec_expval(self, x):
+        # expected values of all transitions, x can hold one
+        # state vector or a stack of them along the first axis
+        total_pop = x[..., 1:-1].sum(axis=-1, keepdims=True)
+        pressure, states_sin = self.loads(x)
+        pressure, states_sin = pressure[..., None], states_sin[..., None]
+
+        expval = self.coef_lo * x[..., self.source_arr]
+        expval[..., self.rows_birth] = self.coef_lo[self.rows_birth] * total_pop
+        expval[..., self.rows_foi] *= pressure / total_pop
+
+        # exits of the hospital chain switch with the hospital load
+        rows = self.rows_hosp
+        coef = np.where(states_sin < self.param_hosp_capacity, self.coef_lo[rows], self.coef_hi[rows])
+        expval[..., rows] = coef * x[..., self.source_arr[rows]]
+
+        return expval
+
+
+    def sample(self, expval, rng=None):
+        # Randomly generate the transition values based on the expected
+        # values: binomial draws below 10 expected transitions, rounding
+        # above and nothing for negative values.
+        # rng is one generator, or one generator per row of a stack of
+        # expected values (None uses the stream of the node)
+        if rng is None:
+            rng = self.rng
+        rngs = rng if isinstance(rng, (list, tuple)) else None
+
+        if self.param_sampler == 'legacy':
+            dx = np.zeros(expval.shape)
+            for ind, eval in np.ndenumerate(expval):
+                if eval < 10 and eval > 0:
+                    temp1 = int(np.ceil(eval * 10 + np.finfo(np.float32).eps))
+                    temp2 = eval/temp1
+                    dx[ind] = self.dx_generator(temp1, temp2, rngs[ind[0]] if rngs else rng)
+                elif eval < 0:
+                    dx[ind] = 0
+                else:
+                    dx[ind] = round(eval)
+        else:
+            dx = np.rint(np.maximum(expval, 0))
+            small = (expval > 0) & (expval < 10)
+
+            trials = np.ceil(expval[small] * 10 + np.finfo(np.float32).eps)
+            prob = expval[small] / trials
+            trials = trials.astype(np.int64)
+            if rngs is None:
+                dx[small] = rng.binomial(trials, prob)
+            else:
+                # draws of a row are contiguous, each row
+                # draws them from its own generator
+                bounds = np.r_[0, np.cumsum(small.sum(axis=-1))]
+                draws = np.empty(len(trials))
+                for row, rng in enumerate(rngs):
+                    lo, hi = bounds[row], bounds[row + 1]
+                    if hi > lo:
+                        draws[lo:hi] = rng.binomial(trials[lo:hi], prob[lo:hi])
+                dx[small] = draws
+
+        # integer states get integer flows
+        if self.param_dtype == 'int64':
+            return dx.astype(np.int64)
         return dx
-    
-    
-    def stoch_solver(self):
-        # define a list to store transitions
-        expval = []
-        state_1 = self.states_x[1]
-                                
-        # Total population is the sum of all states except birth and death
-        total_pop = self.states_x[1:-1].sum()
-        
-        # Transition 1 - Birth to Susceptible
-        expval.append(total_pop * self.param_br * (1 - self.param_mir) * self.param_dt)
-        
-        # Transition 2 - Birth to Maternally Immunized
-        expval.append(total_pop * self.param_br * self.param_mir * self.param_dt)
-        
-        # Transition 3 - Any State except Birth to Dead (Natural Mortality)
-        expval += (self.states_x[1:self.param_num_states - 1] * self.param_dr * self.param_dt).tolist()
-   
-        # Transition 4 - Susceptible to Vaccinated[1]
-        if self.param_vr != 0:
-            expval.append(state_1 * self.param_vr * self.param_dt)
-            
-        # Transition 5 - Vaccinated[i] to Vaccinated[i+1] until i+1 == n_vac
-        if self.param_n_vac != 0:
-            expval += (self.states_x[2:self.param_n_vac + 1] * \
-                   (1 - self.param_dr * self.param_dt)).tolist()
-
-        # Transition 6 - Vaccinated[n_vac] to Vaccination_Immunized
-        # Transition 7 - Vaccinated[n_vac] to Susceptible
-        if self.param_vr != 0:
-            state_vac = self.states_x.dot(self.ind_vac).sum()
-            expval.append(state_vac * self.param_vir)
-            expval.append(state_vac * (1 - self.param_dr * self.param_dt - self.param_vir))
-            
-        # Transition 8 - Susceptible to Exposed[1]
-        temp1 = self.states_x.dot(self.ind_inf).sum() + self.param_eps_exp * \
-                self.states_x.dot(self.ind_exp).sum() + self.param_eps_sev * \
-                self.states_x.dot(self.ind_sin).sum() + self.param_eps_sev * \
-                self.states_x.dot(self.ind_iso).sum() + self.param_eps_qua * \
-                self.states_x.dot(self.ind_qua).sum()
-            
-        if self.param_n_exp != 0:
-            expval.append(state_1 * temp1 * self.param_beta_exp * self.param_dt / total_pop)
-            
-        # Transition 9 - Susceptible to Infected[1] 
-        expval.append(state_1 * temp1 * self.param_beta_inf * self.param_dt / total_pop)
-        
-        # Transition 10 - Exposed[i] to Exposed[i+1] until i+1 == n_exp
-        expval += (self.states_x[self.ind_exp1:self.ind_exp1 + self.param_n_exp - 1] * \
-                   (1 - self.param_dr * self.param_dt - self.param_qr * self.param_dt)).tolist()
 
-        # Transition 11 - Exposed[n_exp] to Infected[1]
-        if self.param_n_exp != 0:
-            expval.append(self.states_x[self.ind_expn] * (1 - self.param_dr * self.param_dt))
-            
-        # Transition 12 - Exposed[i] to Quarantined[i+1] until i+1 == n_exp
-        expval += (self.states_x[self.ind_exp1:self.ind_exp1 + self.param_n_exp - 1] * \
-                  (self.param_qr * self.param_dt)).tolist()
 
-        # Transition 13 - Quarantined[i] to Quarantined[i+1] until i+1 == n_exp
-        expval += (self.states_x[self.ind_qua1:self.ind_qua1 + self.param_n_exp - 1] * \
-                   (1 - self.param_dr * self.param_dt)).tolist()
+    def vec_apply(self, x, dx):
+        # apply the sampled transitions stage by stage
+        y = x.copy()
 
-        # Transition 14 - Quarantined[n_exp] to Isolated[1]
-        if self.param_n_exp != 0:
-            expval.append(self.states_x[self.ind_quan] * (1 - self.param_dr * self.param_dt))
-            
-        # Transition 15 - Infected[i] to Infected[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_inf1:self.ind_inf1 + self.param_n_inf - 1] * \
-                   (1 - self.param_dr * self.param_dt - self.param_sir * self.param_dt)).tolist()
-        
-        # Transition 16 - Isolated[i] to Isolated[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_iso1:self.ind_iso1 + self.param_n_inf - 1] * \
-                   (1 - self.param_dr * self.param_dt - self.param_sir * self.param_dt)).tolist()
-     
-        # Transition 17 - Severe_Infected[i] to Severe_Infected[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_sin1:self.ind_sin1 + self.param_n_inf - 1] * \
-                   (1 - self.param_dr * self.param_dt)).tolist()
-         
-        # Transition 18 - Infected[i] to Severe_Infected[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_inf1:self.ind_inf1 + self.param_n_inf - 1] * \
-                   (self.param_sir * self.param_dt)).tolist()
-        
-        # Transition 19 - Isolated[i] to Severe_Infected[i+1] until i+1 == n_inf
-        expval += (self.states_x[self.ind_iso1:self.ind_iso1 + self.param_n_inf - 1] * \
-                   (self.param_sir * self.param_dt)).tolist()
+        for stage in self.stages:
+            self.apply_stage(y, dx, stage)
 
-        # Transition 20 - Infected[n_inf] to Recovery_Immunized
-        expval.append(self.states_x[self.ind_infn] * self.param_gamma_im)
-        
-        # Transition 21 - Isolated[n_inf] to Recovery_Immunized
-        expval.append(self.states_x[self.ind_ison] * self.param_gamma_im)
-        
-        # Transition 22 - Severe_Infected[n_inf] to Recovery Immunized
-        # expval.append(self.states_x[self.ind_sinn] * self.param_gamma_im)
-        states_sin = self.states_x.dot(self.ind_sin).sum()
-        if states_sin < self.param_hosp_capacity:
-            expval.append(self.states_x[self.ind_sinn] * \
-                          (1 - self.param_gamma_mor1) * self.param_gamma_im)
+        return y
+
+
+    def apply_stage(self, y, dx, stage):
+        # transitions of one stage, applied to y in place
+        start, end, chain, source, dest = stage
+        clamp = self.clamp_mask[start:end]
+        d = dx[..., start:end]
+        if source[1] is None:
+            avail = np.where(clamp, y[..., source[0]], d)
         else:
-            expval.append(self.states_x[self.ind_sinn] * \
-                          (1 - self.param_gamma_mor2) * self.param_gamma_im)
-        
-        # Transition 23 - Infected[n_inf] to Susceptible
-        expval.append(self.states_x[self.ind_infn] * \
-                          (1 - self.param_gamma_mor) * (1 - self.param_gamma_im))
-        
-        # Transition 24 - Isolated[n_inf] to Susceptible
-        expval.append(self.states_x[self.ind_ison] * \
-                          (1 - self.param_gamma_mor) * (1 - self.param_gamma_im))
-            
-        # Transition 25 - Severe_Infected[n_inf] to Susceptible
-        states_sin = self.states_x.dot(self.ind_sin).sum()
-        
-        if states_sin < self.param_hosp_capacity:
-            expval.append(self.states_x[self.ind_sinn] * \
-                          (1 - self.param_gamma_mor1) * (1 - self.param_gamma_im))
+            avail = np.where(clamp, y[..., self.source_arr[start:end]], d)
+
+        if chain:
+            # f[i] = min(d[i], avail[i] + f[i-1]) solved with
+            # a cumulative minimum over the chain
+            cum = np.cumsum(avail, axis=-1)
+            flows = cum + np.minimum(np.minimum.accumulate(d - cum, axis=-1), 0)
         else:
-            expval.append(self.states_x[self.ind_sinn] * \
-                          (1 - self.param_gamma_mor2) * (1 - self.param_gamma_im))
-            
-        # Transition 26 - Infected[n_inf] to Dead
-        expval.append(self.states_x[self.ind_infn] * self.param_gamma_mor)
-        
-        # Transition 27 - Severe_Infected[n_inf] to Dead
-        if states_sin < self.param_hosp_capacity:
-            expval.append(self.states_x[self.ind_sinn] *self.param_gamma_mor1) 
+            flows = np.minimum(d, avail)
+
+        y[..., source[0]] -= self.scatter_flows(flows, source)
+        y[..., dest[0]] += self.scatter_flows(flows, dest)
+
+
+    def scatter_flows(self, flows, index):
+        # sum the flows of the transitions sharing a state
+        uniq, order, offsets = index
+        if order is None:
+            return flows
+
+        return np.add.reduceat(flows[..., order], offsets, axis=-1)
+
+
+    def vec_solver(self, rng=None):
+        # float32 states are computed in double precision,
+        # integer states are used as they are
+        if self.param_dtype == 'int64':
+            x = self.states_x
+        else:
+            x = self.states_x.astype(np.float64)
+
+        expval = self.vec_expval(x)
+        dx = self.sample(expval, rng)
+
+        self.states_x[:] = self.vec_apply(x, dx)
+
+
+    def jit_solver(self, block, rng=None):
+        # advance the states by len(block) steps in the compiled
+        # loop, block receives the states before every step
+        if self.param_sampler != 'binomial':
+            raise ValueError('The compiled engine only supports the binomial sampler')
+
+        self.require_arrays()
+        work_dtype = np.int64 if self.param_dtype == 'int64' else np.float64
+        covid19_jit.compiled()(self.states_x, block, np.empty(self.param_num_states, dtype=work_dtype),
+                               self.source_arr, self.dest_arr, self.kind_arr,
+                               self.coef_lo, self.coef_hi, self.loads_arr, self.weights_arr,
+                               self.hosp_arr, float(self.param_hosp_capacity),
+                               self.rng if rng is None else rng)
+
+
+    def steps(self):
+        # copies of the states before every step of the simulation, a
+        # caller may keep them; the compiled engine advances a block of
+        # steps at once into a buffer that the next block overwrites
+        if self.param_engine == 'compiled':
+            block = np.empty((covid19_jit.BLOCK_SIZE, self.param_num_states), dtype=self.states_x.dtype)
+            for first in range(0, self.param_num_sim, len(block)):
+                rest = self.settled_steps(first)
+                if rest is not None:
+                    yield from rest
+                    return
+                num = min(len(block), self.param_num_sim - first)
+                self.jit_solver(block[:num])
+                for states_x in block[:num]:
+                    yield states_x.copy()
         else:
-            expval.append(self.states_x[self.ind_sinn] *self.param_gamma_mor2)
+            interval = max(1, round(1 / self.param_dt))
+            for ind in range(self.param_num_sim):
+                if ind % interval == 0:
+                    rest = self.settled_steps(ind)
+                    if rest is not None:
+                        yield from rest
+                        return
+                yield self.states_x.copy()
+                self.stoch_solver()
+
+
+    def settled(self, x):
+        # None while anyone is exposed or infected, then 'stationary'
+        # if no transition can move anyone any more, otherwise 'extinct'
+        # (nobody can be infected again, other flows go on)
+        for name, _, state_type, _, _ in self.spec.chains:
+            if state_type != 'Susceptible' and x[self.chains[name]].any():
+                return None
+
+        self.require_arrays()
+        if self.param_dtype == 'int64':
+            expval = self.vec_expval(x)
+        else:
+            expval = self.vec_expval(x.astype(np.float64))
+        # transitions out of an empty clamped source (Birth) never flow
+        moving = (expval > 0) & ~(self.clamp_mask & (x[self.source_arr] <= 0))
+        return 'extinct' if moving.any() else 'stationary'
+
+
+    def settled_steps(self, first):
+        # states of the steps from first on once the epidemic died out,
+        # None while it goes on
+        if not (self.param_early_stop or self.param_fast_forward):
+            return None
+        state = self.settled(self.states_x)
+
+        if state == 'stationary' and self.param_early_stop:
+            print("[INFO] Nothing moves from day {:.1f} on, the states are kept...".format(first * self.param_dt))
+            return (self.states_x.copy() for ind in range(first, self.param_num_sim))
+        elif state is not None and self.param_fast_forward:
+            print("[INFO] Epidemic died out at day {:.1f}, fast-forwarding...".format(first * self.param_dt))
+            return self.fast_forward(first)
+        return None
+
+
+    def fast_forward(self, first):
+        # Once nobody is exposed or infected, the force of infection and
+        # the hospital exits are zero for good and births are clamped
+        # away (Birth stays empty), the rest are linear flows out of the
+        # states outside the infection chains: advance them by their
+        # expected values, on these states only. Integer states are
+        # rounded, so they only conserve the population up to rounding.
+        infected = np.zeros(self.param_num_states, dtype=bool)
+        for name, _, state_type, _, _ in self.spec.chains:
+            infected[self.chains[name]] = state_type != 'Susceptible'
+        rows = np.flatnonzero((self.kind_arr == covid19_jit.KIND_RATE) & ~infected[self.source_arr])
+
+        live, inv = np.unique(np.r_[self.source_arr[rows], self.dest_arr[rows]], return_inverse=True)
+        source, dest = inv[:len(rows)], inv[len(rows):]
+        coef = self.coef_lo[rows]
+        y = self.states_x[live].astype(np.float64)
+
+        for ind in range(first, self.param_num_sim):
+            yield self.states_x.copy()
+            flows = coef * y[source]
+            y += np.bincount(dest, flows, len(live)) - np.bincount(source, flows, len(live))
+            self.states_x[live] = np.rint(y) if self.param_dtype == 'int64' else y
+
+
+    def run(self, recorder):
+        # run the whole simulation, the recorder
+        # sees the states before every step
+        recorder.start(self)
+
+        # the profiler wraps the step methods of this node for the run
+        # only, nothing is measured otherwise
+        profiler = None
+        if self.param_profile:
+            import covid19_profile
+            profiler = covid19_profile.Profiler(track_allocations=self.param_profile > 1)
+            profiler.attach(self)
+
+        start = time.time()
+        try:
+            for ind, states_x in enumerate(self.steps()):
+                recorder.record(ind, states_x)
+
+                if self.param_disp_interval and ind % self.param_disp_interval == 0:
+                    end = time.time()
+                    print("Sim.time: {:.4f} sec, Iteration: {}/{}".format(end - start, ind + 1, self.param_num_sim))
+        finally:
+            if profiler is not None:
+                profiler.detach()
+                self.profiler = profiler
+
+        if profiler is not None and self.param_disp_interval:
+            print(profiler.summary())
+
+        recorder.finish()
+        return recorder
+
+
+    def stoch_solver(self, rng=None):
+        # one step drawn from rng (None uses the stream of the node)
+        self.require_arrays()
+        if self.param_engine == 'vectorized':
+            self.vec_solver(rng)
+            return
+        elif self.param_engine == 'compiled':
+            self.jit_solver(np.empty((1, self.param_num_states), dtype=self.states_x.dtype), rng)
+            return
+
+        # expected values of the transitions from the states before
+        # the step, in the order of the transition table
+        if self.param_dtype == 'int64':
+            expval = self.vec_expval(self.states_x)
+        else:
+            expval = self.vec_expval(self.states_x.astype(np.float64))
         
         # Randomly generate the transition value based on the expected value
-        for eval, sind, dind in zip(expval, self.source_ind, self.dest_ind):
-            if eval < 10 and eval > 0:
-                temp1 = int(np.ceil(eval * 10 + np.finfo(np.float32).eps))
-                temp2 = eval/temp1
-                dx = self.dx_generator(temp1, temp2)
-            elif eval < 0:
-                dx = 0
-            else:
-                dx = round(eval)
-     
+        dx_arr = self.sample(expval, rng)
+        
+        for stage in self.stages:
+            self.apply_transitions(dx_arr, stage[0], stage[1])
+
+
+    def apply_transitions(self, dx_arr, start, end):
+        # transitions start..end applied one by one, in order
+        for dx, sind, dind in zip(dx_arr[start:end], self.source_ind[start:end], self.dest_ind[start:end]):
             # Apply the changes for the transitions to the 
             # corresponding source and destination states     
             temp = self.states_x[sind] - dx
@@ -550,41 +609,44 @@ def main():
     
     # check correctenes of the initialization 
     if node.check_init():
-        # create states based on the
-        # initialization parameters
-        node.create_states()
-        node.indexes()
-        
-        # create transitions based on 
-        # the created states
-        node.create_transitions()
-    
-        # create a container to store states
-        states_arr = np.zeros((node.param_num_sim, len(node.states_name)), dtype=np.float32)
-    
-        start = time.time()
-        # start simulation
-        for ind in range(node.param_num_sim):
-            states_arr[ind, :] = node.states_x
-            node.stoch_solver()
-            
-            if ind % node.param_disp_interval == 0:
-                end = time.time()
-                print("Sim.time: {:.4f} sec, Iteration: {}/{}".format(end - start, ind + 1, node.param_num_sim))
+        if node.param_engine == 'chain':
+            # compact chain model, no transitions are created
+            from covid19_chain import ChainNode
+            node = ChainNode(node)
+            node.create_chains()
+        else:
+            # create states based on the
+            # initialization parameters
+            node.create_states()
+            node.indexes()
+
+            # create transitions based on
+            # the created states
+            node.create_transitions()
+            node.vectorize()
+
+        # start simulation, only the compartment sums are kept
+        # in memory unless the trajectory goes to a file
+        if node.param_store_path:
+            recorder = node.run(MemmapRecorder(node.param_store_path))
+        else:
+            recorder = node.run(AggregateRecorder())
         
         # if visualization is enabled
         # then plot states
         if node.param_vis_on:
-            # extract all states from states array    
+            import matplotlib.pyplot as plt
+
+            # extract all states from the recorder
             time_arr = np.linspace(0, node.param_num_sim, node.param_num_sim) * node.param_dt
-            #state_sus = states_arr.dot(node.ind_sus)
-            state_exp = states_arr.dot(node.ind_exp)
-            state_inf = states_arr.dot(node.ind_inf)
-            state_iso = states_arr.dot(node.ind_iso)
-            state_sin = states_arr.dot(node.ind_sin)
-            state_qua = states_arr.dot(node.ind_qua)
-            state_imm = states_arr.dot(node.ind_imm)
-            state_dea = states_arr[:, -1]
+            #state_sus = recorder['Susceptible']
+            state_exp = recorder['Exposed']
+            state_inf = recorder['Infected']
+            state_iso = recorder['Isolated']
+            state_sin = recorder['Severe_Infected']
+            state_qua = recorder['Quarantined']
+            state_imm = recorder['Immunized']
+            state_dea = recorder['Dead']
             
             print('Inf {}, Sev Inf {}, Dead {}'.format(np.max(state_inf), np.max(state_sin), np.max(state_dea)))
         
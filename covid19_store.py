@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk store of full-resolution Node trajectories.
+
+MemmapRecorder writes the state vectors into a .npy file opened as a
+numpy.memmap, one block of steps at a time, next to a .json sidecar with
+the state names and parameters. TrajectoryStore reopens both lazily and
+reads only the requested time range and states.
+"""
+
+import json
+import numpy as np
+
+from covid19_recorder import AggregateRecorder
+
+
+def store_paths(path):
+    # data and sidecar file of a store
+    base = path[:-4] if path.endswith('.npy') else path
+    return base + '.npy', base + '.json'
+
+
+def node_params(node):
+    # parameters and initial values of a node (or of the node
+    # wrapped by a chain model) that fit in JSON
+    params = {}
+    for name, value in vars(getattr(node, 'node', node)).items():
+        if not name.startswith(('param_', 'init_')):
+            continue
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, (bool, int, float, str, type(None))):
+            params[name] = value
+
+    return params
+
+
+class MemmapRecorder(AggregateRecorder):
+    def __init__(self, path, interval=1, block_size=1024):
+        # File of the trajectory (.npy, the sidecar gets .json)
+        AggregateRecorder.__init__(self)
+        self.data_path, self.meta_path = store_paths(path)
+        # Number of steps between two stored state vectors
+        self.param_interval = interval
+        # Number of stored state vectors kept in memory before
+        # being written to the file
+        self.param_block_size = block_size
+
+
+    def start(self, node):
+        AggregateRecorder.start(self, node)
+
+        # integer states are stored exactly
+        num_rec = (node.param_num_sim - 1) // self.param_interval + 1
+        dtype = np.int64 if node.param_dtype == 'int64' else np.float32
+        self.states_arr = np.lib.format.open_memmap(self.data_path, mode='w+', dtype=dtype,
+                                                    shape=(num_rec, node.param_num_states))
+        self.block = np.zeros((self.param_block_size, node.param_num_states), dtype=dtype)
+        self.num_block = 0
+        self.num_written = 0
+
+        self.meta = {'states_name': list(node.states_name),
+                     'states_type': list(node.states_type),
+                     'dt': node.param_dt * self.param_interval,
+                     'shape': [num_rec, node.param_num_states],
+                     'num_written': 0,
+                     'params': node_params(node)}
+        self.write_meta()
+
+
+    def record(self, ind, states_x):
+        AggregateRecorder.record(self, ind, states_x)
+
+        if ind % self.param_interval == 0:
+            self.block[self.num_block] = states_x
+            self.num_block += 1
+            if self.num_block == self.param_block_size:
+                self.write_block()
+
+
+    def write_block(self):
+        # copy the block into the file and mark it as written,
+        # so a store of an interrupted run can still be read
+        end = self.num_written + self.num_block
+        self.states_arr[self.num_written:end] = self.block[:self.num_block]
+        self.states_arr.flush()
+
+        self.num_written = end
+        self.num_block = 0
+        self.meta['num_written'] = end
+        self.write_meta()
+
+
+    def write_meta(self):
+        with open(self.meta_path, 'w') as f:
+            json.dump(self.meta, f)
+
+
+    def finish(self):
+        self.write_block()
+        del self.states_arr
+
+
+class TrajectoryStore:
+    def __init__(self, path):
+        self.data_path, self.meta_path = store_paths(path)
+
+        with open(self.meta_path) as f:
+            self.meta = json.load(f)
+
+        self.states_name = self.meta['states_name']
+        self.states_type = self.meta['states_type']
+        self.params = self.meta['params']
+        self.param_dt = self.meta['dt']
+
+        # nothing is read until the states are sliced
+        self.states_arr = np.load(self.data_path, mmap_mode='r')[:self.meta['num_written']]
+        self.time = np.arange(len(self.states_arr)) * self.param_dt
+
+
+    def __len__(self):
+        return len(self.states_arr)
+
+
+    def states_index(self, states):
+        # indices of the states given by exact names or by the name
+        # of a chain, e.g. 'Infected' for Infected_1..Infected_n
+        if isinstance(states, str):
+            states = [states]
+
+        ind = []
+        for name in states:
+            found = [count for count, state in enumerate(self.states_name)
+                     if state == name or state.startswith(name + '_')]
+            if not found:
+                raise ValueError('Unknown state: {}'.format(name))
+            ind += found
+
+        return np.asarray(ind)
+
+
+    def slice(self, start=None, end=None, states=None):
+        # time (in days) and states of the steps within [start, end),
+        # optionally restricted to some states or chains
+        first = 0 if start is None else int(np.ceil(start / self.param_dt - 1e-9))
+        last = len(self) if end is None else int(np.ceil(end / self.param_dt - 1e-9))
+        first, last = max(first, 0), min(last, len(self))
+
+        if states is None:
+            return self.time[first:last], np.asarray(self.states_arr[first:last])
+
+        ind = self.states_index(states)
+        if np.all(np.diff(ind) == 1):
+            return self.time[first:last], np.asarray(self.states_arr[first:last, ind[0]:ind[-1] + 1])
+        return self.time[first:last], np.asarray(self.states_arr[first:last][:, ind])
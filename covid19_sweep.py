@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over Node scenarios.
+
+Every scenario is a dictionary of Node parameters. Scenarios are run in
+chunks on a process pool (or serially for debugging) and reduced to a
+few numbers each, collected into one columnar result.
+"""
+
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from covid19_recorder import AggregateRecorder
+from covid19_simulator_v2 import Node
+
+
+# Reduced outputs of every scenario
+OUTPUTS = ['peak_infected', 'peak_severe', 'final_dead', 'day_capacity_exceeded']
+
+
+def make_grid(**params):
+    # cartesian product of parameter values, e.g.
+    # make_grid(param_beta_exp=[0.1, 0.2], param_qr=[0.01, 0.02])
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*params.values())]
+
+
+def stream(scenario, seed, run):
+    # root seed and run of the random stream of a scenario, the
+    # ones of the sweep unless the scenario sets its own
+    return scenario.get('param_seed', seed), scenario.get('param_run', run)
+
+
+def run_scenario(scenario, seed, run):
+    # run one scenario and reduce it to the sweep outputs
+    node = Node()
+    node.param_engine = 'vectorized'
+    node.param_vis_on = 0
+    node.param_disp_interval = 0
+    node.param_seed, node.param_run = stream(scenario, seed, run)
+    node.set_params(scenario)
+
+    # the node reports every stage on stdout, keep workers quiet
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not node.check_init():
+            return dict.fromkeys(OUTPUTS, np.nan)
+        node.create_states()
+        node.indexes()
+        node.create_transitions()
+        node.vectorize()
+
+    recorder = node.run(AggregateRecorder())
+    state_sin = recorder['Severe_Infected']
+
+    # the solver switches to gamma_mor2 once the load reaches the capacity
+    over = np.flatnonzero(state_sin >= node.param_hosp_capacity)
+    day_over = recorder.time[over[0]] if len(over) else np.nan
+
+    return {'peak_infected': float(recorder['Infected'].max()),
+            'peak_severe': float(state_sin.max()),
+            'final_dead': float(node.states_x[-1]),
+            'day_capacity_exceeded': float(day_over)}
+
+
+def run_chunk(chunk):
+    # worker entry point: chunk is a list of (index, scenario, seed)
+    return [(ind, run_scenario(scenario, seed, ind)) for ind, scenario, seed in chunk]
+
+
+class Sweep:
+    def __init__(self, scenarios, seed=1):
+        # List of scenario dictionaries (see make_grid)
+        self.scenarios = list(scenarios)
+        # Root seed, scenario i draws from the stream of run i
+        # (see covid19_rng.py) unless it sets param_seed or param_run
+        self.param_seed = seed
+        # Number of worker processes (None uses all cores)
+        self.param_workers = None
+        # Number of scenarios sent to a worker at once
+        self.param_chunksize = 8
+        # Run in the calling process instead of the pool
+        self.param_serial = False
+        # Append-only file of finished scenarios to resume from
+        self.param_checkpoint = None
+        # Called as progress(done, total) after every chunk
+        self.progress = self.print_progress
+
+        self.results = {}
+
+
+    def print_progress(self, done, total):
+        print("Sweep: {}/{} scenarios, {:.1f} sec".format(done, total, time.time() - self.start))
+
+
+    def load_checkpoint(self):
+        # read the scenarios finished by an earlier run
+        if self.param_checkpoint is None or not os.path.exists(self.param_checkpoint):
+            return
+
+        with open(self.param_checkpoint) as f:
+            header = json.loads(f.readline())
+            if header != self.checkpoint_header():
+                raise ValueError('Checkpoint {} belongs to another sweep'.format(self.param_checkpoint))
+            for line in f:
+                # a run killed while writing leaves a partial last line
+                try:
+                    ind, outputs = json.loads(line)
+                except ValueError:
+                    break
+                self.results[ind] = outputs
+
+        print("[INFO] {} scenarios loaded from checkpoint...".format(len(self.results)))
+
+
+    def checkpoint_header(self):
+        # a checkpoint only resumes the same scenarios with the same
+        # random streams
+        digest = hashlib.sha1(json.dumps(self.scenarios, sort_keys=True, default=str).encode()).hexdigest()
+        streams = [stream(scenario, self.param_seed, ind) for ind, scenario in enumerate(self.scenarios)]
+        streams = hashlib.sha1(json.dumps(streams, default=str).encode()).hexdigest()
+        return {'num_scenarios': len(self.scenarios), 'seed': self.param_seed, 'scenarios': digest,
+                'streams': streams}
+
+
+    def save_checkpoint(self, done):
+        if self.param_checkpoint is None:
+            return
+
+        new_file = not os.path.exists(self.param_checkpoint)
+        with open(self.param_checkpoint, 'a') as f:
+            if new_file:
+                f.write(json.dumps(self.checkpoint_header()) + '\n')
+            for ind, outputs in done:
+                f.write(json.dumps([ind, outputs]) + '\n')
+
+
+    def run(self):
+        self.start = time.time()
+        self.results = {}
+        self.load_checkpoint()
+
+        # the random stream of a scenario is keyed by its index, so
+        # results do not depend on chunking or number of workers
+        todo = [(ind, scenario, self.param_seed) for ind, scenario in enumerate(self.scenarios)
+                if ind not in self.results]
+        chunks = [todo[ind:ind + self.param_chunksize]
+                  for ind in range(0, len(todo), self.param_chunksize)]
+
+        if self.param_serial:
+            for chunk in chunks:
+                self.collect(run_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=self.param_workers) as executor:
+                futures = [executor.submit(run_chunk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    self.collect(future.result())
+
+        return self.columns()
+
+
+    def collect(self, done):
+        for ind, outputs in done:
+            self.results[ind] = outputs
+        self.save_checkpoint(done)
+        self.progress(len(self.results), len(self.scenarios))
+
+
+    def columns(self):
+        # one array per parameter and per output, in scenario order
+        columns = {'index': np.arange(len(self.scenarios))}
+
+        names = []
+        for scenario in self.scenarios:
+            names += [name for name in scenario if name not in names]
+        for name in names:
+            columns[name] = np.array([scenario.get(name, np.nan) for scenario in self.scenarios])
+
+        for name in OUTPUTS:
+            columns[name] = np.array([self.results[ind][name] for ind in range(len(self.scenarios))],
+                                     dtype=np.float64)
+
+        return columns
+
+
+def main():
+    # sweep the transmission and quarantine rates
+    scenarios = make_grid(param_beta_exp=[0.05, 0.1, 0.15, 0.2],
+                          param_qr=[0.0, 0.02, 0.05])
+    sweep = Sweep(scenarios)
+    columns = sweep.run()
+
+    print('beta_exp  qr    peak_inf  peak_sev  dead  day_over')
+    for ind in columns['index']:
+        print('{:<9} {:<5} {:<9.0f} {:<9.0f} {:<5.0f} {}'.format(
+            columns['param_beta_exp'][ind], columns['param_qr'][ind],
+            columns['peak_infected'][ind], columns['peak_severe'][ind],
+            columns['final_dead'][ind], columns['day_capacity_exceeded'][ind]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive tau-leap engine on the chains of covid19_chain.py.
+
+The Erlang stages keep their length (set by param_dt), but one leap
+advances m sampling times at once. Every chain is part of a lane in
+which a cohort moves by one slot per sampling time: Exposed followed by
+Infected, Quarantined followed by Isolated, Severe_Infected, and
+Vaccinated. Since a side exit (quarantine, severe infection) lands one
+slot further in a lane moving at the same pace, a cohort at slot q ends
+at slot q + m whether it left its lane or not; only the number of steps
+spent where the side exit applies changes its probability. New cohorts
+from Susceptible arrive at a uniformly drawn step of the leap. The last
+slot of a lane hands its outcomes out step by step, as the fixed-step
+engines do.
+
+During a leap the hospital switch keeps its value from the start of the
+leap and the force of infection the one of the infection pressure at its
+middle, extrapolated from the change over the last leap. The leap grows
+while the infection pressure changes slowly. A leap is a single step of
+ChainNode.stoch_solver, as in the fixed-step engines, when few
+individuals are infectious, when the number of Severe Infected comes
+close to the hospital capacity, or when more than param_max_sparse of
+the individuals of the chains are in slots holding fewer than 10 of
+them: such slots pass on a random number of individuals per step and
+a lone one often stays behind, which slows the chains down. Checked by
+benchmarks/bench_tauleap.py against the vectorized engine.
+States are reported on a regular grid of param_output_interval steps.
+"""
+
+import numpy as np
+import time
+
+from covid19_chain import ChainNode
+from covid19_recorder import COMPARTMENTS, compartment_matrix
+from covid19_simulator_v2 import Node
+
+
+def overlap(first, last, lo, hi):
+    # number of positions of [first, last) within [lo, hi)
+    return np.clip(np.minimum(last, hi) - np.maximum(first, lo), 0, None)
+
+
+class TauLeapNode(ChainNode):
+    def __init__(self, node):
+        ChainNode.__init__(self, node)
+        # Bound on the relative change of the infection pressure
+        # and of Susceptible during one leap
+        self.param_eps = 0.03
+        # Below this number of infectious individuals every leap
+        # is a single step
+        self.param_min_count = 100
+        # Largest share of the individuals of the chains in slots
+        # holding fewer than 10 of them for a leap of several steps
+        self.param_max_sparse = 0.01
+        # Number of steps between two reported states (None is one day),
+        # also the longest leap
+        self.param_output_interval = None
+        # Aggregated compartments
+        self.compartments = COMPARTMENTS
+
+        self.num_leaps = 0
+
+
+    def create_chains(self):
+        # individuals are moved by binomial thinning, the
+        # states are always integer counts
+        self.node.param_dtype = 'int64'
+        ChainNode.create_chains(self)
+        self.rng = self.node.rng
+
+        if self.param_output_interval is None:
+            self.param_output_interval = max(1, round(1 / self.param_dt))
+
+        self.ind_comp = compartment_matrix(self)
+
+
+    def leap_size(self, max_size):
+        # number of steps of the next leap
+        x = self.states_x
+        pressure, states_sin = self.loads(x)
+        infectious = x[self.sl_exp.start:self.sl_sin.stop].sum()
+        if infectious < self.param_min_count:
+            return 1
+
+        # slots holding fewer than 10 individuals pass a random number
+        # of them on at every step (the binomial draws of Node.sample),
+        # and a lone individual often stays behind; leaps move the
+        # cohorts by one slot per step
+        chains = x[self.sl_vac.start:self.sl_sin.stop]
+        if chains[chains < 10].sum() > self.param_max_sparse * chains.sum():
+            return 1
+
+        size = min(max_size, 2 * self.last_size)
+
+        # relative change of Susceptible per step
+        total_pop = x[1:-1].sum()
+        hazard = (self.param_beta_exp + self.param_beta_inf) * pressure / total_pop + self.param_vr
+        if hazard > 0:
+            size = min(size, int(self.param_eps / (hazard * self.param_dt)))
+
+        # relative change of the infection pressure and distance to
+        # the hospital capacity, from the rates of the last leap
+        last_pressure, last_sin = self.last_loads
+        rate = abs(pressure - last_pressure) / self.last_size / max(pressure, 1)
+        if rate > 0:
+            size = min(size, int(self.param_eps / rate))
+        rate = abs(states_sin - last_sin) / self.last_size
+        gap = abs(self.param_hosp_capacity - states_sin)
+        if rate * size > gap:
+            size = min(size, int(gap / rate))
+
+        return max(1, size)
+
+
+    def leap(self, size):
+        if size == 1:
+            # a single step is the one of the fixed-step engines
+            self.last_loads = self.loads(self.states_x)
+            self.last_size = 1
+            ChainNode.stoch_solver(self)
+            return
+
+        rng = self.rng
+        dt = self.param_dt
+        x = self.states_x
+        n_exp = self.param_n_exp
+        n_inf = self.param_n_inf
+
+        # hospital load at the start of the leap, infection pressure
+        # at its middle (extrapolated from the last leap)
+        total_pop = x[1:-1].sum()
+        pressure, states_sin = self.loads(x)
+        last_pressure, _ = self.last_loads
+        self.last_loads = (pressure, states_sin)
+        pressure = max(pressure + (pressure - last_pressure) / self.last_size * (size - 1) / 2, 0)
+        self.last_size = size
+
+        # Transition 3 - natural mortality over the whole leap
+        y = x.copy()
+        dea = rng.binomial(y[1:-1], 1 - (1 - self.param_dr * dt) ** size)
+        y[1:-1] -= dea
+        y[-1] += dea.sum()
+
+        # Transitions 4, 8 and 9 - out of Susceptible, at a
+        # uniformly drawn step of the leap
+        rates = np.array([self.param_vr * dt if len(y[self.sl_vac]) else 0,
+                          self.param_beta_exp * pressure * dt / total_pop if n_exp != 0 else 0,
+                          self.param_beta_inf * pressure * dt / total_pop])
+        hazard = min(rates.sum(), 1)
+        leave = rng.binomial(max(y[1], 0), 1 - (1 - hazard) ** size) if hazard > 0 else 0
+        new_vac, new_exp, new_inf = rng.multinomial(leave, rates / rates.sum()) if leave else (0, 0, 0)
+        y[1] -= leave
+        arrival = -1 - np.arange(size)
+        uniform = np.full(size, 1 / size)
+
+        # outcomes at the end of the lanes (Transitions 6-7, 20-27)
+        gamma_im = self.param_gamma_im
+        gamma_mor = self.param_gamma_mor
+        if states_sin < self.param_hosp_capacity:
+            gamma_mor_sin = self.param_gamma_mor1
+        else:
+            gamma_mor_sin = self.param_gamma_mor2
+        outcomes_vac = [(self.ind_vim, self.param_vir), (1, 1 - self.param_dr * dt - self.param_vir)] \
+                       if self.param_vr != 0 else []
+        outcomes_inf = [(self.ind_rim, gamma_im), (1, (1 - gamma_mor) * (1 - gamma_im)), (-1, gamma_mor)]
+        outcomes_iso = [(self.ind_rim, gamma_im), (1, (1 - gamma_mor) * (1 - gamma_im))]
+        outcomes_sin = [(self.ind_rim, (1 - gamma_mor_sin) * gamma_im),
+                        (1, (1 - gamma_mor_sin) * (1 - gamma_im)), (-1, gamma_mor_sin)]
+
+        # Vaccinated lane
+        lane_vac = np.zeros(len(y[self.sl_vac]), dtype=np.int64)
+        end_vac = np.zeros(size + 1, dtype=np.int64)
+        if len(lane_vac):
+            count = np.concatenate((y[self.sl_vac], rng.multinomial(new_vac, uniform)))
+            first = np.concatenate((np.arange(len(lane_vac)), arrival))
+            end_vac = self.place(lane_vac, first + size, count, size)
+
+        # Exposed + Infected lane, with new Exposed arriving before
+        # its first slot and new Infected before its Infected part
+        len_lane = n_exp + n_inf
+        count = np.concatenate((y[self.sl_exp], y[self.sl_inf],
+                                rng.multinomial(new_exp, uniform),
+                                rng.multinomial(new_inf, uniform)))
+        first = np.concatenate((np.arange(len_lane), arrival, n_exp + arrival))
+        exposed = np.arange(len(count)) < len_lane + size
+
+        # Transitions 12 and 18 - side exits over the steps spent in
+        # the Exposed and Infected slots that have one
+        steps_qua = overlap(first, first + size, 0, n_exp - 1) * exposed
+        steps_sin = overlap(first, first + size, n_exp, len_lane - 1)
+        to_sin = rng.binomial(count, 1 - (1 - self.param_sir * dt) ** steps_sin)
+        count -= to_sin
+        to_qua = rng.binomial(count, 1 - (1 - self.param_qr * dt) ** steps_qua)
+        count -= to_qua
+
+        lane_exp = np.zeros(len_lane, dtype=np.int64)
+        lane_qua = np.zeros(len_lane, dtype=np.int64)
+        lane_sin = np.zeros(n_inf, dtype=np.int64)
+        end_exp = self.place(lane_exp, first + size, count, size)
+        end_qua = self.place(lane_qua, first + size, to_qua, size)
+        end_sin = self.place(lane_sin, first + size - n_exp, to_sin, size)
+
+        # Quarantined + Isolated lane, Transition 19
+        count = np.concatenate((y[self.sl_qua], y[self.sl_iso]))
+        first = np.arange(len_lane)
+        steps_sin = overlap(first, first + size, n_exp, len_lane - 1)
+        to_sin = rng.binomial(count, 1 - (1 - self.param_sir * dt) ** steps_sin)
+        end_qua += self.place(lane_qua, first + size, count - to_sin, size)
+        end_sin += self.place(lane_sin, first + size - n_exp, to_sin, size)
+
+        # Severe_Infected lane
+        first = np.arange(n_inf)
+        end_sin += self.place(lane_sin, first + size, y[self.sl_sin], size)
+
+        for lane, end, outcomes in [(lane_vac, end_vac, outcomes_vac), (lane_exp, end_exp, outcomes_inf),
+                                    (lane_qua, end_qua, outcomes_iso), (lane_sin, end_sin, outcomes_sin)]:
+            if len(lane):
+                self.lane_end(y, lane, end, outcomes)
+
+        y[self.sl_vac] = lane_vac
+        y[self.sl_exp], y[self.sl_inf] = lane_exp[:n_exp], lane_exp[n_exp:]
+        y[self.sl_qua], y[self.sl_iso] = lane_qua[:n_exp], lane_qua[n_exp:]
+        y[self.sl_sin] = lane_sin
+        self.states_x = y
+
+
+    def place(self, lane, last, count, size):
+        # put the cohorts ending at the slots in last into the lane and
+        # return the number of individuals in its last slot at the start
+        # of k steps of the leap, for k = 0..size, the ones that reach it
+        # (cohorts that cannot reach the lane are empty and
+        # may point before its first slot)
+        end = len(lane) - 1
+        last = np.maximum(last, 0)
+        inside = last < end
+        lane += np.bincount(last[inside], weights=count[inside], minlength=len(lane)).astype(np.int64)
+        return np.bincount(last[~inside] - end, weights=count[~inside], minlength=size + 1).astype(np.int64)
+
+
+    def lane_end(self, y, lane, end, outcomes):
+        # outcomes (destination, probability per step) of the last slot
+        # of a lane, step by step as in the fixed-step engines: they are
+        # drawn independently from the content of the slot at the start
+        # of the step and handed out in order up to what the slot holds
+        # with the arrivals of the step, the rest stays in the slot
+        size = len(end) - 1
+        content = end[size]
+        if not outcomes:
+            lane[-1] += end.sum()
+            return
+
+        prob = np.array([val for _, val in outcomes])
+        flows = np.zeros(len(outcomes), dtype=np.int64)
+        for arrivals in end[size - 1::-1]:
+            draws = self.node.sample(content * prob)
+            held = content + arrivals
+            taken = np.minimum(np.cumsum(draws), held)
+            flows += np.diff(taken, prepend=0)
+            content = held - taken[-1]
+
+        lane[-1] += content
+        for (dest, _), val in zip(outcomes, flows):
+            y[dest] += val
+
+
+    def run(self):
+        # leaps never cross a reported step
+        interval = self.param_output_interval
+        num_out = (self.param_num_sim - 1) // interval + 1
+        comp_arr = np.zeros((num_out, len(self.compartments)))
+
+        self.num_leaps = 0
+        self.last_size = 1
+        self.last_loads = self.loads(self.states_x)
+
+        start = time.time()
+        step = 0
+        for ind in range(num_out):
+            comp_arr[ind] = self.states_x @ self.ind_comp
+            if ind == num_out - 1:
+                break
+
+            while step < (ind + 1) * interval:
+                size = self.leap_size((ind + 1) * interval - step)
+                self.leap(size)
+                step += size
+                self.num_leaps += 1
+
+        if self.param_disp_interval:
+            print("Sim.time: {:.4f} sec, Steps: {}, Leaps: {}".format(time.time() - start, step, self.num_leaps))
+
+        results = {'time': np.arange(num_out) * interval * self.param_dt}
+        for ind, name in enumerate(self.compartments):
+            results[name] = comp_arr[:, ind]
+
+        return results
+
+
+def main():
+    # initialize a new node and run it with adaptive leaps
+    node = Node()
+    node.param_vis_on = 0
+
+    if node.check_init():
+        tau_node = TauLeapNode(node)
+        tau_node.create_chains()
+        results = tau_node.run()
+
+        print('Inf {}, Sev Inf {}, Dead {}'.format(np.max(results['Infected']),
+                                                   np.max(results['Severe_Infected']),
+                                                   np.max(results['Dead'])))
+
+
+if __name__ == "__main__":
+    main()
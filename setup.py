@@ -12,7 +12,7 @@ setup(
     version='0.0.1',
     entry_points={
         'console_scripts': [
-            'covid19_simulator=covid19_simulator:main'
+            'covid19_simulator=covid19_cli:main'
         ]
     }
 )
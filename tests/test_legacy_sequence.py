@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The call sequence of the first versions of the simulator, without
+vectorize, gives the run of the current one.
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_recorder import AggregateRecorder
+from covid19_simulator_v2 import Node
+
+
+def make_node():
+    node = Node()
+    node.param_vis_on = 0
+    node.param_disp_interval = 0
+    node.set_params({'param_sim_len': 20})
+    node.create_states()
+    node.indexes()
+    node.create_transitions()
+    return node
+
+
+def test_stoch_solver_without_vectorize():
+    legacy = make_node()
+    states = [legacy.states_x.copy()]
+    for _ in range(legacy.param_num_sim - 1):
+        legacy.stoch_solver()
+        states.append(legacy.states_x.copy())
+
+    current = make_node()
+    current.vectorize()
+    recorder = current.run(AggregateRecorder())
+
+    assert np.array_equal(np.array(states) @ recorder.ind_comp, recorder.aggregates)
+
+
+def test_run_without_vectorize():
+    node = make_node()
+    recorder = node.run(AggregateRecorder())
+    assert len(recorder.aggregates) == node.param_num_sim